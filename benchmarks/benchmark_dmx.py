@@ -0,0 +1,371 @@
+# Benchmarks for the DMX processing in session_presets.py against synthetic keyvalues2 sessions
+# Sessions are modeled on default_startup_sessions.dmx (film clips with animation sets, channels and float logs with keys)
+# and generated once per size into the work directory, then every stage runs in its own process so peak RSS is per stage
+#
+# Usage:
+#   python benchmarks/benchmark_dmx.py --sizes 1,10,100,1000 --output results.json
+#   python benchmarks/benchmark_dmx.py --baseline results.json --output new_results.json
+# Results are keyed by "stage@sizeMB" so runs of the same sizes can be compared, --baseline prints the change per stage
+# and exits with 1 when a stage got slower than --threshold times its baseline
+
+import argparse, json, os, subprocess, sys, tempfile, time, platform, hashlib
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+benchmark_path = os.path.abspath(__file__)
+benchmarks_directory = os.path.dirname(benchmark_path)
+script_path = os.path.join(benchmarks_directory, "..", "scripts", "sfm", "autoinit", "session_presets.py")
+sys.path.insert(0, benchmarks_directory)
+import standins
+
+stages = ["probe_name", "probe_framerate", "probe_metadata", "patch", "retime", "snap_numpy", "snap_array", "element_index", "document", "custom_session", "default_session"]
+results_version = 1
+
+def load_script():
+    return standins.load(os.path.abspath(script_path))
+
+def peak_rss():
+    # Peak resident set size of this process in bytes
+    try:
+        import resource
+    except ImportError:
+        import ctypes
+        from ctypes import wintypes
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)
+            ]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def document_memory(module, session_path):
+    # Memory a loaded document holds, and the most it held while loading, as multiples of the file size
+    # Counted by tracemalloc on its own load so the timed one isn't slowed down. Peak RSS can't be used for this,
+    # at small sizes it's mostly the interpreter and the script
+    if tracemalloc is None:
+        return "memory not measured without tracemalloc"
+    tracemalloc.start()
+    try:
+        document = module.SessionPresetsDocument(session_path)
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    size = float(os.path.getsize(session_path))
+    return "%.2fx file size held, %.2fx at peak while loading" % (held / size, peak / size)
+
+def session_times(module, session_path):
+    # Time arrays of every log layer in a session, read the way the retime pass reads them
+    with module._session_presets_open_dmx(session_path) as f:
+        return [event[3] for event in module._session_presets_kv2_events(f, typed=module._session_presets_retime_typed) if event[0] == "array" and event[2] == "time_array"]
+
+class SyntheticSession:
+    # Writes a synthetic session through the script's own keyvalues2 writer until it's at least target_bytes long
+    # Ids are derived from a counter so the same arguments always give the same file
+    keys_per_layer = 100
+    channels_per_set = 24
+    def __init__(self, module, target_bytes):
+        self.module = module
+        self.target_bytes = target_bytes
+        self.written = 0
+        self.next_id = 0
+        self.file = None
+        self.writer = None
+    def new_id(self):
+        self.next_id += 1
+        return "%08x-0000-4000-8000-%012x" % (self.next_id >> 48, self.next_id & 0xffffffffffff)
+    def write(self, text):
+        self.written += len(text)
+        self.file.write(text)
+    def emit(self, *event):
+        self.writer.write_event(event)
+    def begin(self, element_type, name, attribute=None, element_id=None):
+        element_id = element_id or self.new_id()
+        self.emit("begin", element_type, attribute)
+        self.emit("attribute", "id", "elementid", element_id)
+        self.emit("attribute", "name", "string", name)
+        return element_id
+    def time_frame(self):
+        self.begin("DmeTimeFrame", "timeFrame", "timeFrame")
+        self.emit("attribute", "start", "time", "0")
+        self.emit("attribute", "duration", "time", "60")
+        self.emit("attribute", "offset", "time", "0")
+        self.emit("attribute", "scale", "float", "1")
+        self.emit("end", "DmeTimeFrame")
+    def channel(self, set_index, channel_index):
+        self.begin("DmeChannel", "channel_%d_%d" % (set_index, channel_index))
+        self.emit("attribute", "fromElement", "element", "")
+        self.emit("attribute", "fromAttribute", "string", "value")
+        self.emit("attribute", "toAttribute", "string", "value")
+        self.emit("attribute", "mode", "int", "3")
+        self.begin("DmeFloatLog", "float log", "log")
+        self.emit("array_begin", "layers", "element_array")
+        self.begin("DmeFloatLogLayer", "float log")
+        keys = range(self.keys_per_layer)
+        self.emit("array", "times", "time_array", ["%.4f" % (key / 24.0) for key in keys])
+        self.emit("array", "curvetypes", "int_array", ["0" for key in keys])
+        self.emit("array", "values", "float_array", [self.module._session_presets_format_float(((key * 7 + channel_index) % 100) / 100.0) for key in keys])
+        self.emit("end", "DmeFloatLogLayer")
+        self.emit("array_end", "layers")
+        self.emit("attribute", "usedefaultvalue", "bool", "0")
+        self.emit("attribute", "defaultvalue", "float", "0")
+        self.emit("end", "DmeFloatLog")
+        self.emit("end", "DmeChannel")
+    def clip(self, name, clip_id, target_bytes, attribute=None):
+        # Film clip with as many animation sets as it takes to write target_bytes
+        start = self.written
+        self.begin("DmeFilmClip", name, attribute, clip_id)
+        self.time_frame()
+        self.emit("attribute", "frameRate", "float", "24")
+        self.emit("attribute", "mapname", "string", "maps/stage.bsp")
+        self.emit("attribute", "text", "string", "Synthetic benchmark session")
+        self.emit("array_begin", "animationSets", "element_array")
+        set_index = 0
+        while self.written - start < target_bytes:
+            self.begin("DmeAnimationSet", "animationSet_%d" % set_index)
+            self.emit("array_begin", "channels", "element_array")
+            for channel_index in range(self.channels_per_set):
+                self.channel(set_index, channel_index)
+            self.emit("array_end", "channels")
+            self.emit("end", "DmeAnimationSet")
+            set_index += 1
+        self.emit("array_end", "animationSets")
+        self.emit("end", "DmeFilmClip")
+    def settings(self):
+        self.begin("DmElement", "sessionSettings", "settings")
+        self.begin("DmeTimeSelection", "timeSelection", "timeSelection")
+        self.emit("attribute", "enabled", "bool", "0")
+        self.emit("end", "DmeTimeSelection")
+        self.emit("end", "DmElement")
+    def write_session(self, path):
+        # A saved session: the root's active clip holds everything
+        with self.module._session_presets_open_dmx(path, "w") as f:
+            self.file = f
+            self.writer = self.module._SessionPresetsKV2Writer(self.write)
+            self.emit("header", "dmx encoding keyvalues2 1 format sfm_session 20")
+            self.begin("DmElement", "session")
+            clip_id = self.new_id()
+            self.clip("synthetic", clip_id, self.target_bytes, "activeClip")
+            self.emit("array_begin", "clipBin", "element_array")
+            self.emit("reference", clip_id)
+            self.emit("array_end", "clipBin")
+            self.settings()
+            self.emit("end", "DmElement")
+        self.file = None
+    def write_defaults(self, path, title, defaults):
+        # Laid out like default_startup_sessions.dmx: one clip per default preset in the root's defaults, plus their ids
+        with self.module._session_presets_open_dmx(path, "w") as f:
+            self.file = f
+            self.writer = self.module._SessionPresetsKV2Writer(self.write)
+            self.emit("header", "dmx encoding keyvalues2 1 format sfm_session 20")
+            self.begin("DmElement", title)
+            self.emit("attribute", "activeClip", "element", defaults[0]["id"])
+            self.emit("array_begin", "clipBin", "element_array")
+            self.emit("array_end", "clipBin")
+            self.emit("array_begin", "defaults", "element_array")
+            for default in defaults:
+                self.clip(default["name"], default["id"], self.target_bytes // len(defaults))
+            self.emit("array_end", "defaults")
+            self.emit("array", "ids", "string_array", [default["id"] for default in defaults])
+            self.settings()
+            self.emit("end", "DmElement")
+        self.file = None
+
+def session_presets(module, work_directory):
+    # Headless SessionPresets keeping its options and caches in the work directory
+    os.chdir(work_directory)
+    return module.SessionPresets(headless=True)
+
+def generate(module, work_directory, size_mb):
+    # Returns the session and default sessions paths for size_mb, writing them if they don't exist yet
+    session_path = os.path.join(work_directory, "session_%dmb.dmx" % size_mb)
+    defaults_path = os.path.join(work_directory, "defaults_%dmb.dmx" % size_mb)
+    target_bytes = size_mb * 1024 * 1024
+    if not os.path.isfile(session_path):
+        started = time.time()
+        SyntheticSession(module, target_bytes).write_session(session_path + ".tmp")
+        os.rename(session_path + ".tmp", session_path)
+        print("Generated %s in %.1f seconds" % (session_path, time.time() - started))
+    if not os.path.isfile(defaults_path):
+        started = time.time()
+        presets = session_presets(module, work_directory)
+        SyntheticSession(module, target_bytes).write_defaults(defaults_path + ".tmp", presets.default_session_title, presets.registry.defaults)
+        os.rename(defaults_path + ".tmp", defaults_path)
+        print("Generated %s in %.1f seconds" % (defaults_path, time.time() - started))
+    return session_path, defaults_path
+
+def run_stage(stage, session_path, defaults_path, work_directory):
+    # Runs a single stage in this process, returns its timing and memory use
+    module = load_script()
+    presets = session_presets(module, work_directory)
+    # Start every stage cold, without metadata from earlier runs
+    presets.metadata_cache.entries = {}
+    output_path = os.path.join(work_directory, "output.dmx")
+    index_path = os.path.join(work_directory, "output.index")
+    input_path = defaults_path if stage == "default_session" else session_path
+    if stage in ("snap_numpy", "snap_array"):
+        # Only snapping is timed, one call per layer like the retime pass. snap_array is the path SFM's Python takes
+        if stage == "snap_array":
+            module.numpy = None
+        layers = session_times(module, session_path)
+    rss_before = peak_rss()
+    started = time.time()
+    if stage == "probe_name":
+        result = presets.get_name_from_dmx(session_path)
+    elif stage == "probe_framerate":
+        result = presets.get_framerate_from_dmx(session_path)
+    elif stage == "probe_metadata":
+        result = module._session_presets_probe_dmx(session_path)["element_counts"]
+    elif stage == "patch":
+        result = presets.replace_name_and_framerate_in_dmx(session_path, "synthetic", "benchmark", 24.0, 30.0, output_path)
+    elif stage == "retime":
+        result = module._session_presets_retime_dmx(session_path, output_path, 30.0, 24.0)[0]["keys"]
+    elif stage == "snap_numpy" and module.numpy is None:
+        result = None
+    elif stage in ("snap_numpy", "snap_array"):
+        result = 0
+        for times in layers:
+            module._session_presets_snap_times(times, 30.0, 24.0)
+            result += len(times)
+    elif stage == "element_index":
+        index = module.SessionPresetsElementIndex(session_path, index_path)
+        index.build()
+        index.close()
+        result = len(index.elements)
+    elif stage == "document":
+        result = len(module.SessionPresetsDocument(session_path).elements)
+    elif stage == "custom_session":
+        presets.registry.set_customs([{"name": "Synthetic", "order": 0, "description": "", "path": session_path}])
+        result = presets.create_session(len(presets.registry.defaults) + 1, 30.0, "benchmark", work_directory)
+    elif stage == "default_session":
+        presets.default_sessions_override = defaults_path
+        result = presets.create_session(1, 30.0, "benchmark", work_directory)
+    else:
+        raise ValueError("Unknown stage %s" % stage)
+    seconds = time.time() - started
+    if stage == "document":
+        result = "%d elements, %s" % (result, document_memory(module, session_path))
+    elif stage in ("retime", "snap_numpy", "snap_array"):
+        result = "numpy not installed" if result is None else "%d keys, %.2fM keys/s" % (result, result / 1000000.0 / max(seconds, 0.000001))
+    for path in (output_path, index_path):
+        if os.path.isfile(path):
+            os.remove(path)
+    return {
+        "seconds": seconds,
+        "peak_rss": peak_rss(),
+        "peak_rss_before": rss_before,
+        "input_bytes": os.path.getsize(input_path),
+        "result": str(result)
+    }
+
+def run_stage_process(stage, session_path, defaults_path, work_directory):
+    output = subprocess.check_output([sys.executable, benchmark_path, "--run-stage", stage, "--session", session_path, "--defaults", defaults_path, "--work-dir", work_directory])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+def script_hash():
+    with open(script_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def compare(results, baseline, threshold):
+    # Print each stage's change against the baseline, returns the keys that got slower than threshold times the baseline
+    regressions = []
+    for key in sorted(results["results"].keys()):
+        previous = baseline.get("results", {}).get(key)
+        if not previous:
+            print("%-28s %10.3f s   (not in baseline)" % (key, results["results"][key]["seconds"]))
+            continue
+        current = results["results"][key]
+        ratio = current["seconds"] / max(previous["seconds"], 0.000001)
+        rss_ratio = float(current["peak_rss"]) / max(previous["peak_rss"], 1)
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print("%-28s %10.3f s  x%.2f   peak RSS x%.2f%s" % (key, current["seconds"], ratio, rss_ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session_presets.py DMX processing against synthetic sessions")
+    parser.add_argument("--sizes", default="1,10,100,1000", help="Comma separated session sizes in MB")
+    parser.add_argument("--stages", default=",".join(stages), help="Comma separated stages to run: %s" % ", ".join(stages))
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the median wall time is recorded")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "session_presets_benchmark"), help="Where synthetic sessions are generated and kept between runs")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results from an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown against the baseline that counts as a regression")
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--session", help=argparse.SUPPRESS)
+    parser.add_argument("--defaults", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    work_directory = os.path.abspath(args.work_dir)
+    if not os.path.isdir(work_directory):
+        os.makedirs(work_directory)
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage, args.session, args.defaults, work_directory)))
+        return 0
+
+    module = load_script()
+    selected_stages = [stage for stage in args.stages.split(",") if stage]
+    results = {
+        "version": results_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "script_sha1": script_hash(),
+        "repeat": args.repeat,
+        "results": {}
+    }
+    for size_mb in [int(size) for size in args.sizes.split(",") if size]:
+        session_path, defaults_path = generate(module, work_directory, size_mb)
+        for stage in selected_stages:
+            runs = [run_stage_process(stage, session_path, defaults_path, work_directory) for i in range(max(1, args.repeat))]
+            seconds = median([run["seconds"] for run in runs])
+            input_bytes = runs[0]["input_bytes"]
+            result = {
+                "size_mb": size_mb,
+                "input_bytes": input_bytes,
+                "seconds": seconds,
+                "runs": [run["seconds"] for run in runs],
+                "peak_rss": max([run["peak_rss"] for run in runs]),
+                "peak_rss_before": max([run["peak_rss_before"] for run in runs]),
+                "mb_per_s": input_bytes / 1048576.0 / max(seconds, 0.000001)
+            }
+            results["results"]["%s@%dMB" % (stage, size_mb)] = result
+            print("%-28s %10.3f s %10.1f MB/s   peak RSS %7.1f MB (+%.1f MB)" % ("%s@%dMB" % (stage, size_mb), seconds, result["mb_per_s"], result["peak_rss"] / 1048576.0, (result["peak_rss"] - result["peak_rss_before"]) / 1048576.0))
+            if stage in ("document", "retime", "snap_numpy", "snap_array"):
+                print("%-28s %s" % ("", runs[0]["result"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print("")
+        print("Compared with %s:" % args.baseline)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# Stand-in sfm, sfmApp, vs, _winreg and PySide modules for running session_presets.py outside of SFM
+# Only covers what the session functions touch in headless mode, nothing here draws anything or talks to SFM
+
+import os, sys, types
+
+class _StandIn(object):
+    # Accepts any attribute access or call, Qt enum values combine as 0
+    def __init__(self, *args, **kwargs):
+        pass
+    def __getattr__(self, name):
+        return _StandIn()
+    def __call__(self, *args, **kwargs):
+        return _StandIn()
+    def __or__(self, other):
+        return self
+    __ror__ = __or__
+    def __int__(self):
+        return 0
+
+class _Document:
+    def __init__(self):
+        self.path = None
+
+_document = _Document()
+messages = []
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    for key, value in attributes.items():
+        setattr(module, key, value)
+    sys.modules[name] = module
+    return module
+
+def _msg(text):
+    messages.append(text)
+    if os.environ.get("SESSION_PRESETS_VERBOSE", "") == "1":
+        sys.stderr.write(text)
+
+def _open_document(path):
+    # Only check that the file is there, SFM would load it here
+    if not os.path.isfile(path):
+        raise IOError("No such file: %s" % path)
+    _document.path = path
+
+def _close_document(forceSilent=True):
+    _document.path = None
+
+def _new_document(path, name, framerate=24.0):
+    _document.path = path
+
+def install():
+    # Register the stand-ins and ask session_presets.py not to start its UI when it's imported
+    os.environ["SESSION_PRESETS_HEADLESS"] = "1"
+    _module("sfm", Msg=_msg)
+    _module("sfmApp",
+        HasDocument=lambda: _document.path is not None,
+        OpenDocument=_open_document,
+        CloseDocument=_close_document,
+        NewDocument=_new_document,
+        ProcessEvents=lambda: None,
+        GetDocumentRoot=lambda: _document.path and _StandIn(),
+        GetMainWindow=lambda: _StandIn()
+    )
+    _module("vs", g_pDataModel=_StandIn())
+    _module("_winreg")
+    qtgui = _module("PySide.QtGui", QWidget=object)
+    qtcore = _module("PySide.QtCore", QObject=object, QAbstractListModel=object, QAbstractTableModel=object, Qt=_StandIn(), QTimer=_StandIn())
+    _module("PySide", QtGui=qtgui, QtCore=qtcore)
+
+def load(path):
+    # Import session_presets.py from path with the stand-ins installed
+    install()
+    name = "session_presets"
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source(name, path)
+    return module
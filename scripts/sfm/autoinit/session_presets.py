@@ -23,24 +23,73 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import ctypes, shutil, subprocess, os, json, traceback
-import sfm, sfmApp
-import _winreg as winreg
-from vs import g_pDataModel as dm
-from PySide import QtGui, QtCore
+import ctypes, shutil, subprocess, os, json, traceback, re, io, sys, struct, uuid, binascii, hashlib, time, mmap, threading, atexit, array, itertools, bisect, operator, tempfile, weakref, math
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import cProfile, pstats
+except ImportError:
+    cProfile = pstats = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+# Optional, keyframe times are retimed with the array module when numpy isn't available (SFM doesn't ship it)
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-virtual_protect = ctypes.windll.kernel32.VirtualProtect
-write_process_memory = ctypes.windll.kernel32.WriteProcessMemory
-get_current_process = ctypes.windll.kernel32.GetCurrentProcess
-get_command_line = ctypes.windll.kernel32.GetCommandLineA
+# Set SESSION_PRESETS_HEADLESS=1 to import this script outside of SFM (benchmarks) without patching SFM or creating any UI
+# Running this script directly is always headless, see the dry run at the bottom of this file
+# In headless mode the sfm, sfmApp, vs, _winreg and PySide modules are optional, anything missing is left as None
+_session_presets_headless = os.environ.get("SESSION_PRESETS_HEADLESS", "") == "1" or __name__ == "__main__"
+
+try:
+    import sfm, sfmApp
+    from vs import g_pDataModel as dm
+except ImportError:
+    if not _session_presets_headless:
+        raise
+    sfm = sfmApp = dm = None
+try:
+    import _winreg as winreg
+except ImportError:
+    if not _session_presets_headless:
+        raise
+    winreg = None
+try:
+    from PySide import QtGui, QtCore
+except ImportError:
+    if not _session_presets_headless:
+        raise
+    QtGui = QtCore = None
+
+if hasattr(ctypes, "windll"):
+    virtual_protect = ctypes.windll.kernel32.VirtualProtect
+    write_process_memory = ctypes.windll.kernel32.WriteProcessMemory
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_command_line = ctypes.windll.kernel32.GetCommandLineA
 
 _session_presets_version = "1.0"
 
 def _session_presets_msg(msg):
+    if sfm is None:
+        sys.stdout.write("[SESSION PRESETS] " + msg + "\n")
+        return
     sfm.Msg("[SESSION PRESETS] " + msg + "\n")
 
 def _session_presets_msg_box(msg, prefix, icon):
+    # Only call this on the Qt thread, worker threads raise or return their errors instead
     _session_presets_msg(prefix + ": " + msg)
+    if QtGui is None or _session_presets_headless:
+        return
     msgBox = QtGui.QMessageBox()
     msgBox.setWindowTitle("Session Presets: " + prefix)
     msgBox.setText(msg)
@@ -48,9 +97,9 @@ def _session_presets_msg_box(msg, prefix, icon):
     msgBox.exec_()
 
 def _session_presets_error_msg(msg):
-    _session_presets_msg_box(msg, "Error", QtGui.QMessageBox.Critical)
+    _session_presets_msg_box(msg, "Error", QtGui.QMessageBox.Critical if QtGui and not _session_presets_headless else None)
 
-class PyCQEditorLowerBarWidget(QtGui.QWidget):
+class PyCQEditorLowerBarWidget(QtGui.QWidget if QtGui else object):
     # python implementation of CQEditorLowerBarWidget
     # modified to add a status label on the left side
     def __init__(self, parent=None):
@@ -112,12 +161,3255 @@ class PyCQEditorLowerBarWidget(QtGui.QWidget):
             # Fallback: draw a simple background
             painter.fillRect(rect, QtGui.QColor(64, 64, 64))
 
+class SessionPresetsActivateFilter(QtCore.QObject if QtCore else object):
+    # Event filter calling callback whenever the window it's installed on is activated
+    def __init__(self, callback, parent=None):
+        super(SessionPresetsActivateFilter, self).__init__(parent)
+        self.callback = callback
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.WindowActivate:
+            self.callback()
+        return False
+
+# DMX files are read in chunks of this many bytes so memory stays bounded regardless of session size
+_session_presets_chunk_size = 1 << 20
+
+# Keyvalues2 tokens: quoted strings (which may span lines, binary blobs do), whole arrays of quoted strings,
+# braces, brackets, commas and comments. The last group only matches when a token was cut off at the end of a chunk
+_session_presets_kv2_token_re = re.compile(
+    r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+    r'|\[\s*((?:"[^"\\]*(?:\\.[^"\\]*)*"(?:\s*,\s*"[^"\\]*(?:\\.[^"\\]*)*")*)?)\s*\]'
+    r'|([{}\[\],])'
+    r'|<!--(.*?)-->'
+    r'|//[^\n]*\n'
+    r'|("|<!--|//)', re.S)
+_session_presets_kv2_value_re = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.S)
+_session_presets_kv2_escape_re = re.compile(r'\\(.)', re.S)
+_session_presets_kv2_escapes = {"n": "\n", "t": "\t", "v": "\v", "b": "\b", "r": "\r", "f": "\f", "a": "\a"}
+
+def _session_presets_open_dmx(path, mode="r"):
+    # DMX files are handled as native strings with one character per byte
+    # This keeps offsets byte-exact and line endings untouched on both Python 2 (SFM) and Python 3
+    if sys.version_info[0] >= 3:
+        return io.open(path, mode, encoding="latin-1", newline="")
+    return open(path, mode + "b")
+
+def _session_presets_kv2_unescape(value):
+    if "\\" not in value:
+        return value
+    return _session_presets_kv2_escape_re.sub(lambda m: _session_presets_kv2_escapes.get(m.group(1), m.group(1)), value)
+
+def _session_presets_kv2_array_values(body):
+    # Split the body of an array of quoted strings into its values
+    values = _session_presets_kv2_value_re.findall(body)
+    if "\\" in body:
+        values = [_session_presets_kv2_unescape(value) for value in values]
+    return values
+
+def _session_presets_kv2_tokens(f, chunk_size=_session_presets_chunk_size):
+    # Yields (kind, value) pairs read from a keyvalues2 file object
+    # kind is 1 for strings, 2 for the body of a complete array of strings, 3 for punctuation and 4 for the header comment
+    # Only one chunk (plus a token cut off at its end) is held in memory at any time
+    finditer = _session_presets_kv2_token_re.finditer
+    unescape = _session_presets_kv2_unescape
+    tail = ""
+    while True:
+        chunk = f.read(chunk_size)
+        buf = tail + chunk if tail else chunk
+        if not buf:
+            return
+        end = 0
+        for m in finditer(buf):
+            kind = m.lastindex
+            if kind == 5:
+                if chunk:
+                    # Token continues in the next chunk
+                    break
+                if m.group(5) == "//":
+                    # Comment on the last line of the file
+                    end = len(buf)
+                    break
+                raise ValueError("Unterminated token at end of keyvalues2 data")
+            end = m.end()
+            if kind == 1:
+                yield 1, unescape(m.group(1))
+            elif kind is not None:
+                yield kind, m.group(kind)
+        if not chunk:
+            return
+        tail = buf[end:]
+        if not tail.strip():
+            tail = ""
+
+def _session_presets_kv2_events(f, chunk_size=_session_presets_chunk_size, typed=None):
+    # Turns keyvalues2 tokens into a flat stream of events:
+    # ("header", text)                      dmx header comment
+    # ("begin", type, attribute)            element starts, attribute is the name it's inlined under (None for top-level and array items)
+    # ("attribute", name, type, value)      single value attribute, element references are ids ("" for null)
+    # ("array", name, type, values)         array of values (list of strings), anything but element arrays
+    # ("array_begin", name, type)           element array starts
+    # ("reference", id)                     element array item referring to an element by id
+    # ("array_end", name)                   element array ends
+    # ("end", type)                         element ends
+    # Arrays of the types in typed (see _session_presets_typed_arrays) come as a _SessionPresetsTypedArray instead of a list,
+    # decoded from the array's text in bulk
+    tokens = _session_presets_kv2_tokens(f, chunk_size)
+    # Each frame is [kind, name, type, values] where kind is 0 for elements, 1 for element arrays and 2 for other arrays
+    stack = []
+    for kind, value in tokens:
+        if not stack:
+            if kind == 4:
+                yield ("header", value.strip())
+            elif kind == 1:
+                brace_kind, brace = next(tokens, (None, None))
+                if brace != "{":
+                    raise ValueError("Expected '{' after top-level element type \"%s\"" % value)
+                stack.append([0, None, value, None])
+                yield ("begin", value, None)
+            else:
+                raise ValueError("Unexpected token in keyvalues2 data: %s" % value)
+            continue
+        frame = stack[-1]
+        frame_kind = frame[0]
+        if frame_kind == 0:
+            if kind == 1:
+                type_kind, attr_type = next(tokens, (None, None))
+                value_kind, attr_value = next(tokens, (None, None))
+                if type_kind != 1 or value_kind is None:
+                    raise ValueError("Malformed attribute \"%s\" in keyvalues2 data" % value)
+                if value_kind == 1:
+                    yield ("attribute", value, attr_type, attr_value)
+                elif value_kind == 2:
+                    if attr_type == "element_array":
+                        yield ("array_begin", value, attr_type)
+                        yield ("array_end", value)
+                    elif typed is not None and attr_type in typed and "\\" not in attr_value:
+                        yield ("array", value, attr_type, _session_presets_typed_array(attr_type, body=attr_value))
+                    else:
+                        yield ("array", value, attr_type, _session_presets_kv2_array_values(attr_value))
+                elif attr_value == "{":
+                    stack.append([0, value, attr_type, None])
+                    yield ("begin", attr_type, value)
+                elif attr_value == "[":
+                    if attr_type == "element_array":
+                        stack.append([1, value, attr_type, None])
+                        yield ("array_begin", value, attr_type)
+                    else:
+                        stack.append([2, value, attr_type, []])
+                else:
+                    raise ValueError("Unexpected \"%s\" for attribute \"%s\" in keyvalues2 data" % (attr_value, value))
+            elif value == "}":
+                stack.pop()
+                yield ("end", frame[2])
+            else:
+                raise ValueError("Unexpected token in keyvalues2 element: %s" % value)
+        elif frame_kind == 1:
+            if kind == 1:
+                item_kind, item_value = next(tokens, (None, None))
+                if item_kind == 1:
+                    yield ("reference", item_value)
+                elif item_value == "{":
+                    stack.append([0, None, value, None])
+                    yield ("begin", value, None)
+                else:
+                    raise ValueError("Malformed element array \"%s\" in keyvalues2 data" % frame[1])
+            elif value == "]":
+                stack.pop()
+                yield ("array_end", frame[1])
+        else:
+            if kind == 1:
+                frame[3].append(value)
+            elif value == "]":
+                stack.pop()
+                if typed is not None and frame[2] in typed:
+                    yield ("array", frame[1], frame[2], _session_presets_typed_array(frame[2], values=frame[3]))
+                else:
+                    yield ("array", frame[1], frame[2], frame[3])
+    if stack:
+        raise ValueError("Unexpected end of keyvalues2 data")
+
+def _session_presets_parse_header(text):
+    # "dmx encoding keyvalues2 1 format sfm_session 20" -> ("keyvalues2", 1, "sfm_session", 20)
+    parts = text.split()
+    try:
+        if len(parts) >= 7 and parts[0] == "dmx" and parts[1] == "encoding" and parts[4] == "format":
+            return parts[2], int(parts[3]), parts[5], int(parts[6])
+    except ValueError:
+        pass
+    return None
+
+def _session_presets_probe_events(events, fields=None, source=""):
+    # Collects session metadata from a dmx event stream in a single pass:
+    # - name and active_clip: name and element id of the root's active clip
+    # - framerate: first frameRate in the document, framerates: all of them
+    # - mapname and time_frame (start, duration, offset, scale) of the active clip
+    # - root_name, encoding and format from the root element and header
+    # - element_counts: number of elements of each type seen
+    # When fields is given, parsing stops as soon as all of those are known
+    info = {
+        "encoding": None,
+        "format": None,
+        "root_name": None,
+        "active_clip": None,
+        "name": None,
+        "framerate": None,
+        "framerates": [],
+        "mapname": None,
+        "time_frame": None,
+        "element_counts": {}
+    }
+    element_counts = info["element_counts"]
+    wanted = set(fields) if fields else None
+    found = set()
+    depth = 0
+    roots = 0
+    active_depth = None
+    time_frame_depth = None
+    time_frame_id = None
+    for event in events:
+        kind = event[0]
+        if kind == "attribute":
+            name, attr_type, value = event[1], event[2], event[3]
+            if name == "frameRate" and attr_type == "float":
+                try:
+                    framerate = float(value)
+                except ValueError:
+                    _session_presets_msg("Invalid framerate value in dmx file %s: %s" % (source, value))
+                    continue
+                info["framerates"].append(framerate)
+                if info["framerate"] is None:
+                    info["framerate"] = framerate
+                    found.add("framerate")
+            elif name == "id" and attr_type == "elementid":
+                if active_depth is None and value == info["active_clip"]:
+                    # Active clip referenced by the root, defined elsewhere
+                    active_depth = depth
+                elif time_frame_depth is None and value == time_frame_id:
+                    # Time frame referenced by the active clip, defined elsewhere
+                    time_frame_depth = depth
+                    info["time_frame"] = {}
+                elif active_depth == depth and info["active_clip"] is None:
+                    # Active clip inlined in the root
+                    info["active_clip"] = value
+                    found.add("active_clip")
+                else:
+                    continue
+            elif depth == active_depth:
+                if name == "name" and info["name"] is None:
+                    info["name"] = value
+                    found.add("name")
+                elif name == "mapname" and info["mapname"] is None:
+                    info["mapname"] = value
+                    found.add("mapname")
+                else:
+                    if name == "timeFrame" and attr_type == "element":
+                        time_frame_id = value
+                    continue
+            elif depth == time_frame_depth:
+                if attr_type == "time" or attr_type == "float":
+                    try:
+                        info["time_frame"][name] = float(value)
+                    except ValueError:
+                        pass
+                continue
+            elif depth == 1 and roots == 1:
+                if name == "name" and info["root_name"] is None:
+                    info["root_name"] = value
+                    found.add("root_name")
+                elif name == "activeClip" and attr_type == "element" and value:
+                    info["active_clip"] = value
+                    found.add("active_clip")
+                else:
+                    continue
+            else:
+                continue
+        elif kind == "begin":
+            depth += 1
+            element_counts[event[1]] = element_counts.get(event[1], 0) + 1
+            if depth == 1:
+                roots += 1
+            elif depth == 2 and roots == 1 and event[2] == "activeClip":
+                active_depth = depth
+            elif active_depth is not None and depth == active_depth + 1 and event[2] == "timeFrame":
+                time_frame_depth = depth
+                info["time_frame"] = {}
+            continue
+        elif kind == "end":
+            ended_time_frame = depth == time_frame_depth
+            if ended_time_frame:
+                time_frame_depth = None
+                found.add("time_frame")
+            elif depth == active_depth:
+                active_depth = None
+            depth -= 1
+            if not ended_time_frame:
+                continue
+        elif kind == "header":
+            header = _session_presets_parse_header(event[1])
+            if header:
+                info["encoding"] = header[0]
+                info["format"] = header[2]
+            continue
+        else:
+            continue
+        if wanted and wanted <= found:
+            break
+    return info
+
+class _SessionPresetsBinaryStream:
+    # Minimal buffered reader for binary dmx files, holds at most one chunk plus the value being read
+    def __init__(self, f, chunk_size=_session_presets_chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = b""
+        self.pos = 0
+    def fill(self, size):
+        if len(self.buf) - self.pos >= size:
+            return
+        data = self.f.read(max(size, self.chunk_size))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if len(self.buf) < size:
+            raise ValueError("Unexpected end of binary dmx data")
+    def read(self, size):
+        self.fill(size)
+        start = self.pos
+        self.pos = start + size
+        return self.buf[start:self.pos]
+    def unpack(self, fmt):
+        self.fill(fmt.size)
+        values = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return values
+    def skip(self, size):
+        available = len(self.buf) - self.pos
+        if size <= available:
+            self.pos += size
+        else:
+            self.f.seek(size - available, 1)
+            self.buf = b""
+            self.pos = 0
+    def cstring(self):
+        # Null terminated string
+        searched = self.pos
+        while True:
+            end = self.buf.find(b"\0", searched)
+            if end != -1:
+                value = self.buf[self.pos:end]
+                self.pos = end + 1
+                return value
+            data = self.f.read(self.chunk_size)
+            if not data:
+                raise ValueError("Unterminated string in binary dmx data")
+            self.buf = self.buf[self.pos:] + data
+            searched = len(self.buf) - len(data)
+            self.pos = 0
+
+if sys.version_info[0] >= 3:
+    def _session_presets_native_str(data):
+        return data.decode("latin-1")
+else:
+    def _session_presets_native_str(data):
+        return data
+
+# Binary dmx attribute type ids (encodings 1 to 5), arrays of each type follow at id + 14
+# Encodings before 3 stored object ids where later ones store times
+_session_presets_binary_types = (None, "element", "int", "float", "bool", "string", "binary", "time", "color", "vector2", "vector3", "vector4", "qangle", "quaternion", "matrix")
+_session_presets_binary_array_offset = 14
+# Item format and number of items per value for fixed size attribute types
+_session_presets_binary_items = {
+    "int": ("i", 1),
+    "float": ("f", 1),
+    "bool": ("B", 1),
+    "time": ("i", 1),
+    "objectid": ("16s", 1),
+    "color": ("B", 4),
+    "vector2": ("f", 2),
+    "vector3": ("f", 3),
+    "vector4": ("f", 4),
+    "qangle": ("f", 3),
+    "quaternion": ("f", 4),
+    "matrix": ("f", 16)
+}
+_session_presets_binary_structs = dict([(attr_type, struct.Struct("<" + (item[0] if item[1] == 1 else "%d%s" % (item[1], item[0])))) for attr_type, item in _session_presets_binary_items.items()])
+_session_presets_binary_int = _session_presets_binary_structs["int"]
+_session_presets_binary_short = struct.Struct("<h")
+_session_presets_binary_byte = struct.Struct("<B")
+
+def _session_presets_format_float(value):
+    # Same as SFM writes floats in keyvalues2: ten decimals without trailing zeros, "24" and "0.8000000119"
+    return ("%.10f" % value).rstrip("0").rstrip(".")
+
+def _session_presets_format_binary_value(attr_type, values):
+    # Format a decoded binary value tuple the way keyvalues2 stores it
+    if attr_type == "float" or attr_type in ("vector2", "vector3", "vector4", "qangle", "quaternion", "matrix"):
+        return " ".join([_session_presets_format_float(value) for value in values])
+    if attr_type == "int" or attr_type == "color":
+        return " ".join([str(value) for value in values])
+    if attr_type == "bool":
+        return "1" if values[0] else "0"
+    if attr_type == "time":
+        return "%.4f" % (values[0] / 10000.0)
+    if attr_type == "objectid":
+        return str(uuid.UUID(bytes_le=values[0]))
+    raise ValueError("Unsupported binary dmx attribute type: %s" % attr_type)
+
+# Numeric array types that can be held as typed arrays, with the typecode their keyvalues2 text is decoded into
+# Times are held in seconds, arrays read from binary files keep the item format they're stored in (single precision floats, bytes)
+_session_presets_typed_arrays = {
+    "time_array": "d",
+    "float_array": "d",
+    "int_array": "i",
+    "bool_array": "b",
+    "color_array": "i",
+    "vector2_array": "d",
+    "vector3_array": "d",
+    "vector4_array": "d",
+    "qangle_array": "d",
+    "quaternion_array": "d",
+    "matrix_array": "d"
+}
+
+class _SessionPresetsTypedArray(object):
+    # Values of a numeric array as one flat buffer of machine numbers, width numbers per value
+    # data is a numpy array when numpy decoded it, an array.array otherwise, both hold 1 to 8 bytes per number
+    # instead of a string object per value, and can be processed without parsing anything
+    __slots__ = ("type", "width", "data")
+    def __init__(self, attr_type, data):
+        self.type = attr_type
+        self.width = _session_presets_binary_items[attr_type[:-6]][1]
+        self.data = data
+    def __len__(self):
+        return len(self.data) // self.width
+    def compress(self, keep):
+        # Copy with only the values keep is true for
+        if self.width > 1:
+            keep = [flag for flag in keep for i in range(self.width)]
+        if numpy is not None and isinstance(self.data, numpy.ndarray):
+            return _SessionPresetsTypedArray(self.type, self.data[numpy.asarray(keep, dtype=bool)])
+        return _SessionPresetsTypedArray(self.type, array.array(self.data.typecode, itertools.compress(self.data, keep)))
+    def text(self, separator):
+        # Every value formatted the way SFM writes it with separator between them, in one string
+        # Built with a single format operation over the whole buffer instead of a string per value
+        count = len(self)
+        if not count:
+            return ""
+        values = self.data.tolist()
+        base_type = self.type[:-6]
+        if base_type == "time":
+            item_format = "%.4f"
+        elif base_type in ("int", "bool", "color"):
+            item_format = "%d"
+        else:
+            item_format = "%s"
+            values = map(_session_presets_format_float, values)
+        separator = separator.replace("%", "%%")
+        value_format = " ".join([item_format] * self.width) + separator
+        return ((value_format * count)[:-len(separator)]) % tuple(values)
+    def values(self):
+        if not len(self):
+            return []
+        return self.text("\x00").split("\x00")
+
+# Smaller typecodes integer arrays are stored as when all of their values fit, most are curve types and flags
+_session_presets_narrow_typecodes = (("b", -128, 127), ("B", 0, 255), ("h", -32768, 32767))
+
+def _session_presets_narrow_ints(data):
+    if not len(data):
+        return data
+    low = min(data) if numpy is None else int(data.min())
+    high = max(data) if numpy is None else int(data.max())
+    for typecode, typecode_low, typecode_high in _session_presets_narrow_typecodes:
+        if low >= typecode_low and high <= typecode_high:
+            if numpy is not None:
+                return data.astype(typecode)
+            return array.array(typecode, data)
+    return data
+
+def _session_presets_typed_array(attr_type, values=None, body=None):
+    # Decode the values of a numeric array into a _SessionPresetsTypedArray in one go, either from a list of strings
+    # or straight from the body of a keyvalues2 array ("0.5", "1.25"...) without splitting it into strings first
+    typecode = _session_presets_typed_arrays[attr_type]
+    width = _session_presets_binary_items[attr_type[:-6]][1]
+    if body is not None:
+        count = body.count('"') // 2
+        text = body.replace('"', " ").replace(",", " ")
+    else:
+        count = len(values)
+        text = " ".join(values)
+    if numpy is not None:
+        data = numpy.fromstring(text, dtype=typecode, sep=" ") if count else numpy.zeros(0, dtype=typecode)
+    else:
+        data = array.array(typecode, map(float if typecode == "d" else int, text.split()))
+    if len(data) != count * width:
+        raise ValueError("Malformed %s in dmx data" % attr_type)
+    if typecode == "i":
+        data = _session_presets_narrow_ints(data)
+    return _SessionPresetsTypedArray(attr_type, data)
+
+def _session_presets_binary_typed_array(attr_type, raw):
+    # Same for the little-endian items of a binary dmx array, times are turned from ticks into seconds
+    item_format = _session_presets_binary_items[attr_type[:-6]][0]
+    if numpy is not None:
+        data = numpy.frombuffer(raw, dtype="<" + item_format)
+        if attr_type == "time_array":
+            data = data / 10000.0
+    else:
+        data = array.array(item_format)
+        if sys.version_info[0] >= 3:
+            data.frombytes(raw)
+        else:
+            data.fromstring(raw)
+        if sys.byteorder == "big":
+            data.byteswap()
+        if attr_type == "time_array":
+            data = array.array("d", [tick / 10000.0 for tick in data])
+    return _SessionPresetsTypedArray(attr_type, data)
+
+def _session_presets_binary_dmx_events(f, attributes=None, chunk_size=_session_presets_chunk_size, typed=None):
+    # Yields the same events as _session_presets_kv2_events for a binary encoded dmx file object (encodings 1 to 5)
+    # Elements come out top-level in file order and refer to each other by id, keyvalues2 allows both forms
+    # When attributes is given, only attributes with those names are decoded, the rest are skipped without being read
+    # Array types in typed are read straight into _SessionPresetsTypedArray, see _session_presets_kv2_events
+    stream = _SessionPresetsBinaryStream(f, chunk_size)
+    header_text = _session_presets_native_str(stream.cstring()).strip()
+    if not header_text.startswith("<!--") or not header_text.endswith("-->"):
+        raise ValueError("Missing dmx header")
+    header_text = header_text[4:-3].strip()
+    header = _session_presets_parse_header(header_text)
+    if not header or header[0] != "binary":
+        raise ValueError("Not a binary dmx file: %s" % header_text)
+    version = header[1]
+    if version < 1 or version > 5:
+        raise ValueError("Unsupported binary dmx encoding version: %d" % version)
+    yield ("header", header_text)
+    int_struct = _session_presets_binary_int
+    native = _session_presets_native_str
+
+    # String table for element types and attribute names (and element names and string values from encoding 4)
+    strings = None
+    symbol_struct = _session_presets_binary_int if version >= 5 else _session_presets_binary_short
+    if version >= 2:
+        count_struct = _session_presets_binary_int if version >= 4 else _session_presets_binary_short
+        string_count = stream.unpack(count_struct)[0]
+        strings = [native(stream.cstring()) for i in range(string_count)]
+    def read_symbol():
+        if strings is None:
+            return native(stream.cstring())
+        return strings[stream.unpack(symbol_struct)[0]]
+
+    # Element index: type, name and id of every element, attribute bodies follow in the same order
+    elements = []
+    element_count = stream.unpack(int_struct)[0]
+    for i in range(element_count):
+        element_type = read_symbol()
+        if version >= 4:
+            element_name = read_symbol()
+        else:
+            element_name = native(stream.cstring())
+        element_id = str(uuid.UUID(bytes_le=stream.read(16)))
+        elements.append((element_type, element_name, element_id))
+
+    def read_element():
+        index = stream.unpack(int_struct)[0]
+        if index == -2:
+            # Element stored in another file, referenced by its id
+            return native(stream.cstring())
+        if index < 0:
+            return ""
+        return elements[index][2]
+    def skip_element():
+        if stream.unpack(int_struct)[0] == -2:
+            stream.cstring()
+    def read_binary():
+        return native(binascii.hexlify(stream.read(stream.unpack(int_struct)[0]))).upper()
+
+    for element_type, element_name, element_id in elements:
+        yield ("begin", element_type, None)
+        yield ("attribute", "id", "elementid", element_id)
+        yield ("attribute", "name", "string", element_name)
+        attribute_count = stream.unpack(int_struct)[0]
+        for i in range(attribute_count):
+            name = read_symbol()
+            type_id = stream.unpack(_session_presets_binary_byte)[0]
+            is_array = type_id > _session_presets_binary_array_offset
+            if is_array:
+                type_id -= _session_presets_binary_array_offset
+            if type_id < 1 or type_id >= len(_session_presets_binary_types):
+                raise ValueError("Unknown binary dmx attribute type %d for attribute \"%s\"" % (type_id, name))
+            attr_type = _session_presets_binary_types[type_id]
+            if attr_type == "time" and version < 3:
+                attr_type = "objectid"
+            wanted = attributes is None or name in attributes
+            if is_array:
+                count = stream.unpack(int_struct)[0]
+                array_type = attr_type + "_array"
+                if attr_type == "element":
+                    if not wanted:
+                        for j in range(count):
+                            skip_element()
+                        continue
+                    yield ("array_begin", name, array_type)
+                    for j in range(count):
+                        yield ("reference", read_element())
+                    yield ("array_end", name)
+                elif attr_type == "string":
+                    values = [native(stream.cstring()) for j in range(count)]
+                    if wanted:
+                        yield ("array", name, array_type, values)
+                elif attr_type == "binary":
+                    if not wanted:
+                        for j in range(count):
+                            stream.skip(stream.unpack(int_struct)[0])
+                        continue
+                    yield ("array", name, array_type, [read_binary() for j in range(count)])
+                else:
+                    item_struct = _session_presets_binary_structs[attr_type]
+                    if not wanted:
+                        stream.skip(item_struct.size * count)
+                        continue
+                    if typed is not None and array_type in typed:
+                        yield ("array", name, array_type, _session_presets_binary_typed_array(array_type, stream.read(item_struct.size * count)))
+                        continue
+                    item_format, width = _session_presets_binary_items[attr_type]
+                    if item_format == "16s":
+                        array_format = "<" + item_format * count
+                    else:
+                        array_format = "<%d%s" % (count * width, item_format)
+                    flat = stream.unpack(struct.Struct(array_format))
+                    yield ("array", name, array_type, [_session_presets_format_binary_value(attr_type, flat[j:j + width]) for j in range(0, len(flat), width)])
+            elif attr_type == "element":
+                if not wanted:
+                    skip_element()
+                    continue
+                yield ("attribute", name, attr_type, read_element())
+            elif attr_type == "string":
+                if version >= 4:
+                    value = read_symbol()
+                else:
+                    value = native(stream.cstring())
+                if wanted:
+                    yield ("attribute", name, attr_type, value)
+            elif attr_type == "binary":
+                if not wanted:
+                    stream.skip(stream.unpack(int_struct)[0])
+                    continue
+                yield ("attribute", name, attr_type, read_binary())
+            else:
+                value_struct = _session_presets_binary_structs[attr_type]
+                if not wanted:
+                    stream.skip(value_struct.size)
+                    continue
+                yield ("attribute", name, attr_type, _session_presets_format_binary_value(attr_type, stream.unpack(value_struct)))
+        yield ("end", element_type)
+
+_session_presets_kv2_escape_chars = {"\n": "\\n", "\t": "\\t", "\v": "\\v", "\b": "\\b", "\r": "\\r", "\f": "\\f", "\a": "\\a", "\\": "\\\\", "\"": "\\\""}
+_session_presets_kv2_escape_chars_re = re.compile(r'[\n\t\v\b\r\f\a\\"]')
+
+def _session_presets_kv2_escape(value):
+    return _session_presets_kv2_escape_chars_re.sub(lambda m: _session_presets_kv2_escape_chars[m.group(0)], value)
+
+class _SessionPresetsKV2Writer:
+    # Writes dmx events back out as keyvalues2 text, formatted the way SFM writes it
+    def __init__(self, write):
+        self.write = write
+        self.depth = 0
+        # One entry per open element or array: "top", "attribute" or "item" for elements, a list [first] for arrays
+        self.frames = []
+    def item_separator(self):
+        # Items of element arrays are separated by commas, written when the next item starts
+        frame = self.frames[-1] if self.frames else None
+        if type(frame) is list:
+            if frame[0]:
+                frame[0] = False
+            else:
+                self.write(",\n")
+            return True
+        return False
+    def write_event(self, event):
+        kind = event[0]
+        write = self.write
+        indent = "\t" * self.depth
+        escape = _session_presets_kv2_escape
+        if kind == "attribute":
+            attr_type = event[2]
+            if attr_type == "binary":
+                # Binary blobs are hex lines between quotes
+                data = "".join(event[3].split())
+                write('%s"%s" "binary" \n%s"\n' % (indent, escape(event[1]), indent))
+                for i in range(0, len(data), 80):
+                    write('%s%s\n' % (indent, data[i:i + 80]))
+                write('%s"\n' % indent)
+            else:
+                write('%s"%s" "%s" "%s"\n' % (indent, escape(event[1]), attr_type, escape(event[3])))
+        elif kind == "begin":
+            if event[2] is not None:
+                write('%s"%s" "%s"\n%s{\n' % (indent, escape(event[2]), event[1], indent))
+                self.frames.append("attribute")
+            elif self.item_separator():
+                write('%s"%s"\n%s{\n' % (indent, event[1], indent))
+                self.frames.append("item")
+            else:
+                write('"%s"\n{\n' % event[1])
+                self.frames.append("top")
+            self.depth += 1
+        elif kind == "end":
+            self.depth -= 1
+            indent = "\t" * self.depth
+            frame = self.frames.pop()
+            if frame == "attribute":
+                write("%s}\n%s\n" % (indent, indent))
+            elif frame == "item":
+                write("%s}" % indent)
+            else:
+                write("}\n\n")
+        elif kind == "reference":
+            self.item_separator()
+            write('%s"element" "%s"' % (indent, escape(event[1])))
+        elif kind == "array":
+            values = event[3]
+            write('%s"%s" "%s" \n%s[\n' % (indent, escape(event[1]), event[2], indent))
+            if values:
+                item_indent = indent + "\t"
+                if isinstance(values, _SessionPresetsTypedArray):
+                    write(item_indent + '"' + values.text('",\n' + item_indent + '"') + '"\n')
+                else:
+                    write(item_indent + '"' + ('",\n' + item_indent + '"').join([escape(value) for value in values]) + '"\n')
+            write("%s]\n" % indent)
+        elif kind == "array_begin":
+            write('%s"%s" "%s" \n%s[\n' % (indent, escape(event[1]), event[2], indent))
+            self.frames.append([True])
+            self.depth += 1
+        elif kind == "array_end":
+            self.depth -= 1
+            if not self.frames.pop()[0]:
+                write("\n")
+            write("%s]\n" % ("\t" * self.depth))
+        elif kind == "header":
+            write("<!-- %s -->\n" % event[1])
+
+def _session_presets_kv2_graph(events):
+    # First pass of subgraph extraction: the id of every element in document order and the elements each one points to
+    # Inline children count as references from their parent, under the attribute they're stored in
+    ids = []
+    edges = {}
+    clips = {}
+    root_arrays = {}
+    elements = []
+    arrays = []
+    for event in events:
+        kind = event[0]
+        if kind == "attribute":
+            if not elements:
+                continue
+            element = elements[-1]
+            name, attr_type, value = event[1], event[2], event[3]
+            if name == "id" and attr_type == "elementid":
+                element[0] = value
+                ids[element[2]] = value
+                edges[value] = element[1]
+                if element[3] is not None:
+                    element[3][1].append((element[4], value))
+                if element[6] is not None:
+                    element[6][0][element[6][1]] = value
+            elif attr_type == "element":
+                if value:
+                    element[1].append((name, value))
+            elif element[5] is not None and (name == "name" or name == "text"):
+                element[5][name] = value
+        elif kind == "begin":
+            parent = elements[-1] if elements else None
+            attribute = event[2] if event[2] is not None else (arrays[-1] if arrays and parent is not None else None)
+            # Inline items of the root's element arrays are listed in place like references
+            slot = None
+            if parent is not None and parent[2] == 0 and event[2] is None:
+                slot = (root_arrays[attribute], len(root_arrays[attribute]))
+                root_arrays[attribute].append(None)
+            # [id, edges, document order, parent, attribute in parent, clip info, slot in root array]
+            element = [None, [], len(ids), parent, attribute, {} if event[1] == "DmeFilmClip" else None, slot]
+            ids.append(None)
+            elements.append(element)
+        elif kind == "end":
+            element = elements.pop()
+            if element[5] is not None and element[0]:
+                clips[element[0]] = element[5]
+        elif kind == "array_begin":
+            arrays.append(event[1])
+            if len(elements) == 1 and elements[0][2] == 0:
+                root_arrays[event[1]] = []
+        elif kind == "reference":
+            if event[1]:
+                elements[-1][1].append((arrays[-1], event[1]))
+                if len(elements) == 1 and elements[0][2] == 0:
+                    root_arrays[arrays[-1]].append(event[1])
+        elif kind == "array_end":
+            arrays.pop()
+        elif kind == "array":
+            if len(elements) == 1 and elements[0][2] == 0:
+                root_arrays[event[1]] = event[3]
+    return {"ids": ids, "edges": edges, "clips": clips, "root_arrays": root_arrays}
+
+def _session_presets_extract_events(events, reachable_order, clip_id, drop_attributes):
+    # Second pass of _session_presets_extract_clip: the events of the extracted session, in the order they're written
+    # Each open element or array has where its contents and its end go: the output (output), a list of events
+    # written after the root ends, or nowhere (None)
+    output = []
+    output_depth = 0
+    relocated = []
+    stack = []
+    order = -1
+    root_open = False
+    for event in events:
+        kind = event[0]
+        if kind == "begin":
+            order += 1
+            if order == 0:
+                root_open = True
+            sink = stack[-1][0] if stack else None
+            if sink is None and order in reachable_order:
+                if output_depth == 0:
+                    sink = output
+                else:
+                    # Still inside the root, write it after the root ends
+                    sink = []
+                    relocated.append(sink)
+                event = ("begin", event[1], None)
+            if sink is not None:
+                sink.append(event)
+                if sink is output:
+                    output_depth += 1
+            stack.append((sink, sink))
+        elif kind == "end":
+            sink = stack.pop()[1]
+            if not stack:
+                root_open = False
+            if sink is not None:
+                sink.append(event)
+                if sink is output:
+                    output_depth -= 1
+                if not stack and relocated:
+                    for buf in relocated:
+                        output.extend(buf)
+                    relocated = []
+        elif kind == "header":
+            output.append(event)
+        else:
+            sink = stack[-1][0] if stack else None
+            in_root = root_open and len(stack) == 1
+            if in_root and kind != "array_end" and event[1] in drop_attributes:
+                if kind == "array_begin":
+                    stack.append((None, None))
+                continue
+            if in_root and kind == "attribute" and event[1] == "activeClip":
+                event = ("attribute", "activeClip", "element", clip_id)
+            elif in_root and kind == "array_begin" and event[1] == "clipBin":
+                sink.append(event)
+                sink.append(("reference", clip_id))
+                stack.append((None, sink))
+                continue
+            if kind == "array_begin":
+                stack.append((sink, sink))
+            elif kind == "array_end":
+                sink = stack.pop()[1]
+            if sink is not None:
+                sink.append(event)
+        if output:
+            for event in output:
+                yield event
+            del output[:]
+
+def _session_presets_extract_clip(source, destination, clip_id, drop_attributes=("defaults", "ids"), transform=None, typed=None):
+    # Write a new session containing only the root (without drop_attributes) and the elements reachable from clip_id,
+    # with the root's activeClip and clipBin pointing at that clip
+    # Elements that were stored inside dropped or unreachable elements are moved to the top level
+    # transform, if given, is an event transform (rename, retime...) applied to the extracted events on their way to
+    # destination, so the session is written once. typed is passed on to _session_presets_kv2_events for it
+    # Returns the defaults read from the source (list of {"name", "description", "id"}) and element counts
+    with _session_presets_open_dmx(source) as f:
+        graph = _session_presets_kv2_graph(_session_presets_kv2_events(f))
+    ids = graph["ids"]
+    edges = graph["edges"]
+    if not ids or clip_id not in edges:
+        raise ValueError("Clip %s not found in %s" % (clip_id, source))
+    root_id = ids[0]
+    replaced_attributes = set(drop_attributes) | set(["activeClip", "clipBin"])
+    pending = [target for attribute, target in edges.get(root_id, []) if attribute not in replaced_attributes]
+    pending.append(clip_id)
+    reachable = set([root_id])
+    while pending:
+        element_id = pending.pop()
+        if element_id in reachable:
+            continue
+        reachable.add(element_id)
+        pending.extend([target for attribute, target in edges.get(element_id, []) if target not in reachable])
+    reachable_order = set([i for i in range(len(ids)) if ids[i] in reachable])
+
+    # Defaults listed in the source, by position in the defaults and ids arrays
+    defaults = []
+    default_clips = graph["root_arrays"].get("defaults", [])
+    default_ids = graph["root_arrays"].get("ids", [])
+    for i in range(len(default_clips)):
+        clip = graph["clips"].get(default_clips[i], {})
+        defaults.append({
+            "name": clip.get("name", ""),
+            "description": clip.get("text", ""),
+            "id": default_ids[i] if i < len(default_ids) else default_clips[i]
+        })
+
+    with _session_presets_open_dmx(destination, "w") as f_out:
+        writer = _SessionPresetsKV2Writer(f_out.write)
+        with _session_presets_open_dmx(source) as f:
+            events = _session_presets_extract_events(_session_presets_kv2_events(f, typed=typed), reachable_order, clip_id, drop_attributes)
+            if transform is not None:
+                events = transform(events)
+            for event in events:
+                writer.write_event(event)
+    return {
+        "defaults": defaults,
+        "elements": len(ids),
+        "extracted": len(reachable_order)
+    }
+
+def _session_presets_dmx_header(path):
+    # Read the encoding and format from a dmx file's header comment without reading the rest of the file
+    with open(path, "rb") as f:
+        data = f.read(256)
+    start = data.find(b"<!--")
+    end = data.find(b"-->", start)
+    if start == -1 or end == -1:
+        return None
+    return _session_presets_parse_header(_session_presets_native_str(data[start + 4:end]).strip())
+
+# Attributes the metadata probe needs from binary files, everything else is skipped
+_session_presets_probe_attributes = frozenset(["activeClip", "mapname", "timeFrame", "frameRate", "start", "duration", "offset", "scale"])
+
+def _session_presets_probe_dmx(path, fields=None):
+    # Metadata probe for any dmx file, binary files are decoded directly without dmxconvert
+    header = _session_presets_dmx_header(path)
+    if header and header[0] == "binary":
+        with open(path, "rb") as f:
+            return _session_presets_probe_events(_session_presets_binary_dmx_events(f, _session_presets_probe_attributes), fields, path)
+    with _session_presets_open_dmx(path) as f:
+        return _session_presets_probe_events(_session_presets_kv2_events(f), fields, path)
+
+def _session_presets_hash_file(path):
+    # Content hash of a file, read in chunks
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_session_presets_chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _session_presets_replace_file(source, destination):
+    # Move source over destination, replacing it
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+        return
+    if os.path.isfile(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+def _session_presets_patch_stream(f_in, f_out, replacements, chunk_size=_session_presets_chunk_size):
+    # Copy keyvalues2 text from f_in to f_out while replacing every occurrence of the keys of replacements with their values
+    # All replacements are done by one combined pattern over whole-line chunks. Returns the number of characters read
+    keys = sorted(replacements.keys(), key=len, reverse=True)
+    pattern = re.compile("|".join([re.escape(key) for key in keys])) if keys else None
+    replace = lambda m: replacements[m.group(0)]
+    size = 0
+    tail = ""
+    while True:
+        chunk = f_in.read(chunk_size)
+        size += len(chunk)
+        if not chunk:
+            if tail:
+                f_out.write(pattern.sub(replace, tail) if pattern else tail)
+            break
+        # Only whole lines are patched, the rest waits for the next chunk
+        buf = tail + chunk if tail else chunk
+        cut = buf.rfind("\n") + 1
+        if cut == 0:
+            tail = buf
+            continue
+        tail = buf[cut:]
+        f_out.write(pattern.sub(replace, buf[:cut]) if pattern else buf[:cut])
+    return size
+
+def _session_presets_patch_dmx(source, destination, replacements, chunk_size=_session_presets_chunk_size):
+    # Copy a keyvalues2 file while replacing every occurrence of the keys of replacements with their values,
+    # see _session_presets_patch_stream. The file is read once and written once
+    # Returns the number of bytes read and the time taken
+    started = time.time()
+    in_place = os.path.normcase(os.path.abspath(source)) == os.path.normcase(os.path.abspath(destination))
+    out_path = destination + ".tmp" if in_place else destination
+    with _session_presets_open_dmx(source) as f_in:
+        with _session_presets_open_dmx(out_path, "w") as f_out:
+            size = _session_presets_patch_stream(f_in, f_out, replacements, chunk_size)
+    if in_place:
+        _session_presets_replace_file(out_path, destination)
+    return size, time.time() - started
+
+# Keys this many ticks (1/10000 s) or less from a frame of the source framerate are step edges, SFM writes them around holds
+# e.g. "66.9999" "67.0000" "67.0001", they keep their offset from the frame they belong to instead of being snapped onto it
+_session_presets_edge_ticks = 2
+
+class _SessionPresetsSnapTable(dict):
+    # Tick each time value (a float or its keyvalues2 text) snaps to at one framerate, filled in as times are looked up
+    # The log layers of a session mostly share their key times, so most times are only snapped once per session
+    __slots__ = ("framerate", "source_framerate")
+    def __init__(self, framerate, source_framerate):
+        dict.__init__(self)
+        self.framerate = framerate
+        self.source_framerate = source_framerate
+    def __missing__(self, key):
+        time_value = float(key)
+        framerate = self.framerate
+        source_framerate = self.source_framerate
+        tick = int(math.floor(math.floor(time_value * framerate + 0.5) * (10000.0 / framerate) + 0.5))
+        if source_framerate:
+            source_frame = math.floor(time_value * source_framerate + 0.5)
+            offset = int(math.floor(time_value * 10000.0 + 0.5) - math.floor(source_frame * (10000.0 / source_framerate) + 0.5))
+            if -_session_presets_edge_ticks <= offset <= _session_presets_edge_ticks:
+                tick = int(math.floor(math.floor(source_frame * framerate / source_framerate + 0.5) * (10000.0 / framerate) + 0.5)) + offset
+        self[key] = tick
+        return tick
+
+class _SessionPresetsTickTexts(dict):
+    # Keyvalues2 text of each tick, "%.4f" seconds
+    __slots__ = ()
+    def __missing__(self, tick):
+        text = "%.4f" % (tick / 10000.0)
+        self[tick] = text
+        return text
+
+# Snap tables by framerate and source framerate, and tick texts, each cleared once it holds this many times
+_session_presets_snap_tables = {}
+_session_presets_tick_texts = _SessionPresetsTickTexts()
+_session_presets_snap_table_size = 1 << 17
+
+# Arrays with fewer keys than this are snapped through the tables, even with numpy: its per call overhead is more than
+# the lookups for a log layer's usual hundred or so keys. Longer ones are snapped in bulk
+_session_presets_snap_table_max_keys = 2048
+
+def _session_presets_snap_table(framerate, source_framerate):
+    key = (framerate, source_framerate or None)
+    table = _session_presets_snap_tables.get(key)
+    if table is None or len(table) > _session_presets_snap_table_size:
+        table = _session_presets_snap_tables[key] = _SessionPresetsSnapTable(framerate, source_framerate or None)
+    return table
+
+def _session_presets_snap_times(values, framerate, source_framerate=None):
+    # Snap keyvalues2 time values (seconds with four decimals) to the nearest frame at framerate, all at once
+    # Returns the snapped values, and which keys to keep or None if all of them were kept
+    # A key that doesn't come after every key before it once snapped is dropped, times in a log layer have to increase
+    # With numpy (long arrays only), keys that didn't move keep their original text when most of them didn't (e.g. 24 to 48 fps)
+    # values may also be a time _SessionPresetsTypedArray, the snapped values are then one too
+    scale = 10000.0 / framerate
+    typed = isinstance(values, _SessionPresetsTypedArray)
+    if numpy is not None and len(values) >= _session_presets_snap_table_max_keys:
+        times = numpy.asarray(values.data if typed else values, dtype=numpy.float64)
+        original = numpy.floor(times * 10000.0 + 0.5)
+        ticks = numpy.floor(numpy.floor(times * framerate + 0.5) * scale + 0.5)
+        if source_framerate:
+            source_frames = numpy.floor(times * source_framerate + 0.5)
+            offsets = original - numpy.floor(source_frames * (10000.0 / source_framerate) + 0.5)
+            edges = numpy.abs(offsets) <= _session_presets_edge_ticks
+            if edges.any():
+                frame_ticks = numpy.floor(numpy.floor(source_frames * framerate / source_framerate + 0.5) * scale + 0.5)
+                ticks = numpy.where(edges, frame_ticks + offsets, ticks)
+        keep = None
+        if len(ticks) > 1:
+            increasing = ticks[1:] > numpy.maximum.accumulate(ticks)[:-1]
+            if not increasing.all():
+                keep = numpy.concatenate(([True], increasing))
+                ticks = ticks[keep]
+                original = original[keep]
+                if not typed:
+                    values = list(itertools.compress(values, keep))
+                keep = keep.tolist()
+        if typed:
+            return _SessionPresetsTypedArray(values.type, ticks / 10000.0), keep
+        moved = numpy.flatnonzero(ticks != original)
+        if len(moved) * 2 > len(ticks):
+            return ["%.4f" % (tick / 10000.0) for tick in ticks.tolist()], keep
+        snapped = list(values)
+        for i, tick in zip(moved.tolist(), ticks[moved].tolist()):
+            snapped[i] = "%.4f" % (tick / 10000.0)
+        return snapped, keep
+    if len(values) < _session_presets_snap_table_max_keys:
+        # Short arrays (a log layer's usual hundred or so keys) look each time up in the snap table,
+        # only times it hasn't seen yet are snapped one by one
+        table = _session_presets_snap_table(framerate, source_framerate)
+        if typed:
+            times = values.data.tolist() if numpy is not None else values.data
+        else:
+            times = values
+        ticks = list(map(table.__getitem__, times))
+    else:
+        # Long arrays without numpy have few times in common with anything else, they're snapped by list comprehensions
+        times = values.data if typed else array.array("d", map(float, values))
+        floor = int if not times or min(times) >= 0 else lambda value: int(value // 1)
+        ticks = [floor(floor(time_value * framerate + 0.5) * scale + 0.5) for time_value in times]
+        if source_framerate:
+            source_scale = 10000.0 / source_framerate
+            source_frames = [floor(time_value * source_framerate + 0.5) for time_value in times]
+            offsets = [floor(time_value * 10000.0 + 0.5) - floor(source_frame * source_scale + 0.5) for time_value, source_frame in zip(times, source_frames)]
+            edge = _session_presets_edge_ticks
+            ticks = [floor(floor(source_frame * framerate / source_framerate + 0.5) * scale + 0.5) + offset if -edge <= offset <= edge else tick for source_frame, offset, tick in zip(source_frames, offsets, ticks)]
+    # Keys are only walked one by one when some collide
+    keep = None
+    if any(map(operator.ge, ticks, itertools.islice(ticks, 1, None))):
+        keep = []
+        latest = None
+        snapped = []
+        for tick in ticks:
+            if latest is not None and tick <= latest:
+                keep.append(False)
+                continue
+            keep.append(True)
+            latest = tick
+            snapped.append(tick)
+        ticks = snapped
+    if typed:
+        return _SessionPresetsTypedArray(values.type, array.array("d", map(operator.truediv, ticks, itertools.repeat(10000.0, len(ticks))))), keep
+    if len(ticks) >= _session_presets_snap_table_max_keys:
+        return ["%.4f" % (tick / 10000.0) for tick in ticks], keep
+    texts = _session_presets_tick_texts
+    if len(texts) > _session_presets_snap_table_size:
+        texts.clear()
+    return list(map(texts.__getitem__, ticks)), keep
+
+def _session_presets_retime_log_layer(events, framerate, source_framerate, stats):
+    # Snap a log layer's times and drop the values and curve types of any keys that were merged
+    times_index = None
+    for i in range(len(events)):
+        event = events[i]
+        if event[0] == "array" and event[1] == "times" and event[2] == "time_array":
+            times_index = i
+            break
+    if times_index is None or not events[times_index][3]:
+        return events
+    times = events[times_index][3]
+    snapped, keep = _session_presets_snap_times(times, framerate, source_framerate)
+    stats["layers"] += 1
+    stats["keys"] += len(times)
+    result = []
+    for i in range(len(events)):
+        event = events[i]
+        if i == times_index:
+            event = ("array", event[1], event[2], snapped)
+        elif keep is not None and event[0] == "array" and len(event[3]) == len(times):
+            if isinstance(event[3], _SessionPresetsTypedArray):
+                event = ("array", event[1], event[2], event[3].compress(keep))
+            else:
+                event = ("array", event[1], event[2], list(itertools.compress(event[3], keep)))
+        result.append(event)
+    if keep is not None:
+        stats["dropped"] += len(times) - len(snapped)
+    return result
+
+def _session_presets_retime_events(events, framerate, source_framerate=None, stats=None):
+    # Event transform that moves a session to a new framerate:
+    # - every frameRate attribute is set to framerate
+    # - the times of every log layer (and other time arrays, like bookmarks) are snapped to its frames, see _session_presets_snap_times
+    #   source_framerate is the framerate the session was made at, so step edges can be told apart from keys between frames
+    # - timeFrame durations are rounded to whole frames
+    # Log layers are held back until they end so their values can follow their times, the rest streams through
+    # stats, if given, is filled with the number of layers, keys and dropped keys
+    if stats is None:
+        stats = {}
+    for key in ("layers", "keys", "dropped"):
+        stats.setdefault(key, 0)
+    framerate_value = _session_presets_format_float(framerate)
+    attributes = []
+    layer = None
+    layer_depth = 0
+    for event in events:
+        kind = event[0]
+        if layer is not None:
+            if kind == "begin":
+                layer_depth += 1
+            elif kind == "end":
+                if layer_depth == 0:
+                    for layer_event in _session_presets_retime_log_layer(layer, framerate, source_framerate, stats):
+                        yield layer_event
+                    layer = None
+                    attributes.pop()
+                    yield event
+                    continue
+                layer_depth -= 1
+            layer.append(event)
+            continue
+        if kind == "begin":
+            attributes.append(event[2])
+            if event[1].endswith("LogLayer"):
+                layer = []
+                layer_depth = 0
+        elif kind == "end":
+            attributes.pop()
+        elif kind == "attribute":
+            if event[1] == "frameRate" and event[2] == "float":
+                event = ("attribute", event[1], event[2], framerate_value)
+            elif event[1] == "duration" and event[2] == "time" and attributes and attributes[-1] == "timeFrame":
+                event = ("attribute", event[1], event[2], _session_presets_snap_times([event[3]], framerate)[0][0])
+        elif kind == "array" and event[2] == "time_array" and event[3]:
+            snapped, keep = _session_presets_snap_times(event[3], framerate, source_framerate)
+            event = ("array", event[1], event[2], snapped)
+        yield event
+
+# Only times are read as typed arrays when retiming, they're snapped and written back without going through a string per key
+# Values pass through as the text they were read as, formatting them again would cost more than it saves
+_session_presets_retime_typed = frozenset(["time_array"])
+
+def _session_presets_retime_dmx(source, destination, framerate, source_framerate=None):
+    # Write a keyvalues2 copy of a dmx file retimed to framerate, see _session_presets_retime_events
+    # source and destination may be the same file. Returns the stats and the time taken
+    started = time.time()
+    in_place = os.path.normcase(os.path.abspath(source)) == os.path.normcase(os.path.abspath(destination))
+    out_path = destination + ".tmp" if in_place else destination
+    stats = {}
+    header = _session_presets_dmx_header(source)
+    if header and header[0] == "binary":
+        f_in = open(source, "rb")
+        events = _session_presets_binary_dmx_events(f_in, typed=_session_presets_retime_typed)
+    else:
+        f_in = _session_presets_open_dmx(source)
+        events = _session_presets_kv2_events(f_in, typed=_session_presets_retime_typed)
+    try:
+        with _session_presets_open_dmx(out_path, "w") as f_out:
+            writer = _SessionPresetsKV2Writer(f_out.write)
+            for event in _session_presets_retime_events(events, framerate, source_framerate, stats):
+                if event[0] == "header" and header and header[0] != "keyvalues2":
+                    # Written as keyvalues2 whatever the source was
+                    event = ("header", "dmx encoding keyvalues2 1 format %s %d" % (header[2], header[3]))
+                writer.write_event(event)
+    finally:
+        f_in.close()
+    if in_place:
+        _session_presets_replace_file(out_path, destination)
+    return stats, time.time() - started
+
+# How much of a preset is kept in memory while looking for its name and framerate, and how much is read at a time meanwhile
+_session_presets_header_bytes = 1 << 21
+_session_presets_header_chunk_size = 1 << 16
+
+class _SessionPresetsReplayReader:
+    # File wrapper for reading the start of a file twice without seeking back: what's read is kept (up to limit bytes),
+    # after replay() reads return it again before carrying on with the rest of the file
+    def __init__(self, f, limit):
+        self.f = f
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        # Set once a read was cut off at limit
+        self.limited = False
+        self.replaying = None
+    def read(self, size=-1):
+        if self.replaying is None:
+            if self.size >= self.limit:
+                self.limited = True
+                return self.f.read(0)
+            data = self.f.read(size)
+            if data:
+                self.chunks.append(data)
+                self.size += len(data)
+            return data
+        data = self.replaying
+        if not data:
+            return self.f.read(size)
+        if size is not None and 0 <= size <= len(data):
+            self.replaying = data[size:]
+            return data[:size]
+        self.replaying = data[:0]
+        if size is None or size < 0:
+            return data + self.f.read()
+        return data + self.f.read(size - len(data))
+    def replay(self):
+        self.replaying = self.f.read(0).join(self.chunks)
+        self.chunks = None
+    def tell(self):
+        if self.replaying:
+            return self.f.tell() - len(self.replaying)
+        return self.f.tell()
+    def seek(self, offset, whence=0):
+        # Forward only, for the binary reader skipping attributes: while recording the skipped bytes are read
+        # (and kept) so they're replayed too, while replaying they're dropped from what's kept, then the file seeks
+        if whence == 0:
+            offset -= self.tell()
+        elif whence != 1:
+            raise ValueError("Unsupported seek whence: %d" % whence)
+        if offset < 0:
+            raise ValueError("Can't seek backwards in a replayed file")
+        if self.replaying is None:
+            while offset > 0:
+                data = self.read(min(offset, _session_presets_header_chunk_size))
+                if not data:
+                    break
+                offset -= len(data)
+        else:
+            data = self.replaying
+            skipped = min(offset, len(data))
+            self.replaying = data[skipped:]
+            if offset > skipped:
+                self.f.seek(offset - skipped, 1)
+        return self.tell()
+
+def _session_presets_rename_events(events, session_name, filename, source_framerate, framerate, strings=None):
+    # Event version of the custom preset patch in replace_name_and_framerate_in_dmx: every "name" string equal to the
+    # session name (the active clip's) becomes filename and every frameRate at source_framerate becomes framerate
+    # strings maps other string values to replace, in any string attribute (the default session title and description)
+    framerate_value = str(framerate).rstrip('0').rstrip('.')
+    for event in events:
+        if event[0] == "attribute":
+            if event[1] == "name" and event[2] == "string" and session_name and event[3] == session_name:
+                event = ("attribute", "name", "string", filename)
+            elif strings and event[2] == "string" and event[3] in strings:
+                event = ("attribute", event[1], "string", strings[event[3]])
+            elif event[1] == "frameRate" and event[2] == "float":
+                try:
+                    if float(event[3]) == source_framerate:
+                        event = ("attribute", "frameRate", "float", framerate_value)
+                except ValueError:
+                    pass
+        yield event
+
+def _session_presets_stream_session(source, destination, filename, framerate, session_name=None, source_framerate=None, default_framerate=24.0, retime=True):
+    # Write a new session from a preset (binary or keyvalues2) with its name and framerate replaced, and its keys retimed
+    # when retime is set and the framerate changes, in one pass over the preset that writes destination once
+    # session_name and source_framerate come from the metadata cache when known. Otherwise the start of the preset is read
+    # until both are found and kept in memory, then replayed into the pass. If they aren't within the first
+    # _session_presets_header_bytes, the preset is probed for them separately first
+    # Keyvalues2 presets that don't need retiming go through the text patch, anything else is decoded into events
+    # (binary presets in-process, without dmxconvert) and written back out as keyvalues2
+    started = time.time()
+    header = _session_presets_dmx_header(source)
+    binary = bool(header and header[0] == "binary")
+    result = {"buffered": 0, "probed": False, "stats": {}}
+    with (open(source, "rb") if binary else _session_presets_open_dmx(source)) as f_in:
+        reader = f_in
+        if session_name is None or source_framerate is None:
+            recorder = _SessionPresetsReplayReader(f_in, _session_presets_header_bytes)
+            chunk_size = _session_presets_header_chunk_size
+            if binary:
+                events = _session_presets_binary_dmx_events(recorder, chunk_size=chunk_size)
+            else:
+                events = _session_presets_kv2_events(recorder, chunk_size)
+            try:
+                info = _session_presets_probe_events(events, ("name", "framerate"), source)
+            except ValueError:
+                # Cut off at the limit in the middle of a token
+                info = None
+            if info is None or recorder.limited and (info["name"] is None or info["framerate"] is None):
+                info = _session_presets_probe_dmx(source, ("name", "framerate"))
+                result["probed"] = True
+                f_in.seek(0)
+            else:
+                result["buffered"] = recorder.size
+                recorder.replay()
+                reader = recorder
+            if session_name is None:
+                session_name = info["name"]
+            if source_framerate is None:
+                source_framerate = info["framerate"]
+        if not source_framerate:
+            source_framerate = default_framerate
+        retimed = bool(retime and framerate != source_framerate)
+        result.update({"name": session_name, "framerate": source_framerate, "retimed": retimed})
+        try:
+            with _session_presets_open_dmx(destination, "w") as f_out:
+                if not binary and not retimed:
+                    # Names are matched and written the way they appear in the file, escaped
+                    replacements = {}
+                    if session_name:
+                        replacements['"name" "string" "' + _session_presets_kv2_escape(session_name) + '"'] = '"name" "string" "' + _session_presets_kv2_escape(filename) + '"'
+                    replacements['"frameRate" "float" "' + str(source_framerate).rstrip('0').rstrip('.') + '"'] = '"frameRate" "float" "' + str(framerate).rstrip('0').rstrip('.') + '"'
+                    _session_presets_patch_stream(reader, f_out, replacements)
+                else:
+                    typed = _session_presets_retime_typed if retimed else None
+                    if binary:
+                        events = _session_presets_binary_dmx_events(reader, typed=typed)
+                    else:
+                        events = _session_presets_kv2_events(reader, typed=typed)
+                    events = _session_presets_rename_events(events, session_name, filename, source_framerate, framerate)
+                    if retimed:
+                        events = _session_presets_retime_events(events, framerate, source_framerate, result["stats"])
+                    writer = _SessionPresetsKV2Writer(f_out.write)
+                    for event in events:
+                        if event[0] == "header" and binary:
+                            # Written as keyvalues2 whatever the source was
+                            event = ("header", "dmx encoding keyvalues2 1 format %s %d" % (header[2], header[3]))
+                        writer.write_event(event)
+        except Exception:
+            # No half written session left behind
+            if os.path.isfile(destination):
+                os.remove(destination)
+            raise
+    result["seconds"] = time.time() - started
+    return result
+
+class _SessionPresetsFileLock:
+    # Advisory lock on a lock file shared by every SFM instance using the same game directory
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+    def __enter__(self):
+        self.file = open(self.path, "a+")
+        if msvcrt is not None:
+            # Retries for about 10 seconds before giving up
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        elif fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if msvcrt is not None:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            elif fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
+        return False
+
+# Options stores that are still in use, what they have pending is written when Python exits
+# Stores that were replaced or dropped aren't kept alive until then
+_session_presets_option_stores = weakref.WeakSet()
+
+def _session_presets_flush_option_stores():
+    for store in list(_session_presets_option_stores):
+        store.flush()
+
+atexit.register(_session_presets_flush_option_stores)
+
+class SessionPresetsOptionsStore:
+    # Writes the options file behind the caller: saves within debounce seconds of each other become a single write
+    # With qt, the delayed write runs from a QTimer on the Qt thread, otherwise from a timer thread
+    # Dialogs flush when they close, anything still pending after that is written when Python exits
+    # Unchanged options aren't written at all
+    # Each write goes to a temporary file that then replaces the options file, so a crash mid-write leaves the old options intact
+    # Reads and writes hold an advisory lock so SFM instances sharing a game directory don't write at the same time
+    # That only keeps the file whole: each write is the writer's options, so the last instance to save wins and
+    # changes another instance saved since this one read the file are lost
+    def __init__(self, path, debounce=0.5, qt=False):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.debounce = debounce
+        self.qt = qt
+        self.lock = threading.Lock()
+        self.pending = None
+        self.written = None
+        self.timer = None
+        self.saves = 0
+        self.writes = 0
+        self.skipped = 0
+        self.bytes_written = 0
+        _session_presets_option_stores.add(self)
+    def read(self):
+        # The parsed options, or None if there's no options file yet
+        if not os.path.isfile(self.path):
+            return None
+        with _SessionPresetsFileLock(self.lock_path):
+            with open(self.path, "r") as f:
+                text = f.read()
+        data = json.loads(text)
+        self.written = text
+        return data
+    def save(self, data):
+        text = json.dumps(data, indent=4)
+        with self.lock:
+            self.saves += 1
+            self.pending = text
+            if self.debounce > 0 and self.timer is None:
+                if self.qt:
+                    self.timer = QtCore.QTimer()
+                    self.timer.setSingleShot(True)
+                    self.timer.timeout.connect(self.flush)
+                    self.timer.start(int(self.debounce * 1000))
+                else:
+                    self.timer = threading.Timer(self.debounce, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        if self.debounce <= 0:
+            self.flush()
+    def flush(self):
+        # Write pending options now, returns True if the file was written
+        with self.lock:
+            if self.timer is not None:
+                if self.qt:
+                    try:
+                        self.timer.stop()
+                    except RuntimeError:
+                        # Already deleted along with Qt when flushed at exit
+                        pass
+                else:
+                    self.timer.cancel()
+                self.timer = None
+            text = self.pending
+            self.pending = None
+            if text is None:
+                return False
+            if text == self.written:
+                self.skipped += 1
+                return False
+            temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+            try:
+                with _SessionPresetsFileLock(self.lock_path):
+                    with open(temp_path, "w") as f:
+                        f.write(text)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    _session_presets_replace_file(temp_path, self.path)
+            except Exception as e:
+                _session_presets_msg("Error saving options to %s: %s" % (self.path, e))
+                if os.path.isfile(temp_path):
+                    os.remove(temp_path)
+                return False
+            self.written = text
+            self.writes += 1
+            self.bytes_written += len(text)
+        _session_presets_msg("Saved options to %s (%d writes for %d saves, %d bytes written)" % (self.path, self.writes, self.saves, self.bytes_written))
+        return True
+    def stats(self):
+        return {
+            "saves": self.saves,
+            "writes": self.writes,
+            "skipped": self.skipped,
+            "coalesced": self.saves - self.writes - self.skipped,
+            "bytes_written": self.bytes_written
+        }
+
+class _SessionPresetsSpan:
+    # One timed phase, see SessionPresetsTracer.span
+    def __init__(self, tracer, name, fields):
+        self.tracer = tracer
+        self.name = name
+        self.fields = fields
+        self.parent = None
+        self.start = None
+    def __enter__(self):
+        self.tracer.begin(self)
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer.end(self, exc_type)
+        return False
+
+class _SessionPresetsProfile:
+    # cProfile and tracemalloc around one block when the tracer has a profile requested, otherwise does nothing
+    # Writes session_presets_trace.<time>.<name>.prof for pstats, and a .memory.txt with the largest allocations on Python 3
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.profiler = None
+        self.tracing_memory = False
+    def __enter__(self):
+        with self.tracer.lock:
+            if not self.tracer.profile_next:
+                return self
+            self.tracer.profile_next = False
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start(16)
+            self.tracing_memory = True
+        if cProfile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.profiler is None and not self.tracing_memory:
+            return False
+        base = "%s.%s.%s" % (os.path.splitext(self.tracer.path)[0], time.strftime("%Y%m%d-%H%M%S"), self.name)
+        try:
+            if self.profiler is not None:
+                self.profiler.disable()
+                self.profiler.dump_stats(base + ".prof")
+                _session_presets_msg("Wrote profile to %s.prof" % base)
+            if self.tracing_memory:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                with open(base + ".memory.txt", "w") as f:
+                    f.write("current %d bytes, peak %d bytes\n" % (current, peak))
+                    for statistic in snapshot.statistics("lineno")[:50]:
+                        f.write(str(statistic) + "\n")
+                _session_presets_msg("Wrote memory snapshot to %s.memory.txt (peak %.1f MB)" % (base, peak / 1048576.0))
+        except Exception as e:
+            _session_presets_msg("Error writing profile %s: %s" % (base, e))
+        finally:
+            if self.tracing_memory:
+                tracemalloc.stop()
+        return False
+
+class SessionPresetsTracer:
+    # Span based timings for startup and session creation, appended to a JSONL trace file
+    # Each line is one span: the run it belongs to, its name and parent, when it started, how long it took and any extra fields
+    # Spans stay in memory until the outermost span on their thread ends, then the whole run is written at once
+    # The trace file is rotated to .1, .2, ... once it grows past max_bytes
+    def __init__(self, path, max_bytes=1048576, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = True
+        self.profile_next = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    def span(self, name, **fields):
+        # with tracer.span("name"): times the block, extra fields are written with the span
+        return _SessionPresetsSpan(self, name, fields)
+    def profile(self, name):
+        # with tracer.profile("name"): profiles the block if profile_next is set, then clears it
+        return _SessionPresetsProfile(self, name)
+    def state(self):
+        local = self.local
+        if not hasattr(local, "stack"):
+            local.stack = []
+            local.records = []
+            local.run = None
+        return local
+    def begin(self, span):
+        state = self.state()
+        if not state.stack:
+            state.run = uuid.uuid4().hex[:12]
+            state.records = []
+        span.parent = state.stack[-1].name if state.stack else None
+        span.start = time.time()
+        state.stack.append(span)
+    def end(self, span, exc_type=None):
+        seconds = time.time() - span.start
+        state = self.state()
+        if span in state.stack:
+            state.stack.remove(span)
+        self.add(state, span.name, span.parent, span.start, seconds, span.fields, exc_type)
+    def record(self, name, seconds, **fields):
+        # Add a phase that was timed elsewhere as a span under the current one
+        state = self.state()
+        parent = state.stack[-1].name if state.stack else None
+        if not state.stack:
+            state.run = uuid.uuid4().hex[:12]
+            state.records = []
+        self.add(state, name, parent, time.time() - seconds, seconds, fields)
+    def add(self, state, name, parent, start, seconds, fields, exc_type=None):
+        record = {
+            "run": state.run,
+            "name": name,
+            "parent": parent,
+            "start": round(start, 6),
+            "seconds": round(seconds, 6)
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(fields)
+        state.records.append(record)
+        if not state.stack:
+            records = state.records
+            state.records = []
+            self.write(records)
+    def write(self, records):
+        if not self.enabled or not records:
+            return
+        text = "".join([json.dumps(record, sort_keys=True) + "\n" for record in records])
+        with self.lock:
+            try:
+                self.rotate(len(text))
+                with open(self.path, "a") as f:
+                    f.write(text)
+            except Exception as e:
+                _session_presets_msg("Error writing trace to %s: %s" % (self.path, e))
+    def rotate(self, incoming):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) + incoming <= self.max_bytes:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = "%s.%d" % (self.path, i)
+            if os.path.isfile(older):
+                _session_presets_replace_file(older, "%s.%d" % (self.path, i + 1))
+        if self.backups > 0:
+            _session_presets_replace_file(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+    def read(self):
+        # Every span in the trace files, oldest first
+        records = []
+        paths = ["%s.%d" % (self.path, i) for i in range(self.backups, 0, -1)] + [self.path]
+        with self.lock:
+            for path in paths:
+                if not os.path.isfile(path):
+                    continue
+                with open(path, "r") as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            pass # Partially written line
+        return records
+    def summary(self, runs=50):
+        # p50, p95 and max seconds of each phase over the last runs runs
+        records = self.read()
+        run_order = []
+        seen = set()
+        for record in records:
+            if record.get("run") not in seen:
+                seen.add(record.get("run"))
+                run_order.append(record.get("run"))
+        last_runs = set(run_order[-runs:])
+        phases = {}
+        for record in records:
+            if record.get("run") in last_runs:
+                phases.setdefault(record.get("name", ""), []).append(record.get("seconds", 0.0))
+        summary = {}
+        for name, values in phases.items():
+            values.sort()
+            count = len(values)
+            summary[name] = {
+                "count": count,
+                "p50": values[min(count - 1, count * 50 // 100)],
+                "p95": values[min(count - 1, count * 95 // 100)],
+                "max": values[-1]
+            }
+        return summary
+    def log_summary(self, runs=50):
+        summary = self.summary(runs)
+        _session_presets_msg("Timings over the last %d runs from %s:" % (runs, self.path))
+        _session_presets_msg("%-30s %6s %9s %9s %9s" % ("phase", "count", "p50", "p95", "max"))
+        for name in sorted(summary.keys()):
+            phase = summary[name]
+            _session_presets_msg("%-30s %6d %8.3fs %8.3fs %8.3fs" % (name, phase["count"], phase["p50"], phase["p95"], phase["max"]))
+        return summary
+
+class SessionPresetsMetadataCache:
+    # Remembers preset metadata between runs so presets don't have to be read again to show their name, framerate, etc.
+    # Entries are keyed by path and revalidated lazily against the file's size and modification time
+    # With hash_contents, files whose modification time changed (copied to a share, touched) are hashed before being read again
+    def __init__(self, path, hash_contents=False):
+        self.path = path
+        self.hash_contents = hash_contents
+        self.entries = {}
+        self.dirty = False
+        # Presets are read on import worker threads
+        self.lock = threading.RLock()
+        self.load()
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+        except Exception as e:
+            _session_presets_msg("Error loading metadata cache from %s: %s" % (self.path, e))
+            self.entries = {}
+    def save(self):
+        if not self.dirty:
+            return
+        # Written to a temporary file that then replaces the cache, a crash mid-write leaves the old cache intact
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with self.lock:
+                text = json.dumps({
+                    "entries": self.entries,
+                    "version": _session_presets_version
+                }, separators=(",", ":"))
+                with open(temp_path, "w") as f:
+                    f.write(text)
+                _session_presets_replace_file(temp_path, self.path)
+                self.dirty = False
+        except Exception as e:
+            _session_presets_msg("Error saving metadata cache to %s: %s" % (self.path, e))
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+    def get(self, path, validate=True, read=True):
+        # Returns the metadata for a preset file, or None if it can't be read
+        # validate=False trusts an existing entry without touching the file, read=False never reads the file
+        key = self.key(path)
+        entry = self.entries.get(key)
+        if entry and not validate:
+            return entry["metadata"]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry and entry["size"] == stat.st_size:
+            if entry["mtime"] == stat.st_mtime:
+                return entry["metadata"]
+            if self.hash_contents and entry.get("hash") and read:
+                file_hash = _session_presets_hash_file(path)
+                if file_hash == entry["hash"]:
+                    with self.lock:
+                        entry["mtime"] = stat.st_mtime
+                        self.dirty = True
+                    return entry["metadata"]
+        if not read:
+            return None
+        metadata = self.read_metadata(path, stat)
+        if metadata is None:
+            return None
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": _session_presets_hash_file(path) if self.hash_contents else None,
+            "metadata": metadata
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.dirty = True
+        return metadata
+    def read_metadata(self, path, stat):
+        try:
+            info = _session_presets_probe_dmx(path)
+        except Exception as e:
+            _session_presets_msg("Error reading dmx file %s: %s" % (path, e))
+            return None
+        time_frame = info["time_frame"] or {}
+        return {
+            "name": info["name"],
+            "framerate": info["framerate"],
+            "active_clip": info["active_clip"],
+            "mapname": info["mapname"],
+            "duration": time_frame.get("duration"),
+            "element_counts": info["element_counts"],
+            "file_size": stat.st_size
+        }
+    def get_hash(self, path, compute=True):
+        # Content hash of a preset, only recomputed when the file changed since it was last hashed
+        # compute=False returns None instead of reading the file
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = self.key(path)
+        entry = self.entries.get(key)
+        if entry and entry.get("hash") and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["hash"]
+        if not compute:
+            return None
+        file_hash = _session_presets_hash_file(path)
+        if entry and entry["size"] == stat.st_size and entry.get("hash") in (None, file_hash):
+            with self.lock:
+                entry["hash"] = file_hash
+                entry["mtime"] = stat.st_mtime
+                self.dirty = True
+        return file_hash
+    def remove(self, path):
+        with self.lock:
+            if self.entries.pop(self.key(path), None) is not None:
+                self.dirty = True
+
+class SessionPresetsConvertedCache:
+    # Keeps keyvalues2 conversions of binary presets so the same preset isn't run through dmxconvert on every new session
+    # Conversions are stored by the source file's content hash and evicted least recently used first once over budget_bytes
+    def __init__(self, directory, budget_bytes):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.budget_bytes = budget_bytes
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Hits only touch the index in memory, it's written once by the caller when it's done (see SessionPresets.save_caches)
+        self.dirty = False
+        # Presets are converted on import worker threads, conversions themselves run outside the lock
+        self.lock = threading.RLock()
+        self.load()
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            counters = data.get("counters", {})
+            self.hits = counters.get("hits", 0)
+            self.misses = counters.get("misses", 0)
+            self.evictions = counters.get("evictions", 0)
+        except Exception as e:
+            _session_presets_msg("Error loading converted preset cache index %s: %s" % (self.index_path, e))
+            self.entries = {}
+        # Forget entries whose files were deleted by hand
+        for key in list(self.entries.keys()):
+            if not os.path.isfile(self.entry_path(key)):
+                del self.entries[key]
+        # Take back conversions the index lost (an older index written non-atomically, a crash before the index was saved)
+        # so they count against the budget and get evicted like the others
+        adopted = 0
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            key, ext = os.path.splitext(name)
+            if ext != ".dmx" or key in self.entries:
+                continue
+            try:
+                stat = os.stat(self.entry_path(key))
+            except OSError:
+                continue
+            self.entries[key] = {
+                "size": stat.st_size,
+                "last_used": stat.st_mtime,
+                "source": ""
+            }
+            adopted += 1
+        if adopted:
+            _session_presets_msg("Found %d converted presets missing from the converted preset cache index" % adopted)
+            self.evict()
+            self.dirty = True
+    def save(self):
+        if not self.dirty:
+            return
+        temp_path = "%s.%d.tmp" % (self.index_path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written to a temporary file that then replaces the index, a crash mid-write leaves the old index intact
+            with self.lock:
+                text = json.dumps({
+                    "entries": self.entries,
+                    "counters": self.stats(),
+                    "version": _session_presets_version
+                }, separators=(",", ":"))
+                with open(temp_path, "w") as f:
+                    f.write(text)
+                _session_presets_replace_file(temp_path, self.index_path)
+                self.dirty = False
+        except Exception as e:
+            _session_presets_msg("Error saving converted preset cache index %s: %s" % (self.index_path, e))
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes()
+        }
+    def total_bytes(self):
+        return sum([entry["size"] for entry in self.entries.values()])
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".dmx")
+    def lookup(self, source_hash):
+        # Returns the path of an existing conversion, None if there is none (nothing is converted)
+        out_path = self.entry_path(source_hash)
+        with self.lock:
+            entry = self.entries.get(source_hash)
+            if entry and os.path.isfile(out_path):
+                self.hits += 1
+                entry["last_used"] = time.time()
+                self.dirty = True
+                return out_path
+        return None
+    def get(self, source_path, source_hash, convert):
+        # Returns the path of the keyvalues2 conversion of source_path, calling convert(source_path, out_path) on a miss
+        out_path = self.lookup(source_hash)
+        if out_path:
+            return out_path
+        out_path = self.entry_path(source_hash)
+        with self.lock:
+            self.misses += 1
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        # Each thread converts to its own temporary file
+        temp_path = "%s.%d.tmp" % (out_path, threading.current_thread().ident)
+        try:
+            converted = convert(source_path, temp_path)
+        except Exception:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+        if not converted:
+            return None
+        with self.lock:
+            _session_presets_replace_file(temp_path, out_path)
+            self.entries[source_hash] = {
+                "size": os.path.getsize(out_path),
+                "last_used": time.time(),
+                "source": source_path
+            }
+            self.evict(keep=source_hash)
+            self.dirty = True
+        return out_path
+    def evict(self, keep=None):
+        # Drop least recently used conversions until the cache fits in its budget
+        total = self.total_bytes()
+        for key in sorted(self.entries.keys(), key=lambda key: self.entries[key]["last_used"]):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.entry_path(key))
+            except OSError as e:
+                _session_presets_msg("Error removing cached conversion %s: %s" % (key, e))
+                continue
+            total -= self.entries.pop(key)["size"]
+            self.evictions += 1
+
+# The keyvalues2 token expression for matching directly against a memory mapped file
+_session_presets_kv2_token_bytes_re = re.compile(_session_presets_kv2_token_re.pattern.encode("latin-1") if not isinstance(_session_presets_kv2_token_re.pattern, bytes) else _session_presets_kv2_token_re.pattern, re.S)
+
+def _session_presets_kv2_index(data):
+    # Byte range [start, end, type] of every element in keyvalues2 data (bytes or mmap) and the ids each element references
+    # Inline children count as references from their parent, like they do for _session_presets_kv2_graph
+    # Returns (root id, elements, references)
+    native = _session_presets_native_str
+    elements = {}
+    references = {}
+    root = None
+    # Elements are [start, id, type, references], arrays are None
+    stack = []
+    # (start, value) of the strings read since the last attribute or punctuation
+    pending = []
+    for m in _session_presets_kv2_token_bytes_re.finditer(data):
+        kind = m.lastindex
+        if kind == 1:
+            pending.append((m.start(), m.group(1)))
+            if len(pending) == 3 and stack and stack[-1] is not None:
+                element = stack[-1]
+                name, attr_type, value = pending[0][1], pending[1][1], pending[2][1]
+                if name == b"id" and attr_type == b"elementid":
+                    element[1] = native(value)
+                    if root is None and len(stack) == 1:
+                        root = element[1]
+                elif attr_type == b"element" and value:
+                    element[3].append(native(value))
+                pending = []
+        elif kind == 3:
+            punctuation = m.group(3)
+            if punctuation == b"{":
+                # Inline elements start at their type, so the range reads like a top-level element
+                start = pending[-1][0] if pending else m.start()
+                stack.append([start, None, native(pending[-1][1]) if pending else "", []])
+            elif punctuation == b"}":
+                element = stack.pop()
+                if element[1] is not None:
+                    elements[element[1]] = [element[0], m.end(), element[2]]
+                    references[element[1]] = element[3]
+                    for parent in reversed(stack):
+                        if parent is not None:
+                            parent[3].append(element[1])
+                            break
+            elif punctuation == b"[":
+                stack.append(None)
+            else:
+                # End of an element array item
+                if len(pending) == 2 and pending[0][1] == b"element" and pending[1][1]:
+                    for parent in reversed(stack):
+                        if parent is not None:
+                            parent[3].append(native(pending[1][1]))
+                            break
+                if punctuation == b"]":
+                    stack.pop()
+            pending = []
+        elif kind == 2:
+            pending = []
+        elif kind == 5:
+            raise ValueError("Unterminated token at end of keyvalues2 data")
+    return root, elements, references
+
+class _SessionPresetsMappedRange:
+    # Read-only file object over part of a memory mapped file, for _session_presets_kv2_events
+    def __init__(self, data, start, end):
+        self.data = data
+        self.position = start
+        self.end = end
+    def read(self, size=-1):
+        end = self.end if size < 0 else min(self.position + size, self.end)
+        chunk = self.data[self.position:end]
+        self.position = end
+        return _session_presets_native_str(chunk)
+
+class SessionPresetsElementIndex:
+    # Byte range of every element in a keyvalues2 dmx file plus which elements reference which
+    # Persisted next to the file as <file>.index and rebuilt when the file's size or modification time changes
+    # Element lookups read from a memory map, so only the pages holding that element are touched
+    version = 1
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + ".index"
+        self.root = None
+        self.elements = {}
+        self.references = {}
+        self.referenced_by = None
+        self.file = None
+        self.map = None
+    def __enter__(self):
+        self.open()
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+    def load(self):
+        # Load a persisted index, returns False if there is none or it's out of date
+        try:
+            stat = os.stat(self.path)
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, IOError, ValueError):
+            return False
+        if data.get("version") != self.version or data.get("size") != stat.st_size or data.get("mtime") != stat.st_mtime:
+            return False
+        self.root = data["root"]
+        self.elements = data["elements"]
+        self.references = data["references"]
+        self.referenced_by = None
+        return True
+    def build(self):
+        stat = os.stat(self.path)
+        started = time.time()
+        self.map_file()
+        self.root, self.elements, self.references = _session_presets_kv2_index(self.map)
+        self.referenced_by = None
+        _session_presets_msg("Indexed %d elements in %s in %.3f seconds" % (len(self.elements), self.path, time.time() - started))
+        data = {
+            "version": self.version,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "root": self.root,
+            "elements": self.elements,
+            "references": self.references
+        }
+        try:
+            with open(self.index_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+        except (OSError, IOError) as e:
+            _session_presets_msg("Error saving element index to %s: %s" % (self.index_path, e))
+    def map_file(self):
+        if self.map is None:
+            self.file = open(self.path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    def open(self):
+        # Use the persisted index when it's still valid, otherwise index the file again
+        if not self.load():
+            self.build()
+        self.map_file()
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    def element_range(self, element_id):
+        element = self.elements.get(element_id)
+        if element is None:
+            return None
+        return element[0], element[1]
+    def element_type(self, element_id):
+        element = self.elements.get(element_id)
+        return element[2] if element else None
+    def element_text(self, element_id):
+        # Keyvalues2 text of the element, including its inline children
+        element = self.elements.get(element_id)
+        if element is None:
+            return None
+        return _session_presets_native_str(self.map[element[0]:element[1]])
+    def element_events(self, element_id, chunk_size=1 << 16):
+        # Stream the element's events (see _session_presets_kv2_events) without reading past it
+        element = self.elements.get(element_id)
+        if element is None:
+            return iter(())
+        return _session_presets_kv2_events(_SessionPresetsMappedRange(self.map, element[0], element[1]), chunk_size)
+    def element_attribute(self, element_id, name):
+        # Value of one of the element's own attributes, stops reading as soon as it's found
+        # Inline elements give their id, like element references do
+        depth = 0
+        found = False
+        for event in self.element_events(element_id):
+            kind = event[0]
+            if kind == "begin":
+                depth += 1
+                if depth == 2 and event[2] == name:
+                    found = True
+            elif kind == "end" or kind == "array_end":
+                depth -= 1
+            elif kind == "array_begin":
+                depth += 1
+            elif kind == "attribute":
+                if found and depth == 2 and event[1] == "id":
+                    return event[3]
+                if depth == 1 and event[1] == name:
+                    return event[3]
+            elif kind == "array":
+                if depth == 1 and event[1] == name:
+                    return event[3]
+        return None
+    def get_references(self, element_id):
+        return self.references.get(element_id, [])
+    def get_referenced_by(self, element_id):
+        # Reverse of references, built the first time it's needed
+        if self.referenced_by is None:
+            self.referenced_by = {}
+            for source, targets in self.references.items():
+                for target in targets:
+                    self.referenced_by.setdefault(target, []).append(source)
+        return self.referenced_by.get(element_id, [])
+
+try:
+    _session_presets_intern = sys.intern
+except AttributeError:
+    _session_presets_intern = intern
+
+class _SessionPresetsLazyArray(object):
+    # Values of a non-element array kept as one string until they're asked for
+    # A list of short strings costs several times the text it holds, arrays are most of a session's size
+    # New-style class, __slots__ does nothing on old-style classes in Python 2
+    __slots__ = ("data", "count")
+    def __init__(self, values):
+        self.count = len(values)
+        self.data = "\x00".join(values)
+        if self.count and self.data.count("\x00") != self.count - 1:
+            # A value contains the separator, keep the list as it is
+            self.data = list(values)
+    def values(self):
+        if type(self.data) is list:
+            return list(self.data)
+        if not self.count:
+            return []
+        return self.data.split("\x00")
+    def __len__(self):
+        return self.count
+
+class _SessionPresetsElement(object):
+    # One element of a SessionPresetsDocument
+    # attributes is flat: name, type, value, name, type, value... with interned names and types
+    # Element values are handles (-1 for null), element arrays are array("l") of handles,
+    # numeric arrays are _SessionPresetsTypedArray and other arrays are _SessionPresetsLazyArray
+    __slots__ = ("handle", "type", "parent", "attributes")
+    def __init__(self, element_type):
+        self.handle = None
+        self.type = element_type
+        # Handle of the element this one is written inline in, -1 for top-level elements
+        self.parent = -1
+        self.attributes = []
+    def find(self, name):
+        attributes = self.attributes
+        for i in range(0, len(attributes), 3):
+            if attributes[i] == name:
+                return i
+        return -1
+    def names(self):
+        return self.attributes[0::3]
+    def get_type(self, name):
+        i = self.find(name)
+        return self.attributes[i + 1] if i != -1 else None
+    def get(self, name, default=None):
+        # Arrays are decoded here, each call decodes them again
+        i = self.find(name)
+        if i == -1:
+            return default
+        value = self.attributes[i + 2]
+        if isinstance(value, (_SessionPresetsLazyArray, _SessionPresetsTypedArray)):
+            return value.values()
+        if self.attributes[i + 1] == "element_array":
+            return list(value)
+        return value
+    def get_typed(self, name):
+        # The _SessionPresetsTypedArray of a numeric array as it's held, None for anything else
+        i = self.find(name)
+        if i == -1 or not isinstance(self.attributes[i + 2], _SessionPresetsTypedArray):
+            return None
+        return self.attributes[i + 2]
+    def set(self, name, attr_type, value):
+        # Array values are lists of strings (handles for element arrays), or a _SessionPresetsTypedArray
+        attr_type = _session_presets_intern(attr_type)
+        if attr_type == "element_array":
+            value = array.array("l", value)
+        elif isinstance(value, _SessionPresetsTypedArray):
+            pass
+        elif attr_type in _session_presets_typed_arrays:
+            value = _session_presets_typed_array(attr_type, values=value)
+        elif attr_type.endswith("_array"):
+            value = _SessionPresetsLazyArray(value)
+        i = self.find(name)
+        if i == -1:
+            self.attributes.extend((_session_presets_intern(name), attr_type, value))
+        else:
+            self.attributes[i + 1] = attr_type
+            self.attributes[i + 2] = value
+    def remove(self, name):
+        i = self.find(name)
+        if i != -1:
+            del self.attributes[i:i + 3]
+
+class SessionPresetsDocument:
+    # Compact in-memory model of a whole dmx document, for operations that need more than one streaming pass
+    # Elements are referred to by integer handles instead of their ids, ids are kept once in ids
+    # Attribute names and types are interned, numeric arrays are held as typed arrays and other array values are only decoded
+    # when asked for, so a loaded document takes a small multiple of the file's size (see benchmarks/benchmark_dmx.py)
+    def __init__(self, path=None):
+        self.header = None
+        # Indexed by handle, elements is None for ids that are referenced but never defined
+        self.elements = []
+        self.ids = []
+        self.handles = {}
+        # Handles of the top-level elements in document order, the first is the root
+        self.roots = []
+        if path:
+            self.load(path)
+    def load(self, path):
+        header = _session_presets_dmx_header(path)
+        if header and header[0] == "binary":
+            with open(path, "rb") as f:
+                self.build(_session_presets_binary_dmx_events(f, typed=_session_presets_typed_arrays))
+        else:
+            with _session_presets_open_dmx(path) as f:
+                self.build(_session_presets_kv2_events(f, typed=_session_presets_typed_arrays))
+        return self
+    def handle(self, element_id):
+        # Handle for an element id, a new one if the id hasn't been seen yet
+        handle = self.handles.get(element_id)
+        if handle is None:
+            handle = len(self.ids)
+            self.handles[element_id] = handle
+            self.ids.append(element_id)
+            self.elements.append(None)
+        return handle
+    def element(self, element_id):
+        handle = self.handles.get(element_id)
+        return self.elements[handle] if handle is not None else None
+    def root(self):
+        return self.elements[self.roots[0]] if self.roots else None
+    def build(self, events):
+        # Fill the document from a dmx event stream, see _session_presets_kv2_events
+        intern = _session_presets_intern
+        # Frames are [element, index of the attribute in the parent referring to it] or [None, owner, index, items] for element arrays
+        stack = []
+        for event in events:
+            kind = event[0]
+            if kind == "attribute":
+                element = stack[-1][0]
+                if event[1] == "id" and event[2] == "elementid":
+                    element.handle = self.handle(event[3])
+                    self.elements[element.handle] = element
+                elif event[2] == "element":
+                    element.attributes.extend((intern(event[1]), "element", self.handle(event[3]) if event[3] else -1))
+                else:
+                    element.attributes.extend((intern(event[1]), intern(event[2]), event[3]))
+            elif kind == "array":
+                values = event[3]
+                if not isinstance(values, _SessionPresetsTypedArray):
+                    values = _SessionPresetsLazyArray(values)
+                stack[-1][0].attributes.extend((intern(event[1]), intern(event[2]), values))
+            elif kind == "begin":
+                element = _SessionPresetsElement(intern(event[1]))
+                index = None
+                if event[2] is not None:
+                    parent = stack[-1][0]
+                    parent.attributes.extend((intern(event[2]), "element", -1))
+                    index = len(parent.attributes) - 1
+                stack.append([element, index])
+            elif kind == "end":
+                element, index = stack.pop()
+                if element.handle is None:
+                    element.handle = self.handle(str(uuid.uuid4()))
+                    self.elements[element.handle] = element
+                if not stack:
+                    self.roots.append(element.handle)
+                elif stack[-1][0] is None:
+                    # Element array item
+                    element.parent = stack[-1][1].handle
+                    stack[-1][3].append(element.handle)
+                else:
+                    element.parent = stack[-1][0].handle
+                    stack[-1][0].attributes[index] = element.handle
+            elif kind == "reference":
+                stack[-1][3].append(self.handle(event[1]) if event[1] else -1)
+            elif kind == "array_begin":
+                owner = stack[-1][0]
+                owner.attributes.extend((intern(event[1]), "element_array", None))
+                stack.append([None, owner, len(owner.attributes) - 1, []])
+            elif kind == "array_end":
+                frame = stack.pop()
+                frame[1].attributes[frame[2]] = array.array("l", frame[3])
+            elif kind == "header":
+                self.header = event[1]
+        return self
+    def inline(self, handle, owner, written):
+        # Whether to write an element inline in owner: it was defined there and hasn't been written yet
+        element = self.elements[handle] if handle >= 0 else None
+        return element is not None and element.parent == owner and handle not in written
+    def element_events(self, handle, attribute, written):
+        element = self.elements[handle]
+        written.add(handle)
+        yield ("begin", element.type, attribute)
+        yield ("attribute", "id", "elementid", self.ids[handle])
+        attributes = element.attributes
+        for i in range(0, len(attributes), 3):
+            name = attributes[i]
+            attr_type = attributes[i + 1]
+            value = attributes[i + 2]
+            if attr_type == "element":
+                if self.inline(value, handle, written):
+                    for event in self.element_events(value, name, written):
+                        yield event
+                else:
+                    yield ("attribute", name, attr_type, self.ids[value] if value >= 0 else "")
+            elif attr_type == "element_array":
+                yield ("array_begin", name, attr_type)
+                for item in value:
+                    if self.inline(item, handle, written):
+                        for event in self.element_events(item, None, written):
+                            yield event
+                    else:
+                        yield ("reference", self.ids[item] if item >= 0 else "")
+                yield ("array_end", name)
+            elif isinstance(value, _SessionPresetsLazyArray):
+                yield ("array", name, attr_type, value.values())
+            elif isinstance(value, _SessionPresetsTypedArray):
+                yield ("array", name, attr_type, value)
+            else:
+                yield ("attribute", name, attr_type, value)
+        yield ("end", element.type)
+    def events(self):
+        # The document as a dmx event stream again
+        if self.header is not None:
+            yield ("header", self.header)
+        written = set()
+        for handle in self.roots:
+            for event in self.element_events(handle, None, written):
+                yield event
+    def save(self, path):
+        # Write the document as keyvalues2, formatted the way SFM writes it
+        temp_path = path + ".tmp"
+        with _session_presets_open_dmx(temp_path, "w") as f:
+            writer = _SessionPresetsKV2Writer(f.write)
+            for event in self.events():
+                writer.write_event(event)
+        _session_presets_replace_file(temp_path, path)
+
+class SessionPresetsDirectorySnapshot:
+    # Cached listing of each directory sessions are created in, so checking whether a session exists doesn't touch the disk
+    # Each directory is listed with a single scandir, then trusted for ttl seconds or until refresh()
+    # Names are compared with os.path.normcase, case-insensitively on Windows like the file system does
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self.listings = {}
+        self.scans = 0
+    def key(self, directory):
+        return os.path.normcase(os.path.abspath(directory or "."))
+    def names(self, directory):
+        key = self.key(directory)
+        listing = self.listings.get(key)
+        now = time.time()
+        if listing is None or now - listing[0] > self.ttl:
+            names = set()
+            try:
+                if hasattr(os, "scandir"):
+                    for entry in os.scandir(key):
+                        names.add(os.path.normcase(entry.name))
+                else:
+                    for name in os.listdir(key):
+                        names.add(os.path.normcase(name))
+            except OSError:
+                # Directory doesn't exist (yet), nothing in it
+                pass
+            self.scans += 1
+            listing = (now, names)
+            self.listings[key] = listing
+        return listing[1]
+    def refresh(self, directory=None):
+        # Forget one directory's listing, or all of them
+        if directory is None:
+            self.listings = {}
+        else:
+            self.listings.pop(self.key(directory), None)
+    def exists(self, path):
+        directory, name = os.path.split(path)
+        return os.path.normcase(name) in self.names(directory)
+    def unique_name(self, directory, base_name, extension=".dmx"):
+        # First name that doesn't exist in directory, incrementing the number at the end of base_name (or appending 1)
+        names = self.names(directory)
+        while os.path.normcase(base_name + extension) in names:
+            # If the name ends in numbers, get the numbers and increment by 1
+            numbers = ""
+            for char in reversed(base_name):
+                if char.isdigit():
+                    numbers = char + numbers
+                else:
+                    break
+            if numbers:
+                new_number = str(int(numbers) + 1)
+                base_name = base_name[:-len(numbers)] + new_number
+            else:
+                # Append 1 to the name
+                base_name = base_name + "1"
+        return base_name
+
+class SessionPresetsFileProber:
+    # Checks whether files exist on worker threads, so slow or offline network shares don't block the Qt thread
+    # poll() returns (path, exists) for every check finished since the last poll, exists is None for checks still running after timeout seconds
+    # A worker stuck on an unreachable host is abandoned and replaced, its late result is still reported if anyone is polling
+    def __init__(self, workers=4, timeout=3.0):
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = []
+        # Worker name -> [path, started] for checks in progress
+        self.running = {}
+        self.abandoned = set()
+        self.results = []
+        self.active = 0
+        self.count = 0
+    def probe(self, path):
+        with self.lock:
+            self.pending.append(path)
+            self.start_workers()
+    def start_workers(self):
+        # Called with the lock held, workers exit once there's nothing left to check
+        while self.pending and self.active < self.workers:
+            self.active += 1
+            self.count += 1
+            thread = threading.Thread(target=self.run, name="SessionPresetsFileProber-%d" % self.count)
+            thread.daemon = True
+            thread.start()
+    def run(self):
+        name = threading.current_thread().name
+        while True:
+            with self.lock:
+                if name in self.abandoned:
+                    return
+                if not self.pending:
+                    self.active -= 1
+                    return
+                path = self.pending.pop(0)
+                self.running[name] = [path, time.time()]
+            try:
+                exists = os.path.isfile(path)
+            except Exception:
+                exists = False
+            with self.lock:
+                self.running.pop(name, None)
+                self.results.append((path, exists))
+    def poll(self):
+        with self.lock:
+            now = time.time()
+            for name, check in self.running.items():
+                if name not in self.abandoned and now - check[1] > self.timeout:
+                    self.abandoned.add(name)
+                    self.active -= 1
+                    self.results.append((check[0], None))
+            self.start_workers()
+            results = self.results
+            self.results = []
+        return results
+    def busy(self):
+        # True while there are checks that haven't been reported yet
+        with self.lock:
+            if self.pending or self.results:
+                return True
+            for name in self.running:
+                if name not in self.abandoned:
+                    return True
+        return False
+
+class SessionPresetsImporter:
+    # Runs job(path) for each path on a bounded pool of worker threads
+    # results holds (path, result, error) in the order of paths, or None for paths skipped by cancel()
+    # Threads rather than processes, SFM's embedded Python can't start worker processes and the work is mostly file reads and dmxconvert
+    def __init__(self, job, paths, workers=4):
+        self.job = job
+        self.paths = list(paths)
+        self.results = [None] * len(self.paths)
+        self.completed = 0
+        self.cancelled = False
+        self.next_index = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(max(1, min(workers, len(self.paths)))):
+            thread = threading.Thread(target=self.run, name="SessionPresetsImporter-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    def run(self):
+        while not self.cancelled:
+            with self.lock:
+                index = self.next_index
+                if index >= len(self.paths):
+                    return
+                self.next_index += 1
+            path = self.paths[index]
+            try:
+                result = (path, self.job(path), None)
+            except Exception as e:
+                result = (path, None, e)
+            with self.lock:
+                self.results[index] = result
+                self.completed += 1
+    def cancel(self):
+        # Files already being processed finish, the rest are skipped
+        self.cancelled = True
+    def wait(self, timeout=None):
+        # Returns True once every worker has finished
+        for thread in self.threads:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+        return True
+
+class SessionPresetsPrewarm:
+    # Runs prepare(*args) on a worker thread, wait() blocks until it's done and returns the result (or raises its error)
+    # Logs how much of the preparation happened before anything waited on it
+    def __init__(self, prepare, *args):
+        self.prepare = prepare
+        self.args = args
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self.run, name="SessionPresetsPrewarm")
+        self.thread.daemon = True
+        self.thread.start()
+    def run(self):
+        try:
+            self.result = self.prepare(*self.args)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+        self.finished = time.time()
+    def wait(self):
+        waiting = time.time()
+        self.thread.join()
+        done = time.time()
+        total = self.finished - self.started
+        overlapped = min(self.finished, waiting) - self.started
+        _session_presets_msg("Prepared session in %.3f seconds, %.3f seconds (%d%%) overlapped with SFM startup, waited %.3f seconds" % (total, overlapped, 100 * overlapped / max(total, 0.000001), done - waiting))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SessionPresetsFolderScan:
+    # Looks for .dmx files that were added, changed or removed in preset folders (and their subdirectories) on a worker thread
+    # known holds the (size, mtime) saved with each folder preset by path key, or None for presets added by hand, which are left alone
+    # Each directory is listed once, only files that are new or whose size or mtime changed are read, through job like SessionPresetsImporter
+    def __init__(self, folders, known, job, workers=4):
+        self.folders = list(folders)
+        self.known = known
+        self.job = job
+        self.workers = workers
+        # Every .dmx file found as (path, folder, size, mtime) and their path keys, keys of folders that couldn't be listed
+        self.files = []
+        self.found = set()
+        self.unreachable = set()
+        # (path, folder, size, mtime, preset, error) for each file that was read
+        self.results = []
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self.run, name="SessionPresetsFolderScan")
+        self.thread.daemon = True
+        self.thread.start()
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+    def list_directory(self, directory):
+        # (name, is_directory, size, mtime) of each subdirectory and .dmx file
+        entries = []
+        if hasattr(os, "scandir"):
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    entries.append((entry.name, True, 0, 0))
+                elif entry.name.lower().endswith(".dmx"):
+                    stat = entry.stat()
+                    entries.append((entry.name, False, stat.st_size, stat.st_mtime))
+        else:
+            # No scandir before Python 3.5, .dmx files are stat'ed one by one
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    entries.append((name, True, 0, 0))
+                elif name.lower().endswith(".dmx"):
+                    stat = os.stat(path)
+                    entries.append((name, False, stat.st_size, stat.st_mtime))
+        return entries
+    def scan(self, folder):
+        directories = [folder]
+        files = []
+        try:
+            while directories:
+                directory = directories.pop()
+                subdirectories = []
+                for name, is_directory, size, mtime in sorted(self.list_directory(directory)):
+                    path = os.path.join(directory, name)
+                    if is_directory:
+                        subdirectories.append(path)
+                    else:
+                        files.append((path, folder, size, mtime))
+                # Depth first in name order, like Add Folder
+                directories.extend(reversed(subdirectories))
+        except OSError as e:
+            # Offline share or a directory that went away while listing it, its presets are kept as they are
+            _session_presets_msg("Could not scan preset folder %s: %s" % (folder, e))
+            self.unreachable.add(self.key(folder))
+            return
+        for entry in files:
+            key = self.key(entry[0])
+            if key not in self.found:
+                self.found.add(key)
+                self.files.append(entry)
+    def run(self):
+        try:
+            for folder in self.folders:
+                self.scan(folder)
+            changed = []
+            for entry in self.files:
+                state = self.known.get(self.key(entry[0]), False)
+                if state is not None and state != (entry[2], entry[3]):
+                    changed.append(entry)
+            if changed:
+                importer = SessionPresetsImporter(self.job, [entry[0] for entry in changed], self.workers)
+                importer.wait()
+                for entry, result in zip(changed, importer.results):
+                    self.results.append(entry + result[1:])
+        except Exception:
+            traceback.print_exc()
+        self.finished = time.time()
+    def done(self):
+        return self.finished is not None
+    def wait(self):
+        self.thread.join()
+
+class SessionPresetsRegistry:
+    # Default and custom presets, looked up by name, id or path without going through every preset
+    # Rows are the items of the preset combo box: the default presets, a separator if any custom preset has a name,
+    # then the custom presets that have a name. The row of a preset is the preset index create_session takes
+    # Custom presets get an id when they're added, it's saved with them so it stays the same between sessions
+    def __init__(self, defaults=None, customs=None):
+        self.defaults = []
+        self.customs = []
+        # Index of each default preset by id and of each custom preset by id, ids of the custom presets with each
+        # name and path (usually one, the first in order wins)
+        self.default_ids = {}
+        self.default_names = {}
+        self.positions = {}
+        self.custom_names = {}
+        self.paths = {}
+        # Preset shown in each row (None for the separator) and the row of each custom preset by id
+        self.rows = []
+        self.custom_rows = {}
+        # Named custom presets before each custom preset, so rows after a change can be renumbered from there
+        self.named_before = []
+        # Incremented on every change, the preset combo is only rebuilt when this changed
+        self.version = 0
+        # Called with no arguments after every change, once the rows are up to date
+        self.listeners = []
+        self.set_defaults(defaults or [])
+        self.set_customs(customs or [])
+    def path_key(self, path):
+        return os.path.normcase(os.path.abspath(path)) if path else ""
+    def set_defaults(self, presets):
+        self.defaults = list(presets)
+        self.default_ids = {}
+        self.default_names = {}
+        for i, preset in enumerate(self.defaults):
+            preset_id = preset.get("id", "")
+            if preset_id:
+                self.default_ids.setdefault(preset_id, i)
+            self.default_names.setdefault(preset.get("name", ""), i)
+        # Every custom row moves with the defaults
+        self.rows = list(self.defaults)
+        self.reindex(0)
+    def set_customs(self, presets):
+        self.customs = []
+        self.positions = {}
+        self.custom_names = {}
+        self.paths = {}
+        self.custom_rows = {}
+        self.named_before = []
+        for preset in presets:
+            if not preset.get("id", ""):
+                preset["id"] = str(uuid.uuid4())
+            self.customs.append(preset)
+            self.link(preset)
+        del self.rows[len(self.defaults):]
+        self.reindex(0)
+    def link(self, preset, unlink=False):
+        # Add preset to (or remove it from) the name and path lookups
+        preset_id = preset["id"]
+        for table, key in ((self.custom_names, preset.get("name", "")), (self.paths, self.path_key(preset.get("path", "")))):
+            ids = table.get(key)
+            if not unlink:
+                if ids is None:
+                    table[key] = [preset_id]
+                else:
+                    ids.append(preset_id)
+            elif ids is not None and preset_id in ids:
+                ids.remove(preset_id)
+                if not ids:
+                    del table[key]
+    def add_custom(self, preset, index=None):
+        if not preset.get("id", ""):
+            preset["id"] = str(uuid.uuid4())
+        if index is None:
+            index = len(self.customs)
+        self.customs.insert(index, preset)
+        self.link(preset)
+        self.reindex(index)
+        return index
+    def remove_custom(self, index):
+        return self.remove_customs(index, index + 1)[0]
+    def remove_customs(self, start, end):
+        # Remove the custom presets from index start up to end, renumbering the ones after them once
+        presets = self.customs[start:end]
+        del self.customs[start:end]
+        for preset in presets:
+            self.link(preset, unlink=True)
+            self.positions.pop(preset["id"], None)
+            self.custom_rows.pop(preset["id"], None)
+        self.reindex(start)
+        return presets
+    def move_custom(self, index, new_index):
+        # Only the presets between the old and new index move
+        self.customs.insert(new_index, self.customs.pop(index))
+        self.reindex(min(index, new_index), max(index, new_index))
+    def update_custom(self, index, changes):
+        # Change fields of a custom preset (name, path, description...)
+        # Lookups are updated in place, rows are only renumbered when the preset gains or loses its name (and its row)
+        preset = self.customs[index]
+        was_named = bool(preset.get("name", ""))
+        self.link(preset, unlink=True)
+        preset.update(changes)
+        self.link(preset)
+        if bool(preset.get("name", "")) != was_named:
+            self.reindex(index)
+        else:
+            self.changed()
+    def changed(self):
+        self.version += 1
+        for listener in self.listeners:
+            listener()
+    def reindex(self, start, end=None):
+        # Renumber custom presets from index start to end (the last one by default), the ones outside haven't moved
+        # A range that ends before the last preset must keep its number of named presets, like when presets are moved
+        default_count = len(self.defaults)
+        if start:
+            named = self.named_before[start - 1] + (1 if self.customs[start - 1].get("name", "") else 0)
+        else:
+            named = 0
+        if end is not None and end < len(self.customs) - 1:
+            row = default_count + 1 + named
+            for i in range(start, end + 1):
+                preset = self.customs[i]
+                self.positions[preset["id"]] = i
+                self.named_before[i] = named
+                if preset.get("name", ""):
+                    self.custom_rows[preset["id"]] = row
+                    self.rows[row] = preset
+                    row += 1
+                    named += 1
+            self.changed()
+            return
+        del self.named_before[start:]
+        del self.rows[default_count + 1 + named:]
+        if len(self.rows) == default_count:
+            self.rows.append(None)
+        for i in range(start, len(self.customs)):
+            preset = self.customs[i]
+            preset_id = preset["id"]
+            self.positions[preset_id] = i
+            self.named_before.append(named)
+            if preset.get("name", ""):
+                self.custom_rows[preset_id] = len(self.rows)
+                self.rows.append(preset)
+                named += 1
+            else:
+                self.custom_rows.pop(preset_id, None)
+        if len(self.rows) == default_count + 1:
+            # No named custom presets, no separator
+            self.rows.pop()
+        self.changed()
+    def first(self, table, key):
+        # Index of the first custom preset in a name or path lookup, -1 if there is none
+        ids = table.get(key)
+        if not ids:
+            return -1
+        if len(ids) == 1:
+            return self.positions[ids[0]]
+        return min([self.positions[preset_id] for preset_id in ids])
+    def indices(self, path):
+        # Indices of every custom preset made from a dmx file
+        return sorted([self.positions[preset_id] for preset_id in self.paths.get(self.path_key(path), [])])
+    def find(self, name, is_default=None):
+        # Preset by name and whether it's a default preset, (None, False) if it wasn't found
+        # is_default limits the search to default (True) or custom (False) presets, None searches defaults first
+        if is_default is not False:
+            i = self.default_names.get(name)
+            if i is not None:
+                return self.defaults[i], True
+        if is_default is not True:
+            i = self.first(self.custom_names, name)
+            if i != -1:
+                return self.customs[i], False
+        return None, False
+    def find_path(self, path):
+        # Custom preset made from a dmx file, None if there is none
+        i = self.first(self.paths, self.path_key(path))
+        return self.customs[i] if i != -1 else None
+    def get(self, preset_id):
+        i = self.default_ids.get(preset_id)
+        if i is not None:
+            return self.defaults[i]
+        i = self.positions.get(preset_id)
+        if i is not None:
+            return self.customs[i]
+        return None
+    def row(self, name, is_default=None):
+        # Combo row of a preset by name, -1 if it wasn't found or is a custom preset without a name
+        preset, preset_is_default = self.find(name, is_default)
+        if preset is None:
+            return -1
+        if preset_is_default:
+            return self.default_names[name]
+        return self.custom_rows.get(preset["id"], -1)
+    def row_of_id(self, preset_id):
+        i = self.default_ids.get(preset_id)
+        if i is not None:
+            return i
+        return self.custom_rows.get(preset_id, -1)
+    def at(self, row):
+        # Preset shown in a combo row and whether it's a default preset, (None, False) for the separator or no row
+        if row < 0 or row >= len(self.rows):
+            return None, False
+        return self.rows[row], row < len(self.defaults)
+
+class SessionPresetsSearchIndex:
+    # Trigram index over the names and descriptions of a registry's presets, for filtering the preset list as the user types
+    # Queries of three characters or more only look at presets that have every trigram of the query,
+    # shorter ones check every preset. A query that extends the previous one only checks the previous results
+    def __init__(self, registry):
+        self.registry = registry
+        self.version = None
+        # Lowercased "name\ndescription" of each registry row ("" for the separator), rows having each trigram
+        self.texts = []
+        self.trigrams = {}
+        self.last_query = None
+        self.last_results = None
+    def update(self):
+        # Index the registry again if it changed since the last search
+        if self.version == self.registry.version:
+            return
+        self.version = self.registry.version
+        self.texts = []
+        self.trigrams = {}
+        self.last_query = None
+        self.last_results = None
+        trigrams = self.trigrams
+        for row, preset in enumerate(self.registry.rows):
+            text = ""
+            if preset is not None:
+                text = (preset.get("name", "") + "\n" + preset.get("description", "")).lower()
+            self.texts.append(text)
+            for trigram in set([text[i:i + 3] for i in range(len(text) - 2)]):
+                rows = trigrams.get(trigram)
+                if rows is None:
+                    trigrams[trigram] = [row]
+                else:
+                    rows.append(row)
+    def search(self, query):
+        # Registry rows of the presets whose name or description contains query (ignoring case) in row order,
+        # None for an empty query, which doesn't filter anything
+        self.update()
+        query = query.strip().lower()
+        if not query:
+            return None
+        if self.last_query is not None and query.startswith(self.last_query):
+            candidates = self.last_results
+        elif len(query) >= 3:
+            # Rows are appended in order, so each trigram's rows are sorted, start from the rarest one
+            postings = []
+            for trigram in set([query[i:i + 3] for i in range(len(query) - 2)]):
+                rows = self.trigrams.get(trigram)
+                if rows is None:
+                    postings = None
+                    break
+                postings.append(rows)
+            if postings is None:
+                candidates = []
+            else:
+                postings.sort(key=len)
+                candidates = postings[0]
+                if len(postings) > 1:
+                    others = [set(rows) for rows in postings[1:]]
+                    candidates = [row for row in candidates if all([row in rows for rows in others])]
+        else:
+            candidates = range(len(self.texts))
+        texts = self.texts
+        results = [row for row in candidates if query in texts[row]]
+        self.last_query = query
+        self.last_results = results
+        return results
+
+class SessionPresetsListModel(QtCore.QAbstractListModel if QtCore else object):
+    # Rows of a SessionPresetsRegistry for a preset combo box, optionally filtered by a SessionPresetsSearchIndex query
+    # Item text and tooltips are made when the view asks for them, which is only for the rows on screen
+    # Registry changes are shown as one layout change on the next event loop pass, so a batch of them (a folder merge) is one update
+    def __init__(self, registry, search_index, describe, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.registry = registry
+        self.search_index = search_index
+        # Called with a custom preset for its tooltip
+        self.describe = describe
+        self.query = ""
+        # Registry row shown in each model row, the registry's rows and version when they were taken
+        self.rows = []
+        self.shown = []
+        self.version = None
+        self.update_pending = False
+        self.autoload_row = -1
+        self.append = ""
+        registry.listeners.append(self.registry_changed)
+    def update_rows(self):
+        results = self.search_index.search(self.query) if self.query else None
+        self.rows = range(len(self.registry.rows)) if results is None else results
+        self.shown = list(self.registry.rows)
+        self.version = self.registry.version
+    def reset(self, autoload_row=-1, append=None):
+        # Show the registry's rows again, through the current query
+        self.beginResetModel()
+        self.autoload_row = autoload_row
+        if append is not None:
+            self.append = append
+        self.update_rows()
+        self.endResetModel()
+    def registry_changed(self):
+        if not self.update_pending:
+            self.update_pending = True
+            QtCore.QTimer.singleShot(0, self.update_layout)
+    def update_layout(self):
+        # Show the registry's rows after it changed, persistent indexes (the combo's current item) stay on the preset
+        # they showed, or become invalid if it's gone
+        self.update_pending = False
+        if self.version == self.registry.version:
+            return
+        self.layoutAboutToBeChanged.emit()
+        moved = [(index, self.shown_preset(self.registry_row(index.row()))) for index in self.persistentIndexList()]
+        autoload = self.shown_preset(self.autoload_row)
+        self.update_rows()
+        self.autoload_row = self.row_of(autoload)
+        for index, preset in moved:
+            row = self.index_of(self.row_of(preset))
+            self.changePersistentIndex(index, self.index(row, 0) if row != -1 else QtCore.QModelIndex())
+        self.layoutChanged.emit()
+    def shown_preset(self, registry_row):
+        # Preset a registry row had when the rows were last taken
+        return self.shown[registry_row] if 0 <= registry_row < len(self.shown) else None
+    def row_of(self, preset):
+        # Registry row of a preset now, -1 for none
+        if preset is None:
+            return -1
+        if preset.get("id", ""):
+            return self.registry.row_of_id(preset["id"])
+        # Only default presets can be without an id
+        return self.registry.default_names.get(preset.get("name", ""), -1)
+    def set_query(self, query):
+        self.query = query
+        self.reset(self.autoload_row)
+    def registry_row(self, index):
+        # Registry row (the preset index create_session takes) shown at a model row, -1 for none
+        if 0 <= index < len(self.rows):
+            return self.rows[index]
+        return -1
+    def index_of(self, registry_row):
+        # Model row showing a registry row, -1 if it's filtered out
+        if self.query:
+            i = bisect.bisect_left(self.rows, registry_row)
+            return i if i < len(self.rows) and self.rows[i] == registry_row else -1
+        return registry_row if 0 <= registry_row < len(self.rows) else -1
+    def rowCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.rows)
+    def data(self, index, role=None):
+        # The registry may have changed since the rows were taken, until update_layout runs
+        row = self.registry_row(index.row())
+        if not 0 <= row < len(self.registry.rows):
+            return None
+        preset = self.registry.rows[row]
+        if preset is None:
+            if role == QtCore.Qt.AccessibleDescriptionRole:
+                # How QComboBox tells separators apart
+                return "separator"
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            if row == self.autoload_row:
+                return preset.get("name", "") + self.append
+            return preset.get("name", "")
+        if role == QtCore.Qt.ToolTipRole and row > len(self.registry.defaults):
+            return self.describe(preset)
+        return None
+    def flags(self, index):
+        row = self.registry_row(index.row())
+        if not 0 <= row < len(self.registry.rows) or self.registry.rows[row] is None:
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+class SessionPresetsTableModel(QtCore.QAbstractTableModel if QtCore else object):
+    # Custom presets of a SessionPresetsRegistry for the preset editor's table: name, path and description
+    # Edits go straight to the registry, moves, insertions and removals only signal the rows they touch
+    # Whether a path exists is checked the first time its row is drawn, in the background through check_paths
+    columns = ("name", "path", "description")
+    headers = ("Name", "Path", "Description")
+    def __init__(self, registry, check_paths, renamed, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.registry = registry
+        # Called with a list of paths to check, results come back through path_checked
+        self.check_paths = check_paths
+        # Called with the old and new name when a preset is renamed
+        self.renamed = renamed
+        # True if a path exists, False if it doesn't, None if checking it timed out, by path key
+        self.path_states = {}
+        # Path keys being checked, paths drawn since the last batch was sent to check_paths
+        self.checking = set()
+        self.unchecked = []
+    def rowCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.registry.customs)
+    def columnCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.columns)
+    def headerData(self, section, orientation, role=None):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal and 0 <= section < len(self.headers):
+            return self.headers[section]
+        return None
+    def data(self, index, role=None):
+        if not index.isValid() or index.row() >= len(self.registry.customs):
+            return None
+        preset = self.registry.customs[index.row()]
+        column = self.columns[index.column()]
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.EditRole:
+            return preset.get(column, "")
+        if column == "path" and (role == QtCore.Qt.ForegroundRole or role == QtCore.Qt.ToolTipRole):
+            # Path colors: gray while checking, red if the file does not exist, orange if the check timed out
+            state = self.path_state(preset.get("path", ""))
+            if state is True:
+                return None
+            if state == "checking":
+                color, tooltip = (128, 128, 128), "Checking..."
+            elif state is None:
+                color, tooltip = (255, 160, 0), "Not responding"
+            else:
+                color, tooltip = (255, 0, 0), "File does not exist"
+            if role == QtCore.Qt.ToolTipRole:
+                return tooltip
+            return QtGui.QBrush(QtGui.QColor(*color))
+        return None
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        # Paths are picked with a file dialog instead
+        if self.columns[index.column()] != "path":
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+    def setData(self, index, value, role=None):
+        if role is not None and role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        row = index.row()
+        column = self.columns[index.column()]
+        old_value = self.registry.customs[row].get(column, "")
+        if value == old_value:
+            return False
+        self.registry.update_custom(row, {column: value})
+        self.dataChanged.emit(index, index)
+        if column == "name":
+            self.renamed(old_value, value)
+        return True
+    def path_state(self, path):
+        # State of a path, "checking" if it isn't known yet, the first time a path is asked for starts checking it
+        key = self.registry.path_key(path)
+        if key in self.path_states:
+            return self.path_states[key]
+        if key not in self.checking:
+            self.checking.add(key)
+            if not self.unchecked:
+                # Every row drawn in this pass is checked together
+                QtCore.QTimer.singleShot(0, self.check_unchecked)
+            self.unchecked.append(path)
+        return "checking"
+    def check_unchecked(self):
+        paths = self.unchecked
+        self.unchecked = []
+        if paths:
+            self.check_paths(paths)
+    def path_checked(self, path, exists):
+        key = self.registry.path_key(path)
+        self.checking.discard(key)
+        self.path_states[key] = exists
+        column = self.columns.index("path")
+        for row in self.registry.indices(path):
+            index = self.index(row, column)
+            self.dataChanged.emit(index, index)
+    def blocks(self, rows):
+        # Sorted rows grouped into runs of adjacent rows, as (first, last) pairs
+        blocks = []
+        for row in sorted(set(rows)):
+            if blocks and blocks[-1][1] == row - 1:
+                blocks[-1] = (blocks[-1][0], row)
+            else:
+                blocks.append((row, row))
+        return blocks
+    def insert_presets(self, presets):
+        # Append presets as one insertion, returns the row of the first one
+        first = len(self.registry.customs)
+        if presets:
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(presets) - 1)
+            for preset in presets:
+                self.registry.add_custom(preset)
+            self.endInsertRows()
+        return first
+    def remove_rows(self, rows):
+        # One removal per run of adjacent rows, from the bottom up so the rows above keep their numbers
+        for first, last in reversed(self.blocks(rows)):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            self.registry.remove_customs(first, last + 1)
+            self.endRemoveRows()
+    def move_rows(self, rows, offset):
+        # Move rows up (offset -1) or down (offset 1) by one, returns their new rows
+        # Each run of adjacent rows moves as one: the row next to it goes to its other side
+        # Nothing moves if a run is already at the top or bottom
+        blocks = self.blocks(rows)
+        if not blocks or offset < 0 and blocks[0][0] == 0 or offset > 0 and blocks[-1][1] == len(self.registry.customs) - 1:
+            return sorted(set(rows))
+        parent = QtCore.QModelIndex()
+        for first, last in (blocks if offset < 0 else reversed(blocks)):
+            if offset < 0:
+                self.beginMoveRows(parent, first - 1, first - 1, parent, last + 1)
+                self.registry.move_custom(first - 1, last)
+            else:
+                self.beginMoveRows(parent, last + 1, last + 1, parent, first)
+                self.registry.move_custom(last + 1, first)
+            self.endMoveRows()
+        return [row + offset for row in sorted(set(rows))]
+
 class SessionPresets:
-    def __init__(self, already_initialized=False):
+    def __init__(self, already_initialized=False, headless=False):
+        # headless only loads options and caches, for using the session functions outside of SFM's UI (benchmarks)
         _session_presets_msg("Initializing Session Presets Script v%s" % _session_presets_version)
         self.cwd = os.getcwd()
         self.descriptor = "SFM Session Presets v%s by KiwifruitDev" % _session_presets_version
         self.options_file = "session_presets.json"
+        self.options_store = SessionPresetsOptionsStore(os.path.join(self.cwd, self.options_file), qt=not headless and QtCore is not None)
+        self.trace_file = "session_presets_trace.jsonl"
+        self.tracer = SessionPresetsTracer(os.path.join(self.cwd, self.trace_file))
+        self.trace_enabled = True
+        self.trace_max_kb = 1024
+        self.profile_next_session = False
+        self.metadata_cache_file = "session_presets_cache.json"
+        self.metadata_cache_hash = False
+        self.metadata_cache = None
+        self.converted_cache_directory = "session_presets_cache"
+        self.converted_cache_budget_mb = 1024
+        self.converted_cache = None
+        self.prewarm = None
+        self.import_workers = 4
+        self.directory_snapshot = SessionPresetsDirectorySnapshot()
+        self.probe_workers = 4
+        self.probe_timeout = 3.0
+        self.default_sessions_override = ""
+        self.default_sessions_path = ""
+        self.default_sessions_mtime = None
+        self.retime_keyframes = True
+        self.preset_folders = []
+        # (size, mtime) of files in preset folders that couldn't be imported by path key, they're only read again once they change
+        self.preset_folder_skipped = {}
+        self.folder_scan = None
+        self.folder_scan_timer = None
+        self.editing_presets = False
         self.autoload_preset = "Blank"
         self.autoload_enabled = False
         self.setting_autoload_enabled = False
@@ -144,33 +3436,58 @@ class SessionPresets:
                 "id": "86157d42-842c-466c-b2ac-bc099a5d431c"
             }
         ]
-        self.default_presets = default_presets
-        self.custom_presets = []
-        self.windowFlags = QtCore.Qt.Dialog | QtCore.Qt.WindowCloseButtonHint | QtCore.Qt.WindowSystemMenuHint | QtCore.Qt.MSWindowsFixedSizeDialogHint
+        # Default and custom presets, see SessionPresetsRegistry
+        self.registry = SessionPresetsRegistry(default_presets)
+        self.windowFlags = QtCore.Qt.Dialog | QtCore.Qt.WindowCloseButtonHint | QtCore.Qt.WindowSystemMenuHint | QtCore.Qt.MSWindowsFixedSizeDialogHint if QtCore else 0
         self.cwd = os.getcwd()
         self.dmxConvert = self.cwd + r"\bin\dmxconvert.exe"
-        self.presets = []
         self.added_separator_header = False
+        self.new_session_dialogs = {}
 
+        with self.tracer.span("init", headless=headless):
+            self.start(already_initialized, headless, default_presets)
+    def start(self, already_initialized, headless, default_presets):
+        # Everything __init__ does after setting defaults, timed as the "init" span
         # Manipulate the function in memory that shows the startup wizard to prevent it from appearing
-        if not already_initialized:
-            self.disable_start_wizard_patch()
+        if not already_initialized and not headless:
+            with self.tracer.span("disable_start_wizard_patch"):
+                self.disable_start_wizard_patch()
         
         # Load the options from file or set defaults if they are corrupt
-        self.load_options()
-        if len(self.default_presets) == 0 or type(self.default_presets[0]) is not dict or self.default_presets[0].get("name", "") == "":
+        with self.tracer.span("load_options"):
+            self.load_options()
+        self.tracer.enabled = self.trace_enabled
+        self.tracer.max_bytes = self.trace_max_kb * 1024
+        with self.tracer.span("load_caches"):
+            self.metadata_cache = SessionPresetsMetadataCache(os.path.join(self.cwd, self.metadata_cache_file), self.metadata_cache_hash)
+            self.converted_cache = SessionPresetsConvertedCache(os.path.join(self.cwd, self.converted_cache_directory), self.converted_cache_budget_mb * 1024 * 1024)
+        if len(self.registry.defaults) == 0 or type(self.registry.defaults[0]) is not dict or self.registry.defaults[0].get("name", "") == "":
             # Reset to default default settings
             _session_presets_msg("Resetting default presets to built-in defaults.")
-            self.default_presets = default_presets
+            self.registry.set_defaults(default_presets)
             self.autoload_preset = "Blank"
             self.autoload_enabled = False
             self.autoload_preset_is_default = True
             self.default_session_framerate = 24.0
             self.default_session_title = "Default Startup Sessions"
             self.save_options()
+        if self.preset_folders:
+            self.scan_preset_folders()
+            if headless:
+                # Nothing to merge them in the background without Qt
+                self.folder_scan.wait()
+                self.merge_preset_folders()
+        if headless:
+            return
+        if self.folder_scan is not None:
+            # Merged on the Qt thread once the scan is done
+            self.folder_scan_timer = QtCore.QTimer()
+            self.folder_scan_timer.timeout.connect(self.poll_preset_folders)
+            self.folder_scan_timer.start(100)
 
         # Replace New in the File menu with our own handler
-        self.add_window_actions()
+        with self.tracer.span("add_window_actions"):
+            self.add_window_actions()
 
         # Check to make sure we haven't already loaded a document (autosave recovery)
         if sfmApp.HasDocument():
@@ -189,35 +3506,14 @@ class SessionPresets:
             reg_framerate = self.get_registry_value("FrameRate")
             if reg_directory and reg_filename and reg_framerate:
                 framerate = float(reg_framerate)
-                preset_index = -1
-                default_count = len(self.default_presets)
-                for i in range(len(self.default_presets)):
-                    if self.autoload_preset_is_default:
-                        if self.default_presets[i].get("name", "") == self.autoload_preset:
-                            preset_index = i
-                            break
-                if preset_index == -1:
-                    for i in range(len(self.presets)):
-                        if not self.autoload_preset_is_default:
-                            if self.presets[i].get("name", "") == self.autoload_preset:
-                                preset_index = default_count + 1 + i # +1 for separator
-                                break
+                preset_index = self.find_preset_index(self.autoload_preset, self.autoload_preset_is_default)
                 # Ensure the name does not already exist in the selected directory
-                while os.path.exists(os.path.join(reg_directory, reg_filename + ".dmx")):
-                    # If the name ends in numbers, get the numbers and increment by 1
-                    numbers = ""
-                    for char in reversed(reg_filename):
-                        if char.isdigit():
-                            numbers = char + numbers
-                        else:
-                            break
-                    if numbers:
-                        new_number = str(int(numbers) + 1)
-                        reg_filename = reg_filename[:-len(numbers)] + new_number
-                    else:
-                        # Append 1 to the name
-                        reg_filename = reg_filename + "1"
-                self.create_session(preset_index, framerate, reg_filename, reg_directory)
+                reg_filename = self.directory_snapshot.unique_name(reg_directory, reg_filename)
+                self.prewarm_session(preset_index, framerate, reg_filename, reg_directory)
+    def find_preset_index(self, name, is_default=None):
+        # Returns the preset list index of a preset by name, as used by create_session, or -1 if it wasn't found
+        # is_default limits the search to default (True) or custom (False) presets, None searches defaults first
+        return self.registry.row(name, is_default)
     def should_show_start_wizard(self):
         # Check if we should show the startup wizard
         if self.autoload_enabled:
@@ -235,152 +3531,268 @@ class SessionPresets:
         return True
     def convert_dmx_file(self, path, out):
         # Run dmxconvert to convert a dmx file to keyvalues2 format in order to read and modify it
+        # Raises with what went wrong instead of showing it, this runs on import and folder scan worker threads
+        # where nothing may touch the UI. Errors are shown on the Qt thread by whoever started the work
 
         # Convert paths to proper OS format
-        dmxconvert = os.path.normpath(self.dmxConvert)
-        if not os.path.isfile(dmxconvert):
-            _session_presets_error_msg("dmxconvert executable not found: %s" % dmxconvert)
-            return None
         path = os.path.normpath(path)
         if not os.path.isfile(path):
-            _session_presets_error_msg("dmxconvert input file does not exist: %s" % path)
-            return None
+            raise Exception("dmxconvert input file does not exist: %s" % path)
         out = os.path.normpath(out)
 
         # Delete the output file if it currently exists
         # We should've already prompted the user to save any unsaved changes before calling this function
         if os.path.isfile(out):
             os.remove(out)
-        
-        # Run dmxconvert using system call
+
+        # Files that are already keyvalues2 only need to be copied
+        header = _session_presets_dmx_header(path)
+        if header and header[0] == "keyvalues2":
+            shutil.copyfile(path, out)
+            if os.path.isfile(out):
+                return out
+            return None
+
+        dmxconvert = os.path.normpath(self.dmxConvert)
+        if not os.path.isfile(dmxconvert):
+            raise Exception("dmxconvert executable not found: %s" % dmxconvert)
+
+        # Run dmxconvert directly, paths are passed as arguments as they are without going through a shell
+        # The shell used to hide dmxconvert's console window, it's hidden here instead (STARTF_USESHOWWINDOW, SW_HIDE)
         args = [dmxconvert, "-i", path, "-o", out, "-oe", "keyvalues2"]
-        proc = subprocess.Popen(args, shell=True)
-        return_code = proc.wait()
+        startupinfo = None
+        if hasattr(subprocess, "STARTUPINFO"):
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= 1
+            startupinfo.wShowWindow = 0
+        with self.tracer.span("dmxconvert", size=os.path.getsize(path)):
+            proc = subprocess.Popen(args, startupinfo=startupinfo)
+            return_code = proc.wait()
         if return_code != 0:
-            _session_presets_error_msg("dmxconvert failed to convert file %s. Return code: %d" % (path, return_code))
-            return None
+            raise Exception("dmxconvert failed to convert file %s. Return code: %d" % (path, return_code))
 
         # Check if out was created
         if os.path.isfile(out):
             return out
         return None
-    def replace_name_and_framerate_in_dmx(self, dmx_path, original_filename, filename, original_framerate, framerate, is_default):
-        # Read the dmx file line-by-line and replace the session name and framerate
-        # Also handles default session special cases, since the default session is formatted in a specific way
-        search_filename = '"name" "string" "' + original_filename + '"'
+    def get_converted_preset(self, preset_path, out):
+        # Returns a keyvalues2 file with the preset's contents to read from:
+        # the preset itself if it's already keyvalues2, its cached conversion, or a new conversion written to out
+        # Raises if dmxconvert fails, see convert_dmx_file
+        header = _session_presets_dmx_header(preset_path)
+        if header and header[0] == "keyvalues2":
+            return preset_path
+        if not self.converted_cache or self.converted_cache_budget_mb <= 0:
+            return self.convert_dmx_file(preset_path, out)
+        if self.metadata_cache:
+            source_hash = self.metadata_cache.get_hash(preset_path)
+        else:
+            source_hash = _session_presets_hash_file(preset_path)
+        if not source_hash:
+            return None
+        cached_path = self.converted_cache.get(preset_path, source_hash, self.convert_dmx_file)
+        stats = self.converted_cache.stats()
+        _session_presets_msg("Converted preset cache: %d hits, %d misses, %d evictions, %d entries, %.1f MB" % (stats["hits"], stats["misses"], stats["evictions"], stats["entries"], stats["bytes"] / 1048576.0))
+        return cached_path
+    def import_preset(self, file_path):
+        # Validate a preset file and read what the preset editor needs from it, runs on import worker threads
+        # Binary presets are also converted into the converted cache, so creating a session from them later is quick
+        if not os.path.isfile(file_path):
+            raise Exception("File does not exist")
+        header = _session_presets_dmx_header(file_path)
+        if not header:
+            raise Exception("Not a dmx file")
+        metadata = self.get_preset_metadata(file_path)
+        if not metadata:
+            raise Exception("Could not read session from dmx file")
+        if header[0] == "binary" and self.converted_cache and self.converted_cache_budget_mb > 0:
+            if not self.get_converted_preset(file_path, None):
+                raise Exception("Failed to convert dmx file")
+        session_name = metadata["name"]
+        if not session_name:
+            # Convert file name to session name by removing extension, replacing underscores or dashes with spaces, and capitalizing words
+            base_name = os.path.basename(file_path)
+            name_without_ext = os.path.splitext(base_name)[0]
+            session_name = name_without_ext.replace("_", " ").replace("-", " ").title()
+        return {
+            "name": session_name,
+            "description": "",
+            "path": file_path
+        }
+    def scan_preset_folders(self):
+        # Start looking for added, changed and removed presets in preset folders, see SessionPresetsFolderScan
+        known = {}
+        for preset in self.registry.customs:
+            if preset.get("folder", ""):
+                known[self.registry.path_key(preset.get("path", ""))] = (preset.get("size", 0), preset.get("mtime", 0))
+            else:
+                known[self.registry.path_key(preset.get("path", ""))] = None
+        for key, snapshot in self.preset_folder_skipped.items():
+            known[key] = tuple(snapshot)
+        self.folder_scan = SessionPresetsFolderScan(self.preset_folders, known, self.import_preset, self.import_workers)
+    def merge_preset_folders(self):
+        # Apply a finished folder scan to the custom presets, returns True if any preset was added, updated or removed
+        # Skipped files are remembered too, a folder that didn't change since the last scan doesn't save anything
+        scan = self.folder_scan
+        if scan is None or not scan.done():
+            return False
+        self.folder_scan = None
+        start_time = time.time()
+        folders = set([scan.key(folder) for folder in scan.folders])
+        # Presets whose file is gone, or whose folder isn't a preset folder anymore, unless their folder couldn't be listed
+        removed = []
+        for i, preset in enumerate(self.registry.customs):
+            folder = preset.get("folder", "")
+            if not folder:
+                continue
+            folder_key = scan.key(folder)
+            if folder_key not in folders or folder_key not in scan.unreachable and self.registry.path_key(preset.get("path", "")) not in scan.found:
+                removed.append(i)
+        blocks = []
+        for i in removed:
+            if blocks and blocks[-1][1] == i:
+                blocks[-1][1] = i + 1
+            else:
+                blocks.append([i, i + 1])
+        for start, end in reversed(blocks):
+            self.registry.remove_customs(start, end)
+        skipped = len(self.preset_folder_skipped)
+        if not scan.unreachable:
+            # Folders that couldn't be listed may still have their skipped files
+            for key in list(self.preset_folder_skipped.keys()):
+                if key not in scan.found:
+                    del self.preset_folder_skipped[key]
+        added = updated = 0
+        for file_path, folder, size, mtime, preset, error in scan.results:
+            key = self.registry.path_key(file_path)
+            if error is not None:
+                _session_presets_msg("Could not import preset %s: %s" % (file_path, error))
+                self.preset_folder_skipped[key] = [size, mtime]
+                continue
+            self.preset_folder_skipped.pop(key, None)
+            existing = self.registry.find_path(file_path)
+            if existing is None:
+                self.registry.add_custom({
+                    "name": preset["name"],
+                    "order": len(self.registry.customs),
+                    "description": preset["description"],
+                    "path": file_path,
+                    "folder": folder,
+                    "size": size,
+                    "mtime": mtime
+                })
+                added += 1
+            else:
+                # Names and descriptions may have been edited, only the snapshot changes
+                self.registry.update_custom(self.registry.positions[existing["id"]], {"size": size, "mtime": mtime})
+                updated += 1
+        seconds = scan.finished - scan.started
+        _session_presets_msg("Scanned %d preset folders in %.3f seconds: %d files, %d read, %d added, %d updated, %d removed" % (len(scan.folders), seconds, len(scan.files), len(scan.results), added, updated, len(removed)))
+        self.tracer.record("preset_folders", seconds, files=len(scan.files), read=len(scan.results), added=added, updated=updated, removed=len(removed), merge=time.time() - start_time)
+        if scan.results or removed or skipped != len(self.preset_folder_skipped):
+            self.save_options()
+        return bool(added or updated or removed)
+    def poll_preset_folders(self):
+        # Timer callback while a folder scan runs, presets aren't merged under an open preset editor
+        if self.editing_presets or self.folder_scan is not None and not self.folder_scan.done():
+            return
+        self.folder_scan_timer.stop()
+        if self.merge_preset_folders():
+            for new_session_dialog in self.new_session_dialogs.values():
+                new_session_dialog["presets_changed"]()
+    def find_converted_preset(self, preset_path):
+        # The keyvalues2 file to read a preset from without converting anything: its cached conversion if it's a binary
+        # preset in the converted cache, the preset itself otherwise. The preset is only hashed if its hash isn't known
+        header = _session_presets_dmx_header(preset_path)
+        if not header or header[0] != "binary" or not self.converted_cache or self.converted_cache_budget_mb <= 0 or not self.metadata_cache:
+            return preset_path
+        source_hash = self.metadata_cache.get_hash(preset_path, compute=False)
+        if source_hash:
+            cached_path = self.converted_cache.lookup(source_hash)
+            if cached_path:
+                return cached_path
+        return preset_path
+    def stream_session(self, dmx_path, out_path, filename, framerate, session_name, source_framerate):
+        # Write a session from a preset in one pass, see _session_presets_stream_session
+        result = _session_presets_stream_session(dmx_path, out_path, filename, framerate, session_name, source_framerate, self.default_session_framerate, self.retime_keyframes)
+        size = os.path.getsize(out_path)
+        if result["probed"]:
+            read = "name and framerate probed separately"
+        elif result["buffered"]:
+            read = "%.1f KB buffered for name and framerate" % (result["buffered"] / 1024.0)
+        else:
+            read = "name and framerate cached"
+        _session_presets_msg("Wrote %s from %s in one pass: %.1f MB in %.3f seconds (%.1f MB/s), %s" % (out_path, dmx_path, size / 1048576.0, result["seconds"], size / 1048576.0 / max(result["seconds"], 0.000001), read))
+        if result["retimed"]:
+            stats = result["stats"]
+            _session_presets_msg("Retimed to %s fps: %d keys in %d layers, %d merged" % (_session_presets_format_float(framerate), stats["keys"], stats["layers"], stats["dropped"]))
+        return result
+    def replace_name_and_framerate_in_dmx(self, dmx_path, original_filename, filename, original_framerate, framerate, out_path=None):
+        # Stream the dmx file to out_path (or back to dmx_path) replacing the session name and framerate
+        # Default sessions are renamed while they're extracted instead, see write_session_file
+        # Names are matched and written the way they appear in the file, escaped
+        replacements = {}
+        if original_filename:
+            replacements['"name" "string" "' + _session_presets_kv2_escape(original_filename) + '"'] = '"name" "string" "' + _session_presets_kv2_escape(filename) + '"'
         original_framerate_str = str(original_framerate).rstrip('0').rstrip('.')
-        search_framerate = '"frameRate" "float" "' + original_framerate_str + '"'
         framerate_str = str(framerate).rstrip('0').rstrip('.')
-        original_id = self.default_presets[0].get("id", "")
-        search_id = '"activeClip" "element" "' + original_id + '"'
-
-        # "clipBin" "element_array" [] is how the clipBin is defined in default sessions
-        # This is not how SFM usually defines the clipBin, but it is formatted this way by hand in the default sessions dmx file
-        # Simply makes it easier to parse and modify here
-        search_clipbin = '"clipBin" "element_array" []'
-        id = ""
-        description = ""
-
-        # Find the ID and description for the original filename if it's a default preset
-        if is_default:
-            for default_preset in self.default_presets:
-                if default_preset.get("name", "") == original_filename:
-                    description = default_preset.get("description", "")
-                    id = default_preset.get("id", "")
-                    break
+        replacements['"frameRate" "float" "' + original_framerate_str + '"'] = '"frameRate" "float" "' + framerate_str + '"'
         try:
-            with open(dmx_path, "r") as f:
-                lines = f.readlines()
-            with open(dmx_path, "w") as f:
-                for line in lines:
-                    # Replace session name and framerate
-                    if search_filename in line:
-                        line = line.replace(original_filename, filename)
-                    elif search_framerate in line:
-                        line = line.replace(original_framerate_str, framerate_str)
-                    
-                    # Handle default session special cases
-                    elif is_default and self.default_session_title in line:
-                        line = line.replace(self.default_session_title, "session")
-                    elif is_default and search_id in line:
-                        line = line.replace(original_id, id)
-                    elif is_default and description in line:
-                        line = line.replace(description, "")
-                    elif is_default and search_clipbin in line:
-                        line = line.replace(" []", "\n\t[\n\t\t\"element\" \"" + id + "\"\n\t]")
-                    
-                    f.write(line)
+            size, seconds = _session_presets_patch_dmx(dmx_path, out_path or dmx_path, replacements)
+            _session_presets_msg("Patched %s: %.1f MB in %.3f seconds (%.1f MB/s)" % (out_path or dmx_path, size / 1048576.0, seconds, size / 1048576.0 / max(seconds, 0.000001)))
             return True
         except Exception as e:
             _session_presets_msg("Error modifying dmx file %s: %s" % (dmx_path, e))
         return False
-    def get_framerate_from_dmx(self, dmx_path):
-        # Read the dmx file line-by-line to find the framerate
+    def probe_dmx(self, dmx_path, fields=None):
+        # Read session metadata from a binary or keyvalues2 dmx file in a single streaming pass
+        # See _session_presets_probe_events for the available fields
         try:
-            with open(dmx_path, "r") as f:
-                lines = f.readlines()
-                for line in lines:
-                    line = line.strip()
-
-                    # This line indicates any element with the framerate attribute
-                    # Includes both clips and lights, but usually they are all set to the same framerate
-                    if '"frameRate" "float" "' in line:
-                        # Extract framerate
-                        parts = line.split('"')
-                        for i in range(len(parts)):
-                            if parts[i] == "float" and i + 2 < len(parts):
-                                framerate_str = parts[i + 2].strip()
-                                try:
-                                    # Make sure we found a valid float
-                                    framerate = float(framerate_str)
-
-                                    # Return the first valid framerate found
-                                    return framerate
-                                except ValueError:
-                                    _session_presets_msg("Invalid framerate value in dmx file %s: %s" % (dmx_path, framerate_str))
+            return _session_presets_probe_dmx(dmx_path, fields)
         except Exception as e:
             _session_presets_msg("Error reading dmx file %s: %s" % (dmx_path, e))
         return None
+    def get_preset_metadata(self, preset_path, validate=True, read=True):
+        # Cached metadata for a preset file, see SessionPresetsMetadataCache.get
+        if not preset_path or not self.metadata_cache:
+            return None
+        return self.metadata_cache.get(preset_path, validate, read)
+    def describe_preset_metadata(self, metadata):
+        # Short summary for the status bar and tooltips, e.g. "stage.bsp, 24 fps, 60 seconds"
+        if not metadata:
+            return ""
+        parts = []
+        if metadata.get("mapname"):
+            parts.append(os.path.basename(metadata["mapname"]))
+        if metadata.get("framerate"):
+            parts.append("%s fps" % str(round(metadata["framerate"], 3)).rstrip('0').rstrip('.'))
+        if metadata.get("duration"):
+            parts.append("%s seconds" % str(round(metadata["duration"], 2)).rstrip('0').rstrip('.'))
+        return ", ".join(parts)
+    def get_framerate_from_dmx(self, dmx_path):
+        # The first frameRate attribute in the document
+        # Includes both clips and lights, but usually they are all set to the same framerate
+        info = self.probe_dmx(dmx_path, ("framerate",))
+        if info:
+            return info["framerate"]
+        return None
     def get_name_from_dmx(self, dmx_path):
-        # Read the dmx file line-by-line to find the active clip name
-        try:
-            with open(dmx_path, "r") as f:
-                lines = f.readlines()
-                in_active_clip = False
-                clip_id = None
-                clip_name = None
-                for line in lines:
-                    line = line.strip()
-
-                    # This line indicates the start of the active clip attribute in the root document
-                    if not clip_name and not clip_id and '"activeClip" "element" "' in line:
-                        # Get the clip ID
-                        parts = line.split('"')
-                        for i in range(len(parts)):
-                            if parts[i] == "element" and i + 2 < len(parts):
-                                clip_id = parts[i + 2].strip()
-                    
-                    # Look for the active clip by its ID
-                    elif not clip_name and clip_id and '"id" "elementid" "' + clip_id + '"' in line:
-                        in_active_clip = True
-                    elif not clip_name and in_active_clip:
-                        if '}' in line:
-                            # End of activeClip
-                            in_active_clip = False
-                            clip_id = None
-                        elif '"name" "string" "' in line:
-                            # Extract clip name from this line
-                            parts = line.split('"')
-                            for i in range(len(parts)):
-                                if parts[i] == "string" and i + 2 < len(parts):
-                                    clip_name = parts[i + 2].strip()
-                                    in_active_clip = False
-                    
-                    # If we have found the clip name, return it
-                    if clip_name:
-                        return clip_name
-        except Exception as e:
-            _session_presets_msg("Error reading dmx file %s: %s" % (dmx_path, e))
+        # The name of the root document's active clip
+        # Follows the activeClip reference through the element index when the file has one, instead of scanning for it
+        index = SessionPresetsElementIndex(dmx_path)
+        if index.load():
+            try:
+                index.map_file()
+                clip_id = index.element_attribute(index.root, "activeClip")
+                if clip_id:
+                    return index.element_attribute(clip_id, "name")
+            except Exception as e:
+                _session_presets_msg("Error reading element index for %s: %s" % (dmx_path, e))
+            finally:
+                index.close()
+        info = self.probe_dmx(dmx_path, ("name",))
+        if info:
+            return info["name"]
         return None
     def disable_start_wizard_patch(self):
         # Apply a patch to prevent the startup wizard from appearing
@@ -418,32 +3830,51 @@ class SessionPresets:
         # Load options from file
         if os.path.isfile(options_path):
             try:
-                with open(options_path, "r") as f:
-                    data = json.load(f)
+                data = self.options_store.read()
                 options = data.get("options", {})
 
                 # User-settable options
                 self.autoload_preset = options.get("autoload_preset", "")
                 self.autoload_enabled = options.get("autoload_enabled", False)
                 self.autoload_preset_is_default = options.get("autoload_preset_is_default", False)
+                self.metadata_cache_hash = options.get("metadata_cache_hash", False)
+                self.converted_cache_budget_mb = options.get("converted_cache_budget_mb", 1024)
+                self.default_sessions_override = options.get("default_sessions_override", "")
+                self.import_workers = options.get("import_workers", 4)
+                self.probe_timeout = options.get("probe_timeout", 3.0)
+                self.trace_enabled = options.get("trace_enabled", True)
+                self.trace_max_kb = options.get("trace_max_kb", 1024)
+                self.profile_next_session = options.get("profile_next_session", False)
+                self.retime_keyframes = options.get("retime_keyframes", True)
+                self.preset_folders = options.get("preset_folders", [])
 
                 # Populate default presets and settings
                 self.default_session_framerate = data.get("default_session_framerate", 24.0)
                 self.default_session_title = data.get("default_session_title", "Default Startup Sessions")
+                self.default_sessions_path = data.get("default_sessions_path", "")
+                self.default_sessions_mtime = data.get("default_sessions_mtime", None)
+                self.preset_folder_skipped = data.get("preset_folder_skipped", {})
                 default_presets = data.get("default_presets", [])
                 if default_presets:
-                    self.default_presets = default_presets
+                    self.registry.set_defaults(default_presets)
 
                 # Populate custom presets
-                presets = data.get("presets", [])
-                for preset in presets:
-                    append_preset = {
+                presets = []
+                for preset in data.get("presets", []):
+                    custom_preset = {
                         "name": preset.get("name", ""),
                         "order": preset.get("order", 0),
                         "description": preset.get("description", ""),
-                        "path": preset.get("path", "")
+                        "path": preset.get("path", ""),
+                        "id": preset.get("id", "")
                     }
-                    self.presets.append(append_preset)
+                    if preset.get("folder", ""):
+                        # Found in a preset folder, with the size and mtime it was last read at
+                        custom_preset["folder"] = preset["folder"]
+                        custom_preset["size"] = preset.get("size", 0)
+                        custom_preset["mtime"] = preset.get("mtime", 0)
+                    presets.append(custom_preset)
+                self.registry.set_customs(presets)
                 _session_presets_msg("Loaded options from %s" % options_path)
             except Exception as e:
                 _session_presets_msg("Error loading options from %s: %s" % (options_path, e))
@@ -451,25 +3882,40 @@ class SessionPresets:
         # JSON file format
         # Saves the current options to the options file
         # This also populates default values if they do not exist in the current options file
-        options_path = os.path.join(self.cwd, self.options_file)
         data = {
             "options": {
                 "autoload_preset": self.autoload_preset,
                 "autoload_enabled": self.autoload_enabled,
-                "autoload_preset_is_default": self.autoload_preset_is_default
+                "autoload_preset_is_default": self.autoload_preset_is_default,
+                "metadata_cache_hash": self.metadata_cache_hash,
+                "converted_cache_budget_mb": self.converted_cache_budget_mb,
+                "default_sessions_override": self.default_sessions_override,
+                "import_workers": self.import_workers,
+                "probe_timeout": self.probe_timeout,
+                "trace_enabled": self.trace_enabled,
+                "trace_max_kb": self.trace_max_kb,
+                "profile_next_session": self.profile_next_session,
+                "retime_keyframes": self.retime_keyframes,
+                "preset_folders": self.preset_folders
             },
-            "default_presets": self.default_presets,
-            "presets": self.presets,
+            "default_presets": self.registry.defaults,
+            "presets": self.registry.customs,
             "default_session_framerate": self.default_session_framerate,
             "default_session_title": self.default_session_title,
+            "default_sessions_path": self.default_sessions_path,
+            "default_sessions_mtime": self.default_sessions_mtime,
+            "preset_folder_skipped": self.preset_folder_skipped,
             "version": _session_presets_version
         }
-        try:
-            with open(options_path, "w") as f:
-                json.dump(data, f, indent=4)
-            _session_presets_msg("Saved options to %s" % options_path)
-        except Exception as e:
-            _session_presets_msg("Error saving options to %s: %s" % (options_path, e))
+        # Written shortly after the last save, see SessionPresetsOptionsStore
+        self.options_store.save(data)
+        self.save_caches()
+    def save_caches(self):
+        # Write the metadata cache and the converted cache index if they changed, once per operation that used them
+        if self.metadata_cache:
+            self.metadata_cache.save()
+        if self.converted_cache:
+            self.converted_cache.save()
     def add_window_actions(self):
         # Adds a window action to File menu, taken from SFM Python Module Pack
         # https://steamcommunity.com/sharedfiles/filedetails/?id=562830725
@@ -499,192 +3945,365 @@ class SessionPresets:
 
         # Connect our new session menu to the New action
         new_action.triggered.connect(self.new_session_menu)
+    def find_default_sessions_dmx(self):
+        # Where default_startup_sessions.dmx is, remembered in the options file along with its modification time
+        # The remembered path is trusted until the file disappears or changes, so the game directory isn't searched every time
+        # Doesn't save the options itself as it runs on the prewarm thread, opening the default session saves them
+        # default_sessions_override skips the search entirely
+        if self.default_sessions_override:
+            if not os.path.isfile(self.default_sessions_override):
+                raise Exception("Default startup sessions override not found: %s" % self.default_sessions_override)
+            return self.default_sessions_override
+        if self.default_sessions_path:
+            try:
+                if os.stat(self.default_sessions_path).st_mtime == self.default_sessions_mtime:
+                    return self.default_sessions_path
+            except OSError:
+                pass
+            _session_presets_msg("Default startup sessions file moved or changed, searching again: %s" % self.default_sessions_path)
+        dmx_path = os.path.join(self.cwd, "workshop\\scripts\\default_startup_sessions.dmx")
+        
+        if not os.path.isfile(dmx_path):
+            # Possibly cloned git repository as a mod
+            dmx_path = os.path.join(self.cwd, "sfm_session_presets\\scripts\\default_startup_sessions.dmx")
+        if not os.path.isfile(dmx_path):
+            # Search each directory in cwd except known game directories
+            dmx_path = ""
+            ignore_dirs = [
+                "bin",
+                "hl2",
+                "left4dead2_movies",
+                "platform",
+                "sdktools",
+                "tf",
+                "tf_movies",
+                "workshop",
+                "dod",
+                "portal2",
+                "portal2_dlc1",
+                "portal2_dlc2",
+                "bladesymphony",
+                "blackmesa",
+                "left4dead2",
+                "left4dead2_dlc1",
+                "left4dead2_dlc2",
+                "dinodday",
+                "stanleyparable"
+            ]
+            for item in os.listdir(self.cwd):
+                item_path = os.path.join(self.cwd, item)
+                if os.path.isdir(item_path) and item.lower() not in ignore_dirs:
+                    scripts_path = os.path.join(item_path, "scripts", "default_startup_sessions.dmx")
+                    if os.path.isfile(scripts_path):
+                        dmx_path = scripts_path
+                        break
+            if not os.path.isfile(dmx_path):
+                raise Exception("Found a default startup sessions but could not read it: %s" % dmx_path)
+        if not os.path.isfile(dmx_path):
+            raise Exception("Could not search and find default startup sessions file.")
+        self.default_sessions_path = dmx_path
+        self.default_sessions_mtime = os.stat(dmx_path).st_mtime
+        return dmx_path
     def create_session(self, preset_index, framerate, filename, directory):
-        if sfmApp.HasDocument():
-            sfmApp.CloseDocument(forceSilent=False)
-        if sfmApp.HasDocument():
-            # User cancelled close (unsaved changes)
-            return False
+        with self.tracer.span("create_session", preset_index=preset_index, framerate=framerate):
+            with self.profile_session("create_session"):
+                with self.tracer.span("close_document"):
+                    if sfmApp.HasDocument():
+                        sfmApp.CloseDocument(forceSilent=False)
+                if sfmApp.HasDocument():
+                    # User cancelled close (unsaved changes)
+                    return False
+                try:
+                    prepared = self.prepare_session(preset_index, framerate, filename, directory)
+                    if prepared and self.open_prepared_session(prepared):
+                        return True
+                except Exception as e:
+                    traceback.print_exc()
+                    _session_presets_error_msg("Error creating session from preset, creating a blank session instead: %s" % e)
+                # Looks like we fell through - create a blank session as fallback
+                self.new_blank_session(framerate, filename, directory)
+                return True
+    def profile_session(self, name):
+        # Profile this session creation if profile_next_session is set, which is cleared so only one creation is profiled
+        if self.profile_next_session:
+            self.profile_next_session = False
+            self.tracer.profile_next = True
+            self.save_options()
+        return self.tracer.profile(name)
+    def prepare_session(self, preset_index, framerate, filename, directory):
+        # Write the new session's dmx file for a preset without touching SFM, so this can run on a worker thread
+        # Returns what open_prepared_session needs, or None if there is no preset to create the session from
+        # Also returns how long each stage took as [name, seconds] pairs in "timings"
+        with self.tracer.span("prepare_session", preset_index=preset_index):
+            try:
+                return self.write_session_file(preset_index, framerate, filename, directory)
+            finally:
+                self.save_caches()
+    def write_session_file(self, preset_index, framerate, filename, directory):
+        # See prepare_session, each stage is also recorded as a span under prepare_session
         _session_presets_msg("Creating session with preset index %d, framerate %f, filename %s, directory %s" % (preset_index, framerate, filename, directory))
         full_filename = directory + "/" + filename + ".dmx"
-        default_preset = False
+        timings = []
+        last_time = [time.time()]
+        def stage(name):
+            now = time.time()
+            timings.append([name, now - last_time[0]])
+            self.tracer.record(name, now - last_time[0])
+            last_time[0] = now
         preset_path = ""
-        print(preset_index)
         # Determine if preset_index is a default preset or custom preset
-        if preset_index >= 0:
-            if preset_index < len(self.default_presets):
-                default_preset = True
-                preset_path = self.default_presets[preset_index].get("name", "")
-            else:
-                # It's a custom preset - calculate the actual custom preset index
-                default_count = len(self.default_presets)
-                custom_index = preset_index - default_count - 1 # -1 for separator
-                if 0 <= custom_index < len(self.presets):
-                    preset = self.presets[custom_index]
-                    preset_path = preset.get("path", "")
-        try:
-            if default_preset:
-                dmx_path = os.path.join(self.cwd, "workshop\\scripts\\default_startup_sessions.dmx")
-                
-                if not os.path.isfile(dmx_path):
-                    # Possibly cloned git repository as a mod
-                    dmx_path = os.path.join(self.cwd, "sfm_session_presets\\scripts\\default_startup_sessions.dmx")
-                if not os.path.isfile(dmx_path):
-                    # Search each directory in cwd except known game directories
-                    dmx_path = ""
-                    ignore_dirs = [
-                        "bin",
-                        "hl2",
-                        "left4dead2_movies",
-                        "platform",
-                        "sdktools",
-                        "tf",
-                        "tf_movies",
-                        "workshop",
-                        "dod",
-                        "portal2",
-                        "portal2_dlc1",
-                        "portal2_dlc2",
-                        "bladesymphony",
-                        "blackmesa",
-                        "left4dead2",
-                        "left4dead2_dlc1",
-                        "left4dead2_dlc2",
-                        "dinodday",
-                        "stanleyparable"
-                    ]
-                    for item in os.listdir(self.cwd):
-                        item_path = os.path.join(self.cwd, item)
-                        if os.path.isdir(item_path) and item.lower() not in ignore_dirs:
-                            scripts_path = os.path.join(item_path, "scripts", "default_startup_sessions.dmx")
-                            if os.path.isfile(scripts_path):
-                                dmx_path = scripts_path
-                                break
-                    if not os.path.isfile(dmx_path):
-                        raise Exception("Found a default startup sessions but could not read it: %s" % dmx_path)
-                if not os.path.isfile(dmx_path):
-                    raise Exception("Could not search and find default startup sessions file.")
-                _session_presets_msg("Loading default startup sessions from %s" % dmx_path)
-
-                # copy the default startup sessions to the new location
-                shutil.copyfile(dmx_path, full_filename)
-                if not os.path.isfile(full_filename):
-                    raise Exception("Failed to copy default startup sessions file to: %s" % full_filename)
-                if not self.replace_name_and_framerate_in_dmx(full_filename, preset_path, filename, self.default_session_framerate, framerate, True):
-                    raise Exception("Failed to modify copied default startup sessions file: %s" % dmx_path)
-                
-                # Load the copied default startup sessions file
-                sfmApp.OpenDocument(full_filename)
-                sfmApp.ProcessEvents()
-                os.remove(full_filename)
-                document = sfmApp.GetDocumentRoot()
-                if not document:
-                    raise Exception("Failed to open copied default startup sessions document.")
-                
-                # Since we're reading from the default sessions, let's update our local default_presets list to match any changes
-                # This allows the Workshop item to update the default presets without updating this script as well
-                defaults = getattr(document, "defaults", None)
-                ids = getattr(document, "ids", None)
-                if not defaults or not ids:
-                    raise Exception("Failed to find defaults in copied default startup sessions document.")
-                clips = []
-                defaults_array = defaults.GetValue()
-                ids_array = ids.GetValue()
-                count = defaults_array.Count()
-                activeclip = None # We're also looking for the desired default session here
-                for i in range(count):
-                    try:
-                        clip_element = defaults_array[i]
-                        name = clip_element.name.GetValue()
-                        id = ids_array[i]
-                        description = clip_element.text.GetValue()
-                        if name == filename:
-                            # Found the active clip, keep our current preset info as it was previously changed when copying
-                            clips.append({
-                                "name": self.default_presets[preset_index].get("name", ""),
-                                "description": self.default_presets[preset_index].get("description", ""),
-                                "id": id
-                            })
-                            activeclip = clip_element
-                        else:
-                            # Populate this clip info into our default presets
-                            clips.append({
-                                "name": name,
-                                "description": description,
-                                "id": id
-                            })
-                    except Exception as e:
-                        raise Exception("Error reading clip from defaults: %s" % e)
-                if not activeclip:
-                    raise Exception("Failed to find active clip in copied default startup sessions document.")
-
-                # Update our default_presets list
-                self.default_presets = clips
-
-                # Set this session's active clip to the one we just created
-                dm.SetUndoEnabled(False) # Making element changes...
-                document.activeClip = activeclip
-
-                # We can't add it to the clipBin without crashing SFM, instead we've done this in the dmx file modification
-                #document.clipBin.SetCount(1)
-                #document.clipBin[0] = activeclip
-
-                # Remove defaults and ids attributes to clean up what's left of the default sessions
-                document.RemoveAttribute("defaults")
-                document.RemoveAttribute("ids")
-
-                # Finished! Save what we've done and return
-                dm.SetUndoEnabled(True) # Done making element changes
-                self.save_options()
-                return True
-            elif preset_path:
-                # User selected a custom preset, let's find it
-                if not preset_path or not os.path.isfile(preset_path):
-                    raise Exception("Preset file not found: %s" % preset_path)
-                
-                # Convert the preset dmx file to keyvalues2 format so we can read it line-by-line
-                dmx_converted_path = self.convert_dmx_file(preset_path, full_filename)
-                if not dmx_converted_path:
-                    raise Exception("Failed to convert preset dmx file: %s" % preset_path)
-                
-                # Read the converted dmx file to get the session name and framerate
-                session_name = self.get_name_from_dmx(dmx_converted_path)
-                if session_name:
-                    session_name = session_name
-                framerate_in_dmx = self.get_framerate_from_dmx(dmx_converted_path)
-                if not framerate_in_dmx:
-                    framerate_in_dmx = self.default_session_framerate
-
-                # Set the desired name and framerate in the copied dmx file
-                if not self.replace_name_and_framerate_in_dmx(dmx_converted_path, session_name, filename, framerate_in_dmx, framerate, False):
-                    raise Exception("Failed to modify copied preset dmx file: %s" % dmx_converted_path)
-                
-                # Just in case, close any open document forcefully (we already asked the user to save unsaved changes above)
-                if sfmApp.HasDocument():
-                    sfmApp.CloseDocument()
+        preset, default_preset = self.registry.at(preset_index)
+        if preset is not None:
+            preset_path = preset.get("name" if default_preset else "path", "")
+        if default_preset:
+            with self.tracer.span("find_default_sessions_dmx"):
+                dmx_path = self.find_default_sessions_dmx()
+            _session_presets_msg("Loading default startup sessions from %s" % dmx_path)
+            stage("resolve")
 
-                # Open the modified preset dmx file as the new session
-                # This also causes the map to load if there is one set
-                sfmApp.OpenDocument(dmx_converted_path)
-                sfmApp.ProcessEvents()
+            # Extract only the chosen preset's elements, the other defaults are never loaded into SFM
+            # The new session's root gets this clip as its activeClip and clipBin, and no defaults or ids attributes
+            # The clip is renamed, the title and description cleared and the keys retimed on the way out, in the same pass
+            clip_id = preset.get("id", "")
+            source_framerate = self.default_session_framerate
+            retimed = self.retime_keyframes and framerate != source_framerate
+            strings = {self.default_session_title: "session"}
+            if preset.get("description", ""):
+                strings[preset["description"]] = ""
+            stats = {}
+            def transform(events):
+                events = _session_presets_rename_events(events, preset_path, filename, source_framerate, framerate, strings)
+                if retimed:
+                    events = _session_presets_retime_events(events, framerate, source_framerate, stats)
+                return events
+            start_time = time.time()
+            try:
+                extracted = _session_presets_extract_clip(dmx_path, full_filename, clip_id, transform=transform, typed=_session_presets_retime_typed if retimed else None)
+            except Exception as e:
+                if os.path.isfile(full_filename):
+                    os.remove(full_filename)
+                raise Exception("Failed to extract default session %s: %s" % (preset_path, e))
+            _session_presets_msg("Extracted %d of %d elements in %.3f seconds" % (extracted["extracted"], extracted["elements"], time.time() - start_time))
+            if retimed:
+                _session_presets_msg("Retimed to %s fps: %d keys in %d layers, %d merged" % (_session_presets_format_float(framerate), stats["keys"], stats["layers"], stats["dropped"]))
+            stage("extract")
 
-                # Delete this new session file
-                # If the user makes any changes, SFM will ask them to save it before closing
-                # This keeps behavior consistent with regular new session creation
-                os.remove(dmx_converted_path)
-                return True
-        except Exception as e:
-            _session_presets_msg("Error creating session from preset: %s" % e)
-            traceback.print_exc()
-        # Looks like we fell through - create a blank session as fallback
+            # Since we're reading from the default sessions, let's update our local default_presets list to match any changes
+            # This allows the Workshop item to update the default presets without updating this script as well
+            # Read from the defaults while extracting, as they're no longer part of the new session
+            clips = []
+            for default in extracted["defaults"]:
+                if default.get("name", "") == preset_path:
+                    # Found the chosen clip, keep our current preset info
+                    clips.append({
+                        "name": preset.get("name", ""),
+                        "description": preset.get("description", ""),
+                        "id": default.get("id", "")
+                    })
+                else:
+                    # Populate this clip info into our default presets
+                    clips.append(default)
+            if not clips:
+                raise Exception("Failed to find defaults in default startup sessions file.")
+            self.log_session_timings(timings)
+            return {
+                "path": full_filename,
+                "default_presets": clips,
+                "timings": timings
+            }
+        elif preset_path:
+            # User selected a custom preset, let's find it
+            if not preset_path or not os.path.isfile(preset_path):
+                raise Exception("Preset file not found: %s" % preset_path)
+            stage("resolve")
+
+            # Get the session name and framerate from the metadata cache if it's up to date
+            # Otherwise they're read from the start of the preset while writing the session
+            session_name = None
+            framerate_in_dmx = None
+            metadata = self.get_preset_metadata(preset_path, read=False)
+            if metadata:
+                session_name = metadata["name"] or ""
+                framerate_in_dmx = metadata["framerate"] or self.default_session_framerate
+            stage("metadata")
+
+            # Binary presets are read from the converted cache when they're in it, decoded as they're read otherwise
+            dmx_source_path = self.find_converted_preset(preset_path)
+            stage("convert")
+
+            # Write the new session with the desired name and framerate, retimed if needed, in a single pass
+            try:
+                streamed = self.stream_session(dmx_source_path, full_filename, filename, framerate, session_name, framerate_in_dmx)
+            except Exception as e:
+                header = _session_presets_dmx_header(preset_path)
+                if dmx_source_path != preset_path or not header or header[0] != "binary":
+                    raise Exception("Failed to write session from preset dmx file %s: %s" % (preset_path, e))
+                # Binary encodings the decoder can't read still go through dmxconvert
+                _session_presets_msg("Could not decode %s, converting it with dmxconvert: %s" % (preset_path, e))
+                # Without the converted cache the conversion goes to the temp directory, not next to the session
+                handle, temp_path = tempfile.mkstemp(prefix="session_presets_", suffix=".kv2")
+                os.close(handle)
+                try:
+                    converted_path = self.get_converted_preset(preset_path, temp_path)
+                except Exception as e:
+                    if os.path.isfile(temp_path):
+                        os.remove(temp_path)
+                    raise Exception("Failed to convert preset dmx file %s: %s" % (preset_path, e))
+                if converted_path != temp_path and os.path.isfile(temp_path):
+                    os.remove(temp_path)
+                if not converted_path:
+                    raise Exception("Failed to convert preset dmx file: %s" % preset_path)
+                try:
+                    streamed = self.stream_session(converted_path, full_filename, filename, framerate, session_name, framerate_in_dmx)
+                finally:
+                    if converted_path == temp_path and os.path.isfile(temp_path):
+                        os.remove(temp_path)
+            stage("write")
+            self.log_session_timings(timings)
+            return {
+                "path": full_filename,
+                "default_presets": None,
+                "timings": timings
+            }
+        return None
+    def log_session_timings(self, timings):
+        total = sum([seconds for name, seconds in timings])
+        _session_presets_msg("Prepared session in %.3f seconds (%s)" % (total, ", ".join(["%s %.3f" % (name, seconds) for name, seconds in timings])))
+    def dry_run_session(self, preset, framerate, filename, directory):
+        # Run everything create_session does up to opening the document, and keep the session file it would open
+        # preset is a default or custom preset name, or the path to a dmx file to use as a custom preset
+        # Nothing here needs SFM, so this works headless to test the pipeline or warm the caches
+        preset_index = self.find_preset_index(preset)
+        added_preset = None
+        if preset_index == -1 and os.path.isfile(preset):
+            added_preset = {
+                "name": os.path.splitext(os.path.basename(preset))[0],
+                "description": "",
+                "path": os.path.abspath(preset)
+            }
+            self.registry.add_custom(added_preset)
+            preset_index = self.registry.row_of_id(added_preset["id"])
+        if preset_index == -1:
+            raise Exception("Preset not found: %s" % preset)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        start_time = time.time()
+        try:
+            with self.tracer.span("dry_run", preset_index=preset_index, framerate=framerate):
+                with self.tracer.profile("dry_run"):
+                    prepared = self.prepare_session(preset_index, framerate, filename, directory)
+        finally:
+            if added_preset is not None:
+                self.registry.remove_custom(self.registry.positions[added_preset["id"]])
+        if not prepared:
+            raise Exception("Failed to prepare session from preset: %s" % preset)
+        if prepared["default_presets"] is not None:
+            self.registry.set_defaults(prepared["default_presets"])
+        return {
+            "preset": preset,
+            "preset_index": preset_index,
+            "framerate": framerate,
+            "path": os.path.abspath(prepared["path"]),
+            "size": os.path.getsize(prepared["path"]),
+            "timings": prepared["timings"],
+            "total": time.time() - start_time
+        }
+    def open_prepared_session(self, prepared):
+        # Open a session file written by prepare_session, must be called on the main thread
+        # Just in case, close any open document forcefully (we already asked the user to save unsaved changes)
         if sfmApp.HasDocument():
-            sfmApp.CloseDocument() # In case we have a lingering document still open
-        sfmApp.ProcessEvents()
-        sfmApp.NewDocument(full_filename, filename, framerate=framerate)
+            sfmApp.CloseDocument()
+
+        # Open the new session file
+        # This also causes the map to load if there is one set
+        with self.tracer.span("open_document"):
+            sfmApp.OpenDocument(prepared["path"])
+            sfmApp.ProcessEvents()
+
+        # Delete this new session file
+        # If the user makes any changes, SFM will ask them to save it before closing
+        # This keeps behavior consistent with regular new session creation
+        os.remove(prepared["path"])
+        if not sfmApp.GetDocumentRoot():
+            raise Exception("Failed to open new session document: %s" % prepared["path"])
+
+        if prepared["default_presets"] is not None:
+            # Update our default presets and save what we've done
+            self.registry.set_defaults(prepared["default_presets"])
+            with self.tracer.span("save_options"):
+                self.save_options()
         return True
+    def new_blank_session(self, framerate, filename, directory):
+        with self.tracer.span("new_blank_session"):
+            if sfmApp.HasDocument():
+                sfmApp.CloseDocument() # In case we have a lingering document still open
+            sfmApp.ProcessEvents()
+            sfmApp.NewDocument(directory + "/" + filename + ".dmx", filename, framerate=framerate)
+    def prewarm_session(self, preset_index, framerate, filename, directory):
+        # Start preparing a session on a worker thread and open it once SFM has finished starting up
+        # Used for autoload, so converting, extracting and patching the preset overlaps with SFM's own initialization
+        self.prewarm = SessionPresetsPrewarm(self.prepare_session, preset_index, framerate, filename, directory)
+        QtCore.QTimer.singleShot(0, self.open_prewarmed_session)
+    def open_prewarmed_session(self):
+        prewarm = self.prewarm
+        self.prewarm = None
+        if prewarm is None:
+            return
+        framerate, filename, directory = prewarm.args[1:]
+        with self.tracer.span("autoload", preset_index=prewarm.args[0], framerate=framerate):
+            with self.profile_session("autoload"):
+                try:
+                    with self.tracer.span("wait_prewarm"):
+                        prepared = prewarm.wait()
+                    if sfmApp.HasDocument():
+                        # Something else opened a document in the meantime (autosave recovery), leave it alone
+                        _session_presets_msg("Document already open, discarding prepared autoload session.")
+                        if prepared and os.path.isfile(prepared["path"]):
+                            os.remove(prepared["path"])
+                        return
+                    if prepared and self.open_prepared_session(prepared):
+                        return
+                except Exception as e:
+                    traceback.print_exc()
+                    _session_presets_error_msg("Error creating session from preset, creating a blank session instead: %s" % e)
+                self.new_blank_session(framerate, filename, directory)
+    def probe_files(self, paths, callback, parent):
+        # Check whether paths exist on worker threads, calling callback(path, exists) on the Qt thread as each check finishes
+        # exists is None when the check timed out, results stop being delivered once parent is destroyed
+        prober = SessionPresetsFileProber(self.probe_workers, self.probe_timeout)
+        for path in paths:
+            prober.probe(path)
+        timer = QtCore.QTimer(parent)
+        def update():
+            for path, exists in prober.poll():
+                callback(path, exists)
+            if not prober.busy():
+                timer.stop()
+        timer.timeout.connect(update)
+        timer.start(50)
+        return prober
     def new_session_menu(self, startupWizard=False):
+        # The dialog is built the first time it's needed and kept, reopening it only refreshes the presets, registry defaults and recent files
+        start_time = time.time()
         self.custom_framerate_checkbox_state = False
         self.changing_preset = False
+        startupWizard = bool(startupWizard)
+        new_session_dialog = self.new_session_dialogs.get(startupWizard)
+        cached = new_session_dialog is not None
+        if not cached:
+            new_session_dialog = self.build_new_session_dialog(startupWizard)
+            self.new_session_dialogs[startupWizard] = new_session_dialog
+        new_session_dialog["refresh"]()
+        def dialog_shown():
+            # First pass of the dialog's event loop, it's on screen by now
+            seconds = time.time() - start_time
+            self.tracer.record("new_session_dialog", seconds, cached=cached, startup_wizard=startupWizard)
+            _session_presets_msg("New session dialog shown in %.1f ms (%s)" % (seconds * 1000, "reused" if cached else "built"))
+        QtCore.QTimer.singleShot(0, dialog_shown)
+        return new_session_dialog["show"]()
+    def build_new_session_dialog(self, startupWizard):
+        # Builds the New Session dialog, returns its refresh function (update it for reopening), presets_changed function
+        # (rebuild the preset combo after presets changed underneath it) and show function (run it)
         # Create modal dialog
         dialog = QtGui.QDialog()
         dialog.setModal(True)
@@ -731,64 +4350,68 @@ class SessionPresets:
         # Preset combo box (populated with default presets, a separator if there are custom presets, and then custom presets)
         preset_combo = QtGui.QComboBox(group_box)
         preset_combo.setGeometry(363, 20, 227, 23)
+        preset_search = SessionPresetsSearchIndex(self.registry)
+        def preset_tooltip(preset):
+            # Tooltip from cached metadata only, presets aren't read while listing them
+            preset_path = preset.get("path", "")
+            summary = self.describe_preset_metadata(self.get_preset_metadata(preset_path, validate=False, read=False))
+            if summary:
+                return preset_path + "\n" + summary
+            return preset_path
+        def preset_combo_model(combo):
+            # Back a preset combo with a SessionPresetsListModel, shown in a list view that only lays out the rows on screen
+            model = SessionPresetsListModel(self.registry, preset_search, preset_tooltip, combo)
+            view = QtGui.QListView(combo)
+            view.setUniformItemSizes(True)
+            combo.setView(view)
+            combo.setModel(model)
+            combo.setMaxVisibleItems(20)
+            # Sizing the combo to its longest preset name would look at every row
+            combo.setSizeAdjustPolicy(QtGui.QComboBox.AdjustToMinimumContentsLength)
+            return model
+        preset_model = preset_combo_model(preset_combo)
+
+        # Search field under the preset combo, filters it by name and description as you type
+        preset_search_label = QtGui.QLabel("Search:", group_box)
+        preset_search_label.move(310-7, 81)
+        preset_search_edit = QtGui.QLineEdit(group_box)
+        preset_search_edit.setGeometry(363, 76, 227, 23)
+        preset_search_edit.setPlaceholderText("Filter presets")
 
-        self.custom_presets = []
         self.attempting_to_rebuild_preset_combo = False
-        def rebuild_preset_combo(combo, append):
-            combo.clear()
-            self.custom_presets = []
-            item_index = 0
-            # Add default presets
-            for preset in self.default_presets:
-                preset_name = preset.get("name", "")
-                item_index += 1
-                if self.autoload_preset_is_default and preset_name == self.autoload_preset:
-                    preset_name += append
-                combo.insertItem(item_index, preset_name)
-            # Add separator if there are custom presets
-            for preset in self.presets:
-                name = preset.get("name", "")
-                if name:
-                    self.custom_presets.append(name)
-            if self.custom_presets:
-                combo.insertSeparator(item_index)
-                item_index += 1
-                for preset in self.custom_presets:
-                    preset_name = preset
-                    item_index += 1
-                    if not self.autoload_preset_is_default and preset_name == self.autoload_preset:
-                        preset_name = preset_name + append
-                    combo.insertItem(item_index, preset_name)
-            # Set current index to autoload preset
-            default_count = len(self.default_presets)
-            preset_index = -1
-            if self.autoload_preset_is_default:
-                for i in range(len(self.default_presets)):
-                    if self.default_presets[i].get("name", "") == self.autoload_preset:
-                        preset_index = i
-                        break
-            else:
-                for i in range(len(self.presets)):
-                    if self.presets[i].get("name", "") == self.autoload_preset:
-                        preset_index = default_count + 1 + i # +1 for separator
-                        break
-            if preset_index != -1:
-                combo.setCurrentIndex(preset_index)
+        def preset_combo_signature():
+            # Everything the preset combo shows, it's only rebuilt on reopen if this changed
+            return (
+                self.autoload_preset,
+                self.autoload_preset_is_default,
+                self.registry.version
+            )
+        preset_signature = [None]
+        def rebuild_preset_combo(combo, model, append):
+            # The model shows one item per registry row, the separator is the row between default and custom presets
+            autoload_row = self.registry.row(self.autoload_preset, self.autoload_preset_is_default)
+            model.reset(autoload_row, append)
+            # Set current index to autoload preset, or the first match if the search filtered it out
+            if autoload_row != -1:
+                index = model.index_of(autoload_row)
+                if index == -1 and model.rowCount():
+                    index = 0
+                combo.setCurrentIndex(index)
             else:
                 # Not found, set to first default preset
                 _session_presets_msg("Autoload preset '%s' not found, defaulting to first default preset." % self.autoload_preset)
-                self.autoload_preset = self.default_presets[0].get("name", "")
+                self.autoload_preset = self.registry.defaults[0].get("name", "")
                 self.autoload_preset_is_default = True
                 self.save_options()
                 if not self.attempting_to_rebuild_preset_combo:
                     self.attempting_to_rebuild_preset_combo = True
-                    rebuild_preset_combo(preset_combo, " (default)")
+                    rebuild_preset_combo(combo, model, append)
                     self.attempting_to_rebuild_preset_combo = False
                 else:
                     _session_presets_error_msg("Failed to find autoload preset after rebuilding preset combo.")
-                    preset_combo.setEnabled(False)
+                    combo.setEnabled(False)
 
-        default_framerate_index = 7
+        default_framerate_index = [7]
         
         # Bottom button bar (PyCQEditorLowerBarWidget)
         lower_bar = PyCQEditorLowerBarWidget()
@@ -796,26 +4419,37 @@ class SessionPresets:
         #if startupWizard:
             #lower_bar.setVisible(False)
 
+        # Id of the selected preset, to select it again after presets are merged in from preset folders
+        selected_preset_id = [None]
         def preset_changed(index):
             self.changing_preset = True
             description = ""
             
-            # Check if it's a default preset (index < len(default_presets))
-            if index < len(self.default_presets):
-                description = self.default_presets[index].get("description", "")
-            elif self.custom_presets:
-                # It's a custom preset - calculate the actual custom preset index
-                default_count = len(self.default_presets)
-                custom_index = index - default_count - 1 # -1 for separator
-                
-                if 0 <= custom_index < len(self.presets):
-                    preset = self.presets[custom_index]
-                    description = preset.get("description", "")
+            preset, is_default = self.registry.at(preset_model.registry_row(index))
+            if preset is not None:
+                selected_preset_id[0] = preset.get("id", "")
+                description = preset.get("description", "")
+                if not is_default:
+                    # Show the preset's map, framerate and length, revalidated against the file if it changed
+                    summary = self.describe_preset_metadata(self.get_preset_metadata(preset.get("path", "")))
+                    if summary:
+                        description = description + " (" + summary + ")" if description else summary
             lower_bar.setStatusText(description)
             preset_combo.setToolTip(description)
             self.changing_preset = False
         preset_combo.currentIndexChanged.connect(preset_changed)
-        rebuild_preset_combo(preset_combo, " (default)")
+
+        def filter_presets(text):
+            # Narrow the preset combo down to the matching presets, the selected preset stays selected if it matches
+            selected_row = preset_model.registry_row(preset_combo.currentIndex())
+            preset_model.set_query(text)
+            index = preset_model.index_of(selected_row)
+            if index == -1 and preset_model.rowCount():
+                index = 0
+            preset_combo.setCurrentIndex(index)
+            preset_changed(index)
+            check_create_enabled()
+        preset_search_edit.textChanged.connect(filter_presets)
         
         # Browse button next to preset combo
         preset_edit_button = QtGui.QPushButton("Edit...", group_box)
@@ -856,7 +4490,7 @@ class SessionPresets:
         framerate_combo.insertItem(4, "3")
         framerate_combo.insertItem(5, "6")
         framerate_combo.insertItem(6, "12")
-        framerate_combo.insertItem(default_framerate_index, "24")
+        framerate_combo.insertItem(default_framerate_index[0], "24")
         framerate_combo.insertItem(8, "48")
         framerate_combo.insertItem(9, "72")
         framerate_combo.insertSeparator(10)
@@ -891,7 +4525,7 @@ class SessionPresets:
                     framerate_combo.setCurrentIndex(index)
                 else:
                     # Default to 24
-                    framerate_combo.setCurrentIndex(default_framerate_index)
+                    framerate_combo.setCurrentIndex(default_framerate_index[0])
             if not self.changing_preset:
                 self.custom_framerate_checkbox_state = checked
         custom_framerate_checkbox.toggled.connect(toggle_custom_framerate)
@@ -923,15 +4557,24 @@ class SessionPresets:
                         framerate_passed = True
                 except:
                     framerate_passed = False
-            if name and directory and framerate_passed:
+            # and a preset is selected, the search may have filtered out every preset
+            if name and directory and framerate_passed and preset_model.registry_row(preset_combo.currentIndex()) != -1:
                 create_button.setEnabled(True)
             else:
                 create_button.setEnabled(False)
             # filename in this directory must not already exist
+            # Checked against the directory snapshot, so typing doesn't hit the disk on every keystroke
             full_path = os.path.join(directory, name + ".dmx")
-            if os.path.isfile(full_path):
+            if self.directory_snapshot.exists(full_path):
                 create_button.setEnabled(False)
         
+        # List the directories again whenever the dialog comes back into focus, files may have been added or removed meanwhile
+        def dialog_activated():
+            self.directory_snapshot.refresh()
+            check_create_enabled()
+        activate_filter = SessionPresetsActivateFilter(dialog_activated, dialog)
+        dialog.installEventFilter(activate_filter)
+
         # Connect text change events
         name_edit.textChanged.connect(check_create_enabled)
         dir_edit.textChanged.connect(check_create_enabled)
@@ -954,7 +4597,7 @@ class SessionPresets:
 
         def open_preset_editor():
             # save current state so we can restore it if the user cancels
-            saved_presets = [preset.copy() for preset in self.presets]
+            saved_presets = [preset.copy() for preset in self.registry.customs]
             saved_autoload_preset = self.autoload_preset
             saved_autoload_preset_is_default = self.autoload_preset_is_default
             preset_editor = QtGui.QDialog(dialog)
@@ -989,69 +4632,46 @@ class SessionPresets:
             autoload_layout.addStretch()
             # Populate autoload combo
             self.reloading = False
-            rebuild_preset_combo(autoload_combo, append="")
+            autoload_model = preset_combo_model(autoload_combo)
+            rebuild_preset_combo(autoload_combo, autoload_model, append="")
             def autoload_changed(index):
                 if self.reloading:
                     return
-                self.custom_presets = []
-                for preset in self.presets:
-                    name = preset.get("name", "")
-                    if name:
-                        self.custom_presets.append(name)
-                if index < len(self.default_presets):
-                    # Default preset selected
-                    preset = self.default_presets[index]
+                preset, is_default = self.registry.at(index)
+                if preset is not None:
                     self.autoload_preset = preset.get("name", "")
-                    self.autoload_preset_is_default = True
-                elif self.custom_presets:
-                    # It's a custom preset - calculate the actual custom preset index
-                    default_count = len(self.default_presets)
-                    custom_index = index - default_count - 1 # -1 for separator
-                    if 0 <= custom_index < len(self.presets):
-                        preset = self.presets[custom_index]
-                        self.autoload_preset = preset.get("name", "")
-                        self.autoload_preset_is_default = False
+                    self.autoload_preset_is_default = is_default
             autoload_combo.currentIndexChanged.connect(autoload_changed)
             def find_autoload_index():
                 # Find the index of the current autoload preset in the combo
-                for i in range(autoload_combo.count()):
-                    item_text = autoload_combo.itemText(i)
-                    if item_text == self.autoload_preset:
-                        return i
+                row = self.registry.row(self.autoload_preset, self.autoload_preset_is_default)
+                if row != -1:
+                    return row
                 # Reset to first default preset if not found
                 _session_presets_msg("Autoload preset '%s' not found, resetting to first default preset." % self.autoload_preset)
-                self.autoload_preset = self.default_presets[0].get("name", "")
+                self.autoload_preset = self.registry.defaults[0].get("name", "")
                 self.autoload_preset_is_default = True
                 self.save_options()
-                return 1
+                return 0
             autoload_combo.setCurrentIndex(find_autoload_index())
             autoload_enabled_checkbox.stateChanged.connect(lambda state: setattr(self, 'setting_autoload_enabled', state == QtCore.Qt.Checked))
             # Custom preset table
-            preset_table = QtGui.QTableWidget()
-            preset_table.setColumnCount(4)
-            preset_table.setHorizontalHeaderLabels(["Order", "Name", "Path", "Description"])
-            preset_table.setColumnHidden(0, True)
-            preset_table.setColumnWidth(1, 128)
-            preset_table.setColumnWidth(2, 256)
+            preset_table = QtGui.QTableView()
+            def check_preset_paths(paths):
+                self.probe_files(paths, preset_table_model.path_checked, preset_editor)
+            def preset_renamed(old_name, new_name):
+                # If this is the current autoload preset, set autoload_preset to the new name
+                if not self.autoload_preset_is_default and old_name == self.autoload_preset:
+                    self.autoload_preset = new_name
+                refresh_autoload_combo()
+            preset_table_model = SessionPresetsTableModel(self.registry, check_preset_paths, preset_renamed, preset_editor)
+            preset_table.setModel(preset_table_model)
+            preset_table.setColumnWidth(0, 128)
+            preset_table.setColumnWidth(1, 256)
             preset_table.horizontalHeader().setStretchLastSection(True)
-            preset_table.sortItems(0, QtCore.Qt.AscendingOrder)
+            preset_table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+            preset_table.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
             preset_table.setEditTriggers(QtGui.QAbstractItemView.DoubleClicked | QtGui.QAbstractItemView.SelectedClicked)
-            # Populate table with current presets
-            preset_table.setRowCount(len(self.presets))
-            for row, preset in enumerate(self.presets):
-                order_item = QtGui.QTableWidgetItem(str(preset.get("order", row)))
-                name_item = QtGui.QTableWidgetItem(preset.get("name", ""))
-                description_item = QtGui.QTableWidgetItem(preset.get("description", ""))
-                preset_path = preset.get("path", "")
-                path_item = QtGui.QTableWidgetItem(preset_path)
-                # Set color of the text to red if the file does not exist
-                if not os.path.isfile(preset_path):
-                    path_item.setForeground(QtGui.QBrush(QtGui.QColor(255, 0, 0)))
-                path_item.setFlags(path_item.flags() ^ QtCore.Qt.ItemIsEditable)
-                preset_table.setItem(row, 0, order_item)
-                preset_table.setItem(row, 1, name_item)
-                preset_table.setItem(row, 2, path_item)
-                preset_table.setItem(row, 3, description_item)
             preset_editor_content_layout.addWidget(preset_table)
             # Add, Move Up, Move Down, Delete buttons
             preset_button_bar = QtGui.QWidget()
@@ -1059,38 +4679,29 @@ class SessionPresets:
             preset_button_bar_layout.addStretch()
             preset_button_bar_layout.setContentsMargins(0, 0, 0, 0)
             add_button = QtGui.QPushButton("Add")
+            add_folder_button = QtGui.QPushButton("Add Folder")
             move_up_button = QtGui.QPushButton("Move Up")
             move_down_button = QtGui.QPushButton("Move Down")
             delete_button = QtGui.QPushButton("Delete")
             preset_button_bar_layout.addWidget(add_button)
+            preset_button_bar_layout.addWidget(add_folder_button)
             preset_button_bar_layout.addWidget(move_up_button)
             preset_button_bar_layout.addWidget(move_down_button)
             preset_button_bar_layout.addWidget(delete_button)
             preset_editor_content_layout.addWidget(preset_button_bar)
-            def reload_presets():
-                self.presets = []
-                for row in range(preset_table.rowCount()):
-                    order_item = preset_table.item(row, 0)
-                    name_item = preset_table.item(row, 1)
-                    path_item = preset_table.item(row, 2)
-                    description_item = preset_table.item(row, 3)
-                    preset = {
-                        "order": int(order_item.text()) if order_item else row,
-                        "name": name_item.text() if name_item else "",
-                        "description": description_item.text() if description_item else "",
-                        "path": path_item.text() if path_item else ""
-                    }
-                    self.presets.append(preset)
-            def reload():
+            def refresh_autoload_combo():
                 self.reloading = True
-                reload_presets()
-                rebuild_preset_combo(autoload_combo, append="")
+                rebuild_preset_combo(autoload_combo, autoload_model, append="")
                 autoload_combo.setCurrentIndex(find_autoload_index())
                 self.reloading = False
+            def selected_rows():
+                rows = [index.row() for index in preset_table.selectionModel().selectedRows()]
+                if not rows and preset_table.currentIndex().isValid():
+                    rows = [preset_table.currentIndex().row()]
+                return rows
             # on double click of an item in the Path column, open file dialog to select new .dmx file
-            def edit_path_item(item):
-                if item.column() == 2:
-                    row = item.row()
+            def edit_path_item(index):
+                if preset_table_model.columns[index.column()] == "path":
                     file_dialog = QtGui.QFileDialog(preset_editor, "Select Preset Session", "", "SFM Session (*.dmx)")
                     file_dialog.setFileMode(QtGui.QFileDialog.ExistingFile)
                     # Default to the directory in dir_edit
@@ -1100,7 +4711,7 @@ class SessionPresets:
                     else:
                         file_dialog.setDirectory(self.cwd + r"\usermod\elements\sessions")
                     # If the column currently has a path, set that as the starting file
-                    current_path = item.text().strip()
+                    current_path = (preset_table_model.data(index, QtCore.Qt.DisplayRole) or "").strip()
                     if os.path.isfile(current_path):
                         file_dialog.setDirectory(os.path.dirname(current_path))
                         file_dialog.selectFile(current_path)
@@ -1113,30 +4724,70 @@ class SessionPresets:
                             if not os.path.isfile(file_path):
                                 _session_presets_error_msg("The selected file does not exist:\n%s" % file_path)
                                 return
-                            # Update item text
-                            item.setText(file_path)
-                            reload()
-            preset_table.itemDoubleClicked.connect(edit_path_item)
-            def item_changed(item):
-                # If this is the current autoload preset, set autoload_preset to the new name
-                if not self.autoload_preset_is_default:
-                    if item.column() == 1:
-                        new_preset_name = item.text()
-                        # Get old preset name based on order column
-                        order_item = preset_table.item(item.row(), 0)
-                        old_preset_name = ""
-                        if order_item:
-                            order = int(order_item.text())
-                            if 0 <= order < len(self.presets):
-                                old_preset_name = self.presets[order].get("name", "")
-                        if old_preset_name == self.autoload_preset:
-                            self.autoload_preset = new_preset_name
-                reload()
-            preset_table.itemChanged.connect(item_changed)
+                            preset_table_model.path_states[self.registry.path_key(file_path)] = True
+                            preset_table_model.setData(index, file_path, QtCore.Qt.EditRole)
+            preset_table.doubleClicked.connect(edit_path_item)
+            def import_presets(file_paths):
+                # Read the files on worker threads while showing progress, then add every imported preset at once
+                existing = set()
+                errors = []
+                paths = []
+                for file_path in file_paths:
+                    key = self.registry.path_key(file_path)
+                    if key in existing or self.registry.find_path(file_path) is not None:
+                        errors.append("%s: Already added" % file_path)
+                        continue
+                    existing.add(key)
+                    paths.append(file_path)
+                imported = []
+                if paths:
+                    start_time = time.time()
+                    importer = SessionPresetsImporter(self.import_preset, paths, self.import_workers)
+                    progress = QtGui.QProgressDialog("Importing presets...", "Cancel", 0, len(paths), preset_editor)
+                    progress.setWindowTitle(" ")
+                    progress.setWindowModality(QtCore.Qt.WindowModal)
+                    progress.setMinimumDuration(250)
+                    while not importer.wait(0.02):
+                        progress.setValue(importer.completed)
+                        progress.setLabelText("Importing presets... (%d of %d)" % (importer.completed, len(paths)))
+                        QtGui.QApplication.processEvents()
+                        if progress.wasCanceled():
+                            importer.cancel()
+                    progress.setValue(len(paths))
+                    progress.close()
+                    self.save_caches()
+                    for result in importer.results:
+                        if result is None:
+                            continue
+                        file_path, preset, error = result
+                        if error is not None:
+                            errors.append("%s: %s" % (file_path, error))
+                        else:
+                            imported.append(preset)
+                    _session_presets_msg("Imported %d of %d presets in %.3f seconds" % (len(imported), len(paths), time.time() - start_time))
+                if imported:
+                    # Imported files were just read, no need to check them again
+                    for preset in imported:
+                        preset_table_model.path_states[self.registry.path_key(preset["path"])] = True
+                    first = preset_table_model.insert_presets([{
+                        "order": len(self.registry.customs) + i,
+                        "name": preset["name"],
+                        "description": preset["description"],
+                        "path": preset["path"]
+                    } for i, preset in enumerate(imported)])
+                    preset_table.scrollTo(preset_table_model.index(first, 0))
+                    refresh_autoload_combo()
+                if errors:
+                    for error in errors:
+                        _session_presets_msg("Could not import preset %s" % error)
+                    shown = errors[:10]
+                    if len(errors) > len(shown):
+                        shown.append("...and %d more" % (len(errors) - len(shown)))
+                    _session_presets_error_msg("Some presets could not be imported:\n%s" % "\n".join(shown))
             def add_preset():
-                # File picker dialog to select a .dmx file
-                file_dialog = QtGui.QFileDialog(preset_editor, "Select Preset Session", "", "SFM Session (*.dmx)")
-                file_dialog.setFileMode(QtGui.QFileDialog.ExistingFile)
+                # File picker dialog to select one or more .dmx files
+                file_dialog = QtGui.QFileDialog(preset_editor, "Select Preset Sessions", "", "SFM Session (*.dmx)")
+                file_dialog.setFileMode(QtGui.QFileDialog.ExistingFiles)
                 # Default to the directory in dir_edit
                 start_dir = dir_edit.text().strip()
                 if os.path.isdir(start_dir):
@@ -1146,67 +4797,44 @@ class SessionPresets:
                 if file_dialog.exec_():
                     selected_files = file_dialog.selectedFiles()
                     if selected_files:
-                        file_path = selected_files[0]
-                        # Make sure we can access the file
-                        if not os.path.isfile(file_path):
-                            _session_presets_error_msg("The selected file does not exist:\n%s" % file_path)
-                            return
-                        # Try to get framerate from dmx file
-                        session_name = ""
-                        dmx_converted_path = self.convert_dmx_file(file_path, self.cwd + r"\_temp.dmx")
-                        if dmx_converted_path:
-                            session_name = self.get_name_from_dmx(dmx_converted_path)
-                            if session_name:
-                                session_name = session_name
-                            # Delete temporary converted file
-                            os.remove(dmx_converted_path)
-                        if session_name == "":
-                            # Convert file name to session name by removing extension, replacing underscores or dashes with spaces, and capitalizing words
-                            base_name = os.path.basename(file_path)
-                            name_without_ext = os.path.splitext(base_name)[0]
-                            session_name = name_without_ext.replace("_", " ").replace("-", " ").title()
-                        # Add new row to table
-                        row = preset_table.rowCount()
-                        preset_table.insertRow(row)
-                        order_item = QtGui.QTableWidgetItem(str(row))
-                        name_item = QtGui.QTableWidgetItem(session_name)
-                        description_item = QtGui.QTableWidgetItem("")
-                        path_item = QtGui.QTableWidgetItem(file_path)
-                        # Set color of the text to red if the file does not exist
-                        if not os.path.isfile(file_path):
-                            path_item.setForeground(QtGui.QBrush(QtGui.QColor(255, 0, 0)))
-                        path_item.setFlags(path_item.flags() ^ QtCore.Qt.ItemIsEditable)
-                        preset_table.setItem(row, 0, order_item)
-                        preset_table.setItem(row, 1, name_item)
-                        preset_table.setItem(row, 2, path_item)
-                        preset_table.setItem(row, 3, description_item)
-                        reload()
+                        import_presets(selected_files)
+            def add_preset_folder():
+                # Import every .dmx file in a directory and its subdirectories
+                start_dir = dir_edit.text().strip()
+                if not os.path.isdir(start_dir):
+                    start_dir = self.cwd + r"\usermod\elements\sessions"
+                directory = QtGui.QFileDialog.getExistingDirectory(preset_editor, "Select Preset Folder", start_dir)
+                if not directory:
+                    return
+                file_paths = []
+                for root, dirs, files in os.walk(directory):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith(".dmx"):
+                            file_paths.append(os.path.join(root, name))
+                if not file_paths:
+                    _session_presets_error_msg("No .dmx files found in:\n%s" % directory)
+                    return
+                import_presets(file_paths)
+            def move_preset(offset):
+                rows = selected_rows()
+                if rows:
+                    # Selected rows move as one, the selection moves with them
+                    moved = preset_table_model.move_rows(rows, offset)
+                    if moved != sorted(set(rows)):
+                        preset_table.scrollTo(preset_table_model.index(moved[0] if offset < 0 else moved[-1], 0))
+                        refresh_autoload_combo()
             def move_up_preset():
-                current_row = preset_table.currentRow()
-                if current_row > 0:
-                    preset_table.insertRow(current_row - 1)
-                    for col in range(preset_table.columnCount()):
-                        item = preset_table.takeItem(current_row + 1, col)
-                        preset_table.setItem(current_row - 1, col, item)
-                    preset_table.removeRow(current_row + 1)
-                    preset_table.setCurrentCell(current_row - 1, 0)
-                    reload()
+                move_preset(-1)
             def move_down_preset():
-                current_row = preset_table.currentRow()
-                if current_row < preset_table.rowCount() - 1 and current_row != -1:
-                    preset_table.insertRow(current_row + 2)
-                    for col in range(preset_table.columnCount()):
-                        item = preset_table.takeItem(current_row, col)
-                        preset_table.setItem(current_row + 2, col, item)
-                    preset_table.removeRow(current_row)
-                    preset_table.setCurrentCell(current_row + 1, 0)
-                    reload()
+                move_preset(1)
             def delete_preset():
-                current_row = preset_table.currentRow()
-                if current_row != -1:
-                    preset_table.removeRow(current_row)
-                    reload()
+                rows = selected_rows()
+                if rows:
+                    preset_table_model.remove_rows(rows)
+                    refresh_autoload_combo()
             add_button.clicked.connect(add_preset)
+            add_folder_button.clicked.connect(add_preset_folder)
             move_up_button.clicked.connect(move_up_preset)
             move_down_button.clicked.connect(move_down_preset)
             delete_button.clicked.connect(delete_preset)
@@ -1222,18 +4850,26 @@ class SessionPresets:
             preset_lower_bar.addButton(preset_create_button)
             preset_lower_bar.addButton(preset_cancel_button)
             preset_editor_layout.addWidget(preset_lower_bar)
-            result = preset_editor.exec_()
+            # Folder scans finishing now are merged once the editor is closed
+            self.editing_presets = True
+            try:
+                result = preset_editor.exec_()
+            finally:
+                self.editing_presets = False
             if result == QtGui.QDialog.Accepted:
-                # Reload presets after editing
-                reload_presets()
+                # Edits are already in the registry, only the saved order is left
+                for i, preset in enumerate(self.registry.customs):
+                    preset["order"] = i
                 self.autoload_enabled = self.setting_autoload_enabled
                 self.save_options()
-                rebuild_preset_combo(preset_combo, append=" (default)")
+                self.options_store.flush()
+                rebuild_preset_combo(preset_combo, preset_model, append=" (default)")
+                preset_signature[0] = preset_combo_signature()
                 preset_changed(preset_combo.currentIndex())
                 check_create_enabled()
             else:
                 # Restore saved presets
-                self.presets = saved_presets
+                self.registry.set_customs(saved_presets)
                 self.autoload_preset = saved_autoload_preset
                 self.autoload_preset_is_default = saved_autoload_preset_is_default
 
@@ -1243,57 +4879,41 @@ class SessionPresets:
         create_button.clicked.connect(dialog.accept)
         cancel_button.clicked.connect(dialog.reject)
 
-        # Populate fields from registry
-        reg_directory = self.get_registry_value("Directory")
-        if reg_directory is not None:
-            dir_edit.setText(reg_directory)
-                
-        reg_use_custom = self.get_registry_value("UseCustomFramerate")
-        if reg_use_custom == "1":
-            custom_framerate_checkbox.setChecked(True)
-            self.custom_framerate_checkbox_state = True
-        
-        reg_framerate = self.get_registry_value("Framerate")
-        if reg_framerate is not None:
-            framerate_value = float(reg_framerate)
-            framerate_edit.setValue(framerate_value)
-            framerate_parsed = str(round(framerate_value, 3)).rstrip('0').rstrip('.')
-            index = framerate_combo.findText(framerate_parsed)
-            if index == -1:
-                # Force showing custom framerate
-                custom_framerate_checkbox.setChecked(True)
-                framerate_edit.setVisible(True)
-                framerate_combo.setVisible(False)
-            else:
-                framerate_combo.setCurrentIndex(index)
-                default_framerate_index = index
-        
-        reg_name = self.get_registry_value("Name")
-        if reg_name is not None:
-            base_name = reg_name
-            # Ensure the name does not already exist in the selected directory
-            while os.path.exists(os.path.join(dir_edit.text(), base_name + ".dmx")):
-                # If the name ends in numbers, get the numbers and increment by 1
-                numbers = ""
-                for char in reversed(base_name):
-                    if char.isdigit():
-                        numbers = char + numbers
-                    else:
-                        break
-                if numbers:
-                    new_number = str(int(numbers) + 1)
-                    base_name = base_name[:-len(numbers)] + new_number
+        def refresh_registry_defaults():
+            # Populate fields from registry, fields that already match are left alone
+            reg_directory = self.get_registry_value("Directory")
+            if reg_directory is not None and dir_edit.text() != reg_directory:
+                dir_edit.setText(reg_directory)
+                    
+            reg_use_custom = self.get_registry_value("UseCustomFramerate")
+            custom_framerate_checkbox.setChecked(reg_use_custom == "1")
+            self.custom_framerate_checkbox_state = reg_use_custom == "1"
+            
+            reg_framerate = self.get_registry_value("Framerate")
+            if reg_framerate is not None:
+                framerate_value = float(reg_framerate)
+                framerate_edit.setValue(framerate_value)
+                framerate_parsed = str(round(framerate_value, 3)).rstrip('0').rstrip('.')
+                index = framerate_combo.findText(framerate_parsed)
+                if index == -1:
+                    # Force showing custom framerate
+                    custom_framerate_checkbox.setChecked(True)
+                    framerate_edit.setVisible(True)
+                    framerate_combo.setVisible(False)
                 else:
-                    # Append 1 to the name
-                    base_name = base_name + "1"
-            name_edit.setText(base_name)
+                    framerate_combo.setCurrentIndex(index)
+                    default_framerate_index[0] = index
+            
+            reg_name = self.get_registry_value("Name")
+            if reg_name is not None:
+                # Ensure the name does not already exist in the selected directory
+                base_name = self.directory_snapshot.unique_name(dir_edit.text(), reg_name)
+                if name_edit.text() != base_name:
+                    name_edit.setText(base_name)
         
         # Startup wizard options
+        refresh_recent_files = None
         if startupWizard:
-            recent_files = []
-            reg_recent_file_list = self.get_registry_value("recentFileList", path=r"Software\Valve\SourceFilmmaker\FileDialogs\SessionDocument")
-            if reg_recent_file_list and type(reg_recent_file_list) == list:
-                recent_files = reg_recent_file_list
             # Recent sessions group box
             recent_group_box = QtGui.QGroupBox(" Recent Session ", content_widget)
             recent_group_box.setFixedHeight(55)
@@ -1302,12 +4922,23 @@ class SessionPresets:
             recent_combo.setGeometry(10, 20, 666, 23)
             recent_open_button = QtGui.QPushButton("Open Recent", recent_group_box)
             recent_open_button.setGeometry(682, 20, 100, 23)
-            # Populate recent sessions
-            for recent_file in recent_files:
-                # Make sure file exists
-                if os.path.isfile(recent_file):
-                    recent_combo.addItem(recent_file)
-            # Add starter sessions
+            recent_listed = [None]
+            recent_count = [0]
+            def recent_file_checked(path, exists):
+                index = recent_combo.findData(path)
+                if index == -1:
+                    return
+                if exists:
+                    recent_combo.setItemText(index, path)
+                elif exists is None:
+                    recent_combo.setItemText(index, "%s (not responding)" % path)
+                else:
+                    recent_combo.removeItem(index)
+                    recent_count[0] -= 1
+                    if recent_count[0] == 0:
+                        # Remove the separator before the starter sessions
+                        recent_combo.removeItem(0)
+            # Starter sessions, listed after the recent sessions
             starter_sessions = [
                 {
                     "name": "Meet the Heavy",
@@ -1322,10 +4953,33 @@ class SessionPresets:
                     "file": "tf_movies\\elements\\sessions\\mtt_soldier\\mtt_soldier.dmx"
                 }
             ]
-            if recent_combo.count() > 0:
-                recent_combo.insertSeparator(recent_combo.count())
-            for session in starter_sessions:
-                recent_combo.addItem(session["name"])
+            def refresh_recent_files():
+                # Populate recent sessions, the combo is only rebuilt if SFM's recent file list changed
+                # Files are checked in the background so an offline share can't hold up the dialog, missing ones are removed once checked
+                recent_files = []
+                reg_recent_file_list = self.get_registry_value("recentFileList", path=r"Software\Valve\SourceFilmmaker\FileDialogs\SessionDocument")
+                if reg_recent_file_list and type(reg_recent_file_list) == list:
+                    recent_files = reg_recent_file_list
+                recent_checking = []
+                for recent_file in recent_files:
+                    if recent_file and recent_file not in recent_checking:
+                        recent_checking.append(recent_file)
+                if recent_checking != recent_listed[0]:
+                    recent_combo.clear()
+                    for recent_file in recent_checking:
+                        recent_combo.addItem("%s (checking...)" % recent_file, recent_file)
+                    recent_count[0] = len(recent_checking)
+                    if recent_combo.count() > 0:
+                        recent_combo.insertSeparator(recent_combo.count())
+                    # Add starter sessions
+                    for session in starter_sessions:
+                        recent_combo.addItem(session["name"])
+                    recent_listed[0] = recent_checking
+                else:
+                    # Same list as last time, check the files that are still listed again
+                    recent_checking = [recent_file for recent_file in recent_checking if recent_combo.findData(recent_file) != -1]
+                if recent_checking:
+                    self.probe_files(recent_checking, recent_file_checked, dialog)
             def open_recent_session():
                 selected_text = recent_combo.currentText()
                 if selected_text == "":
@@ -1339,7 +4993,8 @@ class SessionPresets:
                             dialog.done(QtGui.QDialog.Rejected)
                             return
                 # Otherwise, try to open the selected file
-                if self.open_session_file(selected_text):
+                recent_file = recent_combo.itemData(recent_combo.currentIndex())
+                if recent_file and self.open_session_file(recent_file):
                     # close dialog without creating new session
                     dialog.done(QtGui.QDialog.Rejected)
             recent_open_button.clicked.connect(open_recent_session)
@@ -1415,33 +5070,75 @@ class SessionPresets:
         main_layout.addWidget(content_widget)
         main_layout.addWidget(lower_bar)
 
-        # Connect create button
-        preset_changed(preset_combo.currentIndex())
-        check_create_enabled()
-        
-        # Show dialog
-        result = dialog.exec_()
-        if result == QtGui.QDialog.Accepted:
-            filename = name_edit.text()
-            preset_index = preset_combo.currentIndex()
-            directory = dir_edit.text()
-            framerate = 24.0
-            
-            if custom_framerate_checkbox.isChecked():
-                framerate = float(framerate_edit.value())
+        def refresh():
+            # A new dialog would start without a search
+            if preset_search_edit.text():
+                preset_search_edit.setText("")
+            signature = preset_combo_signature()
+            if signature != preset_signature[0]:
+                rebuild_preset_combo(preset_combo, preset_model, " (default)")
+                # Rebuilding may have reset the autoload preset
+                preset_signature[0] = preset_combo_signature()
+                # Index the presets for the search once the dialog is up, instead of on the first keystroke
+                QtCore.QTimer.singleShot(0, preset_search.update)
             else:
-                framerate = float(framerate_combo.currentText())
-            # make sure file does not already exist
-            full_filename = os.path.join(directory, filename + ".dmx")
-            if os.path.exists(full_filename):
-                return
-            if self.create_session(preset_index, framerate, filename, directory):
-                # Save values to registry
-                self.set_registry_value("Directory", directory)
-                self.set_registry_value("Name", filename)
-                self.set_registry_value("Framerate", str(round(framerate, 3)).rstrip('0').rstrip('.'))
-                self.set_registry_value("UseCustomFramerate", "1" if custom_framerate_checkbox.isChecked() else "0")
-        return result
+                # Reselect the default preset like a new dialog would
+                preset_index = preset_model.index_of(self.find_preset_index(self.autoload_preset, self.autoload_preset_is_default))
+                if preset_index != -1:
+                    preset_combo.setCurrentIndex(preset_index)
+            refresh_registry_defaults()
+            if refresh_recent_files:
+                refresh_recent_files()
+
+            # Connect create button
+            preset_changed(preset_combo.currentIndex())
+            check_create_enabled()
+        
+        def presets_changed():
+            # Presets were added or removed while the dialog may be open, the combo's rows are stale until it's rebuilt
+            selected_id = selected_preset_id[0]
+            rebuild_preset_combo(preset_combo, preset_model, " (default)")
+            preset_signature[0] = preset_combo_signature()
+            index = preset_model.index_of(self.registry.row_of_id(selected_id)) if selected_id else -1
+            if index != -1:
+                preset_combo.setCurrentIndex(index)
+            preset_changed(preset_combo.currentIndex())
+            check_create_enabled()
+
+        def show():
+            # Show dialog
+            result = dialog.exec_()
+            # Options changed while the dialog was open are written now, not when SFM exits
+            self.options_store.flush()
+            if result == QtGui.QDialog.Accepted:
+                filename = name_edit.text()
+                preset_index = preset_model.registry_row(preset_combo.currentIndex())
+                directory = dir_edit.text()
+                framerate = 24.0
+                
+                if custom_framerate_checkbox.isChecked():
+                    framerate = float(framerate_edit.value())
+                else:
+                    framerate = float(framerate_combo.currentText())
+                # make sure file does not already exist
+                full_filename = os.path.join(directory, filename + ".dmx")
+                if os.path.exists(full_filename):
+                    return
+                if self.create_session(preset_index, framerate, filename, directory):
+                    # Save values to registry
+                    self.set_registry_value("Directory", directory)
+                    self.set_registry_value("Name", filename)
+                    self.set_registry_value("Framerate", str(round(framerate, 3)).rstrip('0').rstrip('.'))
+                    self.set_registry_value("UseCustomFramerate", "1" if custom_framerate_checkbox.isChecked() else "0")
+                # Default presets updated by the new session
+                self.options_store.flush()
+            return result
+        return {
+            "dialog": dialog,
+            "refresh": refresh,
+            "presets_changed": presets_changed,
+            "show": show
+        }
     def open_session_file(self, file_path):
         if not os.path.isfile(file_path):
             _session_presets_error_msg("The selected session file does not exist:\n%s" % file_path)
@@ -1496,4 +5193,48 @@ def _SessionPresets_FirstBoot():
         traceback.print_exc()
         _session_presets_error_msg("Error: %s" % e)
 
-_SessionPresets_FirstBoot()
+def _session_presets_main(argv=None):
+    # Headless dry run, writes the session file create_session would open and prints how long each stage took
+    # e.g. python session_presets.py --cwd "C:\Program Files (x86)\Steam\steamapps\common\SourceFilmmaker\game" --preset "Dark Room"
+    import argparse
+    parser = argparse.ArgumentParser(description="Create a session file from a preset without SFM.")
+    parser.add_argument("--preset", default="Blank", help="default or custom preset name, or a dmx file to use as a custom preset")
+    parser.add_argument("--framerate", type=float, default=24.0, help="framerate of the new session")
+    parser.add_argument("--name", default="session", help="name of the new session, also used for its file name")
+    parser.add_argument("--directory", default=".", help="directory to write the new session to")
+    parser.add_argument("--cwd", default=None, help="SFM game directory with the options file and caches, defaults to the current directory")
+    parser.add_argument("--defaults", default=None, help="default_startup_sessions.dmx to use instead of searching for it")
+    parser.add_argument("--report", default=None, help="also write the timings to this JSON file")
+    parser.add_argument("--profile", action="store_true", help="write a cProfile and tracemalloc snapshot next to the trace file")
+    parser.add_argument("--summary", type=int, default=0, metavar="RUNS", help="print p50/p95/max of each phase over the last RUNS traced runs")
+    args = parser.parse_args(argv)
+    directory = os.path.abspath(args.directory)
+    report_path = os.path.abspath(args.report) if args.report else None
+    if args.cwd:
+        os.chdir(args.cwd)
+    session_presets = SessionPresets(headless=True)
+    if args.defaults:
+        session_presets.default_sessions_override = os.path.abspath(args.defaults)
+    session_presets.tracer.profile_next = args.profile
+    try:
+        report = session_presets.dry_run_session(args.preset, args.framerate, args.name, directory)
+    except Exception as e:
+        _session_presets_msg("Dry run failed: %s" % e)
+        return 1
+    finally:
+        session_presets.options_store.flush()
+    for name, seconds in report["timings"]:
+        sys.stdout.write("%-10s %9.3f s\n" % (name, seconds))
+    sys.stdout.write("%-10s %9.3f s\n" % ("total", report["total"]))
+    sys.stdout.write("%s (%d bytes)\n" % (report["path"], report["size"]))
+    if args.summary > 0:
+        session_presets.tracer.log_summary(args.summary)
+    if report_path:
+        with open(report_path, "w") as f:
+            f.write(json.dumps(report, indent=4))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_session_presets_main())
+elif not _session_presets_headless:
+    _SessionPresets_FirstBoot()
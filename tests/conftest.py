@@ -0,0 +1,85 @@
+# Loads session_presets.py with the benchmark stand-ins so the dmx functions can be tested outside of SFM
+
+import os, sys
+
+import pytest
+
+tests_directory = os.path.dirname(os.path.abspath(__file__))
+fixtures_directory = os.path.join(tests_directory, "fixtures")
+sys.path.insert(0, os.path.join(tests_directory, "..", "benchmarks"))
+sys.path.insert(0, fixtures_directory)
+
+import standins
+
+script_path = os.path.join(tests_directory, "..", "scripts", "sfm", "autoinit", "session_presets.py")
+
+@pytest.fixture(scope="session")
+def sp():
+    return standins.load(os.path.abspath(script_path))
+
+@pytest.fixture
+def presets(sp, tmp_path, monkeypatch):
+    # Headless SessionPresets keeping its options and caches in a temporary directory
+    monkeypatch.chdir(tmp_path)
+    return sp.SessionPresets(headless=True)
+
+@pytest.fixture
+def message_boxes(sp, monkeypatch):
+    # Every message box that would have been shown, with the thread it was shown from
+    shown = []
+    monkeypatch.setattr(sp, "_session_presets_msg_box", lambda msg, prefix, icon: shown.append((msg, sp.threading.current_thread().name)))
+    monkeypatch.setattr(sp, "_session_presets_error_msg", lambda msg: shown.append((msg, sp.threading.current_thread().name)))
+    return shown
+
+@pytest.fixture
+def fixture_path():
+    return lambda name: os.path.join(fixtures_directory, name)
+
+def write_kv2(sp, path, events):
+    # Write events out as a keyvalues2 file with the script's own writer
+    with sp._session_presets_open_dmx(path, "w") as f:
+        writer = sp._SessionPresetsKV2Writer(f.write)
+        for event in events:
+            writer.write_event(event)
+
+def session_events(name="session", framerate="24", layers=()):
+    # Events of a small session: a root with an inlined active clip named name at framerate
+    # Each layer is a list of times (strings) for a float log layer in the clip
+    events = [
+        ("header", "dmx encoding keyvalues2 1 format sfm_session 20"),
+        ("begin", "DmElement", None),
+        ("attribute", "id", "elementid", "00000000-0000-0000-0000-000000000001"),
+        ("attribute", "name", "string", name),
+        ("begin", "DmeFilmClip", "activeClip"),
+        ("attribute", "id", "elementid", "00000000-0000-0000-0000-000000000002"),
+        ("attribute", "name", "string", name),
+        ("attribute", "mapname", "string", "maps/stage.bsp"),
+        ("begin", "DmeTimeFrame", "timeFrame"),
+        ("attribute", "id", "elementid", "00000000-0000-0000-0000-000000000003"),
+        ("attribute", "start", "time", "0"),
+        ("attribute", "duration", "time", "10"),
+        ("attribute", "offset", "time", "0"),
+        ("attribute", "scale", "float", "1"),
+        ("end", "DmeTimeFrame"),
+        ("attribute", "frameRate", "float", framerate),
+        ("array_begin", "layers", "element_array"),
+    ]
+    for i, times in enumerate(layers):
+        events += [
+            ("begin", "DmeFloatLogLayer", None),
+            ("attribute", "id", "elementid", "00000000-0000-0000-0001-%012d" % i),
+            ("attribute", "name", "string", "layer %d" % i),
+            ("array", "times", "time_array", list(times)),
+            ("array", "values", "float_array", [str(j) for j in range(len(times))]),
+            ("array", "curvetypes", "int_array", []),
+            ("end", "DmeFloatLogLayer"),
+        ]
+    events += [
+        ("array_end", "layers"),
+        ("end", "DmeFilmClip"),
+        ("array_begin", "clipBin", "element_array"),
+        ("reference", "00000000-0000-0000-0000-000000000002"),
+        ("array_end", "clipBin"),
+        ("end", "DmElement"),
+    ]
+    return events
@@ -0,0 +1,194 @@
+# Writes session.dmx (keyvalues2) and session_binary1.dmx to session_binary5.dmx, the same session in binary encodings 1 to 5
+# Laid out the way dmxconvert writes them: string table (from encoding 2), element index, then the attributes of each element
+# The files are checked in, run this again only to change them: python tests/fixtures/make_binary_fixtures.py
+
+import os, struct, sys, uuid
+
+fixtures_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(fixtures_directory, "..", "..", "benchmarks"))
+
+import standins
+
+binary_types = ("element", "int", "float", "bool", "string", "binary", "time", "color", "vector2", "vector3", "vector4", "qangle", "quaternion", "matrix")
+value_formats = {"int": "i", "float": "f", "bool": "B", "time": "i", "color": "4B", "vector2": "2f", "vector3": "3f", "vector4": "4f", "qangle": "3f", "quaternion": "4f", "matrix": "16f"}
+
+root_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2d01"
+clip_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2d02"
+time_frame_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2d03"
+layer_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2d04"
+values_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2d05"
+external_id = "6b1c1d3a-0d53-4a33-9a4e-1f0a8b6c2dff"
+
+# Top-level elements in file order as (type, id, name, attributes), values formatted the way the binary reader formats them
+# Floats are single precision, "0.1000000015" is 0.1 stored as one. Times are ticks (1/10000 s) written with four decimals
+elements = [
+    ("DmElement", root_id, "Fixture \"Session\"", [
+        ("activeClip", "element", clip_id),
+        ("clipBin", "element_array", [clip_id]),
+        ("miscBin", "element_array", []),
+    ]),
+    ("DmeFilmClip", clip_id, "Fixture \"Session\"", [
+        ("timeFrame", "element", time_frame_id),
+        ("mapname", "string", "maps/stage.bsp"),
+        ("frameRate", "float", "30"),
+        ("layers", "element_array", [layer_id, "", external_id]),
+        ("values", "element", values_id),
+    ]),
+    ("DmeTimeFrame", time_frame_id, "timeFrame", [
+        ("start", "time", "0.0000"),
+        ("duration", "time", "12.5000"),
+        ("offset", "time", "-0.0417"),
+        ("scale", "float", "1"),
+    ]),
+    ("DmeFloatLogLayer", layer_id, "float log", [
+        ("times", "time_array", ["0.0000", "0.0333", "0.0334", "0.5000", "2.2999", "2.3000", "12.5000"]),
+        ("values", "float_array", ["0", "0.25", "0.25", "1", "-1.5", "0.1000000015", "3.75"]),
+        ("curvetypes", "int_array", []),
+    ]),
+    ("DmElement", values_id, "every type", [
+        ("int", "int", "-7"),
+        ("float", "float", "0.1000000015"),
+        ("bool", "bool", "1"),
+        ("string", "string", "quote \" backslash \\ tab \t end"),
+        ("binary", "binary", "DEADBEEF00"),
+        ("time", "time", "1.2345"),
+        ("color", "color", "255 128 0 255"),
+        ("vector2", "vector2", "1 -2"),
+        ("vector3", "vector3", "0.5 0.25 -0.125"),
+        ("vector4", "vector4", "1 2 3 4"),
+        ("qangle", "qangle", "90 -45 0"),
+        ("quaternion", "quaternion", "0 0 0 1"),
+        ("matrix", "matrix", "1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1"),
+        ("int_array", "int_array", ["1", "-2", "300000"]),
+        ("float_array", "float_array", ["0.5", "-0.75"]),
+        ("bool_array", "bool_array", ["0", "1", "1"]),
+        ("string_array", "string_array", ["a", "", "stage \"left\""]),
+        ("binary_array", "binary_array", ["00", "0102FF"]),
+        ("time_array", "time_array", ["-0.0001", "0.0000", "0.0001"]),
+        ("color_array", "color_array", ["0 0 0 0", "255 255 255 255"]),
+        ("vector2_array", "vector2_array", ["0 1"]),
+        ("vector3_array", "vector3_array", ["1 2 3", "-1 -2 -3"]),
+        ("vector4_array", "vector4_array", []),
+        ("qangle_array", "qangle_array", ["0 90 180"]),
+        ("quaternion_array", "quaternion_array", ["0 0 0 1", "0.5 0.5 0.5 0.5"]),
+        ("matrix_array", "matrix_array", ["1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1"]),
+    ]),
+]
+
+# Encodings 1 and 2 store object ids where later ones store times, their files have those attributes as object ids instead
+object_id = "0d6e9b1a-55e1-4c3e-8e36-7c2f0b4a9d10"
+
+def elements_for(version):
+    if version >= 3:
+        return elements
+    result = []
+    for element_type, element_id, name, attributes in elements:
+        attributes = [attribute for attribute in attributes if attribute[1] not in ("time", "time_array")]
+        if element_id == values_id:
+            attributes.append(("objectid", "objectid", object_id))
+        result.append((element_type, element_id, name, attributes))
+    return result
+
+def events_for(version):
+    # The keyvalues2 events the binary reader should yield for the file of this encoding
+    events = [("header", "dmx encoding %s format sfm_session 20" % ("binary %d" % version if version else "keyvalues2 1"))]
+    for element_type, element_id, name, attributes in elements_for(version or 5):
+        events.append(("begin", element_type, None))
+        events.append(("attribute", "id", "elementid", element_id))
+        events.append(("attribute", "name", "string", name))
+        for attribute_name, attribute_type, value in attributes:
+            if attribute_type == "element_array":
+                events.append(("array_begin", attribute_name, attribute_type))
+                for reference in value:
+                    events.append(("reference", reference))
+                events.append(("array_end", attribute_name))
+            elif attribute_type.endswith("_array"):
+                events.append(("array", attribute_name, attribute_type, list(value)))
+            else:
+                events.append(("attribute", attribute_name, attribute_type, value))
+        events.append(("end", element_type))
+    return events
+
+def pack_value(value_type, text):
+    if value_type == "time":
+        return struct.pack("<i", int(round(float(text) * 10000)))
+    if value_type == "objectid":
+        return uuid.UUID(text).bytes_le
+    item_format = value_formats[value_type]
+    convert = float if item_format[-1] == "f" else int
+    return struct.pack("<" + item_format, *[convert(item) for item in text.split()])
+
+def write_binary(path, version):
+    listed = elements_for(version)
+    indices = dict([(element[1], i) for i, element in enumerate(listed)])
+    strings = []
+    string_indices = {}
+    def symbol(text):
+        if text not in string_indices:
+            string_indices[text] = len(strings)
+            strings.append(text)
+        return struct.pack("<i" if version >= 5 else "<h", string_indices[text])
+    def cstring(text):
+        return text.encode("latin-1") + b"\0"
+    # Encoding 1 has no string table, symbols are written out in place
+    name_symbol = symbol if version >= 2 else cstring
+    def element_reference(element_id):
+        if not element_id:
+            return struct.pack("<i", -1)
+        if element_id in indices:
+            return struct.pack("<i", indices[element_id])
+        return struct.pack("<i", -2) + cstring(element_id)
+    def binary_value(text):
+        data = bytearray.fromhex(text)
+        return struct.pack("<i", len(data)) + bytes(data)
+    body = [struct.pack("<i", len(listed))]
+    for element_type, element_id, name, attributes in listed:
+        body.append(name_symbol(element_type))
+        body.append(name_symbol(name) if version >= 4 else cstring(name))
+        body.append(uuid.UUID(element_id).bytes_le)
+    for element_type, element_id, name, attributes in listed:
+        body.append(struct.pack("<i", len(attributes)))
+        for attribute_name, attribute_type, value in attributes:
+            body.append(name_symbol(attribute_name))
+            is_array = attribute_type.endswith("_array")
+            value_type = attribute_type[:-6] if is_array else attribute_type
+            type_id = binary_types.index("time" if value_type == "objectid" else value_type) + 1
+            body.append(struct.pack("<B", type_id + 14 if is_array else type_id))
+            if is_array:
+                body.append(struct.pack("<i", len(value)))
+                for item in value:
+                    if value_type == "element":
+                        body.append(element_reference(item))
+                    elif value_type == "string":
+                        body.append(cstring(item))
+                    elif value_type == "binary":
+                        body.append(binary_value(item))
+                    else:
+                        body.append(pack_value(value_type, item))
+            elif value_type == "element":
+                body.append(element_reference(value))
+            elif value_type == "string":
+                body.append(symbol(value) if version >= 4 else cstring(value))
+            elif value_type == "binary":
+                body.append(binary_value(value))
+            else:
+                body.append(pack_value(value_type, value))
+    with open(path, "wb") as f:
+        f.write(cstring("<!-- dmx encoding binary %d format sfm_session 20 -->\n" % version))
+        if version >= 2:
+            f.write(struct.pack("<i" if version >= 4 else "<h", len(strings)))
+            for text in strings:
+                f.write(cstring(text))
+        f.write(b"".join(body))
+
+def main():
+    module = standins.load(os.path.join(fixtures_directory, "..", "..", "scripts", "sfm", "autoinit", "session_presets.py"))
+    with module._session_presets_open_dmx(os.path.join(fixtures_directory, "session.dmx"), "w") as f:
+        writer = module._SessionPresetsKV2Writer(f.write)
+        for event in events_for(None):
+            writer.write_event(event)
+    for version in range(1, 6):
+        write_binary(os.path.join(fixtures_directory, "session_binary%d.dmx" % version), version)
+
+if __name__ == "__main__":
+    main()
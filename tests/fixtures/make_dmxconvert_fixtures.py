@@ -0,0 +1,41 @@
+# Writes binary fixtures with a real dmxconvert, so the binary reader is checked against Valve's writer and not only against
+# make_binary_fixtures.py. session.dmx is converted to dmxconvert/session_binary<N>.dmx (N is the encoding dmxconvert wrote),
+# then that file is converted back to keyvalues2 as dmxconvert/session_binary<N>.kv2.dmx: what dmxconvert itself read from it
+# SFM's dmxconvert writes encoding 5, the Source SDK's older dmxconvert builds write the older encodings. Run once per build:
+#   python tests/fixtures/make_dmxconvert_fixtures.py "path/to/SourceFilmmaker/game/bin/dmxconvert.exe"
+# The files are checked in, tests/test_dmxconvert_fixtures.py compares the reader against each pair it finds
+
+import os, re, subprocess, sys
+
+fixtures_directory = os.path.dirname(os.path.abspath(__file__))
+output_directory = os.path.join(fixtures_directory, "dmxconvert")
+
+def convert(dmxconvert, source, destination, encoding):
+    subprocess.check_call([dmxconvert, "-i", source, "-o", destination, "-oe", encoding])
+    if not os.path.isfile(destination):
+        raise Exception("dmxconvert didn't write %s" % destination)
+
+def main():
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: python %s path/to/dmxconvert.exe\n" % sys.argv[0])
+        return 2
+    dmxconvert = sys.argv[1]
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    temp_path = os.path.join(output_directory, "session_binary.tmp.dmx")
+    convert(dmxconvert, os.path.join(fixtures_directory, "session.dmx"), temp_path, "binary")
+    with open(temp_path, "rb") as f:
+        header = f.read(128)
+    match = re.match(br"<!-- dmx encoding binary (\d+) ", header)
+    if not match:
+        raise Exception("dmxconvert didn't write a binary dmx file: %r" % header[:64])
+    binary_path = os.path.join(output_directory, "session_binary%d.dmx" % int(match.group(1)))
+    if os.path.isfile(binary_path):
+        os.remove(binary_path)
+    os.rename(temp_path, binary_path)
+    convert(dmxconvert, binary_path, binary_path[:-len(".dmx")] + ".kv2.dmx", "keyvalues2")
+    print("Wrote %s and its keyvalues2 conversion" % binary_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import io
+
+import pytest
+
+from conftest import write_kv2
+from make_binary_fixtures import events_for
+
+versions = [1, 2, 3, 4, 5]
+
+def read_events(sp, path, **kwargs):
+    with open(path, "rb") as f:
+        return list(sp._session_presets_binary_dmx_events(f, **kwargs))
+
+def read_kv2_events(sp, path, **kwargs):
+    with sp._session_presets_open_dmx(path) as f:
+        return list(sp._session_presets_kv2_events(f, **kwargs))
+
+def normalized(events):
+    # Binary blobs are written across lines in keyvalues2, compare their hex digits only
+    result = []
+    for event in events:
+        if event[0] == "attribute" and event[2] == "binary":
+            event = event[:3] + ("".join(event[3].split()),)
+        elif event[0] == "array" and event[2] == "binary_array":
+            event = event[:3] + (["".join(value.split()) for value in event[3]],)
+        result.append(event)
+    return result
+
+def test_kv2_fixture(sp, fixture_path):
+    assert normalized(read_kv2_events(sp, fixture_path("session.dmx"))) == events_for(None)
+
+@pytest.mark.parametrize("version", versions)
+def test_binary_events(sp, fixture_path, version):
+    assert read_events(sp, fixture_path("session_binary%d.dmx" % version)) == events_for(version)
+
+@pytest.mark.parametrize("version", [3, 4, 5])
+def test_binary_matches_kv2(sp, fixture_path, version):
+    binary = read_events(sp, fixture_path("session_binary%d.dmx" % version))
+    kv2 = normalized(read_kv2_events(sp, fixture_path("session.dmx")))
+    assert binary[1:] == kv2[1:]
+
+@pytest.mark.parametrize("version", versions)
+def test_binary_small_chunks(sp, fixture_path, version):
+    # Values, strings and the string table cut across chunk boundaries
+    path = fixture_path("session_binary%d.dmx" % version)
+    expected = read_events(sp, path)
+    for chunk_size in (1, 7, 64):
+        assert read_events(sp, path, chunk_size=chunk_size) == expected
+
+@pytest.mark.parametrize("version", versions)
+def test_binary_skipped_attributes(sp, fixture_path, version):
+    expected = []
+    wanted = False
+    for event in events_for(version):
+        if event[0] in ("attribute", "array", "array_begin"):
+            wanted = event[1] in ("id", "name", "frameRate", "layers")
+        if event[0] in ("header", "begin", "end") or wanted:
+            expected.append(event)
+    assert read_events(sp, fixture_path("session_binary%d.dmx" % version), attributes=frozenset(["frameRate", "layers"])) == expected
+
+@pytest.mark.parametrize("version", versions)
+def test_replayed_skipped_attributes(sp, fixture_path, version):
+    # Skipping attributes seeks, both while the replay reader records and while it replays
+    path = fixture_path("session_binary%d.dmx" % version)
+    attributes = frozenset(["frameRate", "layers"])
+    expected = read_events(sp, path, attributes=attributes)
+    with open(path, "rb") as f:
+        reader = sp._SessionPresetsReplayReader(f, 1 << 20)
+        assert list(sp._session_presets_binary_dmx_events(reader, attributes=attributes, chunk_size=7)) == expected
+        reader.replay()
+        assert list(sp._session_presets_binary_dmx_events(reader, attributes=attributes, chunk_size=7)) == expected
+
+def test_replay_reader_seek(sp):
+    data = bytes(bytearray(range(100)))
+    reader = sp._SessionPresetsReplayReader(io.BytesIO(data), 1 << 20)
+    assert reader.read(10) == data[:10]
+    # Skipped bytes are kept for the replay
+    assert reader.seek(20, 1) == 30
+    assert reader.seek(40) == 40
+    assert reader.tell() == 40
+    with pytest.raises(ValueError):
+        reader.seek(10)
+    reader.replay()
+    assert reader.tell() == 0
+    assert reader.read(5) == data[:5]
+    assert reader.seek(30, 1) == 35
+    assert reader.read(3) == data[35:38]
+    # Past what's kept the file seeks
+    assert reader.seek(60) == 60
+    assert reader.read(5) == data[60:65]
+    assert reader.seek(10, 1) == 75
+    assert reader.read() == data[75:]
+
+def test_binary_object_ids(sp, fixture_path):
+    # Encodings before 3 have object ids instead of times
+    for version in (1, 2):
+        events = read_events(sp, fixture_path("session_binary%d.dmx" % version))
+        assert ("attribute", "objectid", "objectid", "0d6e9b1a-55e1-4c3e-8e36-7c2f0b4a9d10") in events
+        assert not [event for event in events if event[0] in ("attribute", "array") and event[2] in ("time", "time_array")]
+
+@pytest.mark.parametrize("version", [3, 4, 5])
+def test_binary_typed_arrays(sp, fixture_path, version):
+    typed = frozenset(sp._session_presets_typed_arrays)
+    binary = read_events(sp, fixture_path("session_binary%d.dmx" % version), typed=typed)
+    kv2 = read_kv2_events(sp, fixture_path("session.dmx"), typed=typed)
+    binary_arrays = [event for event in binary if event[0] == "array" and event[2] in typed]
+    kv2_arrays = [event for event in kv2 if event[0] == "array" and event[2] in typed]
+    assert [event[1:3] for event in binary_arrays] == [event[1:3] for event in kv2_arrays]
+    for binary_event, kv2_event in zip(binary_arrays, kv2_arrays):
+        assert isinstance(binary_event[3], sp._SessionPresetsTypedArray)
+        assert binary_event[3].values() == kv2_event[3].values()
+        assert list(binary_event[3].data) == pytest.approx(list(kv2_event[3].data), abs=1e-6)
+
+@pytest.mark.parametrize("version", versions)
+def test_binary_probe(sp, fixture_path, tmp_path, version):
+    if version >= 3:
+        kv2_path = fixture_path("session.dmx")
+    else:
+        # Compared against the same session with object ids instead of times
+        kv2_path = str(tmp_path / "session.dmx")
+        write_kv2(sp, kv2_path, events_for(None)[:1] + events_for(version)[1:])
+    binary = sp._session_presets_probe_dmx(fixture_path("session_binary%d.dmx" % version))
+    kv2 = sp._session_presets_probe_dmx(kv2_path)
+    assert binary["encoding"] == "binary"
+    assert kv2["encoding"] == "keyvalues2"
+    del binary["encoding"], kv2["encoding"]
+    assert binary == kv2
+    assert binary["name"] == 'Fixture "Session"'
+    assert binary["framerate"] == 30.0
+    assert binary["mapname"] == "maps/stage.bsp"
+    if version >= 3:
+        assert binary["time_frame"] == {"start": 0.0, "duration": 12.5, "offset": -0.0417, "scale": 1.0}
+
+@pytest.mark.parametrize("version", versions)
+def test_binary_probe_fields(sp, fixture_path, version):
+    info = sp._session_presets_probe_dmx(fixture_path("session_binary%d.dmx" % version), ("name", "framerate"))
+    assert (info["name"], info["framerate"]) == ('Fixture "Session"', 30.0)
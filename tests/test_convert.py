@@ -0,0 +1,123 @@
+import os, stat, sys
+
+import pytest
+
+from conftest import session_events, write_kv2
+
+# Stand-in for dmxconvert: copies the -i file to the -o file
+dmxconvert_source = """#!%s
+import shutil, sys
+args = sys.argv[1:]
+shutil.copyfile(args[args.index("-i") + 1], args[args.index("-o") + 1])
+"""
+
+@pytest.fixture
+def dmxconvert(presets, tmp_path):
+    directory = tmp_path / "bin & tools"
+    directory.mkdir()
+    path = directory / "dmx convert"
+    path.write_text(dmxconvert_source % sys.executable)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    presets.dmxConvert = str(path)
+    return str(path)
+
+@pytest.mark.skipif(os.name == "nt", reason="the stand-in dmxconvert is a script")
+def test_convert_paths_with_spaces(sp, presets, dmxconvert, tmp_path):
+    directory = tmp_path / "My Presets $HOME; (copy)"
+    directory.mkdir()
+    source = str(directory / "binary preset.dmx")
+    write_kv2(sp, source, session_events("converted"))
+    # Only binary files are handed to dmxconvert, keyvalues2 ones are copied
+    with open(source, "rb") as f:
+        data = f.read()
+    with open(source, "wb") as f:
+        f.write(data.replace(b"keyvalues2 1", b"binary 5", 1))
+    out = str(directory / "converted 'out'.dmx")
+    assert presets.convert_dmx_file(source, out) == out
+    with open(out, "rb") as f:
+        assert f.read() == data.replace(b"keyvalues2 1", b"binary 5", 1)
+
+def test_converted_cache_hits_save_once(sp, tmp_path):
+    cache = sp.SessionPresetsConvertedCache(str(tmp_path / "converted"), 1 << 20)
+    source = str(tmp_path / "preset.dmx")
+    write_kv2(sp, source, session_events())
+    def convert(path, out):
+        sp.shutil.copyfile(path, out)
+        return out
+    out = cache.get(source, "abc", convert)
+    assert not os.path.isfile(cache.index_path)
+    cache.save()
+    os.utime(cache.index_path, ns=(0, 0))
+    for i in range(3):
+        assert cache.lookup("abc") == out
+    # Hits are only written with the next save
+    assert os.stat(cache.index_path).st_mtime_ns == 0
+    cache.save()
+    assert os.stat(cache.index_path).st_mtime_ns != 0
+    reloaded = sp.SessionPresetsConvertedCache(str(tmp_path / "converted"), 1 << 20)
+    assert reloaded.hits == 3
+    assert reloaded.lookup("abc") == out
+
+def test_import_errors_are_returned(sp, presets, fixture_path, message_boxes):
+    importer = sp.SessionPresetsImporter(presets.import_preset, [fixture_path("session_binary5.dmx"), fixture_path("session.dmx")])
+    importer.wait()
+    binary, kv2 = importer.results
+    assert binary[1] is None and "dmxconvert executable not found" in str(binary[2])
+    assert kv2[1]["name"] == 'Fixture "Session"' and kv2[2] is None
+    assert message_boxes == []
+
+# Stand-in dmxconvert that writes a keyvalues2 session, for binary files the decoder can't read
+dmxconvert_kv2_source = """#!%s
+import shutil, sys
+args = sys.argv[1:]
+shutil.copyfile(%r, args[args.index("-o") + 1])
+"""
+
+@pytest.mark.skipif(os.name == "nt", reason="the stand-in dmxconvert is a script")
+def test_dmxconvert_fallback_without_cache(sp, presets, tmp_path, monkeypatch):
+    converted = str(tmp_path / "converted.dmx")
+    write_kv2(sp, converted, session_events("converted"))
+    script = tmp_path / "dmxconvert"
+    script.write_text(dmxconvert_kv2_source % (sys.executable, converted))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    presets.dmxConvert = str(script)
+    presets.converted_cache_budget_mb = 0
+    temp_directory = tmp_path / "temp"
+    temp_directory.mkdir()
+    monkeypatch.setattr(sp.tempfile, "tempdir", str(temp_directory))
+    # An encoding the decoder doesn't know
+    source = str(tmp_path / "preset.dmx")
+    with open(source, "wb") as f:
+        f.write(b"<!-- dmx encoding binary 99 format sfm_session 20 -->\n\x00\x01\x02")
+    directory = tmp_path / "sessions"
+    result = presets.dry_run_session(source, 24.0, "fallback", str(directory))
+    assert os.listdir(str(directory)) == ["fallback.dmx"]
+    assert os.listdir(str(temp_directory)) == []
+    with sp._session_presets_open_dmx(result["path"]) as f:
+        assert ("attribute", "name", "string", "fallback") in list(sp._session_presets_kv2_events(f))
+
+def test_converted_cache_adopts_files_missing_from_index(sp, tmp_path):
+    directory = str(tmp_path / "converted")
+    source = str(tmp_path / "preset.dmx")
+    write_kv2(sp, source, session_events())
+    size = os.path.getsize(source)
+    def convert(path, out):
+        sp.shutil.copyfile(path, out)
+        return out
+    cache = sp.SessionPresetsConvertedCache(directory, size * 3)
+    for i, key in enumerate(["aaa", "bbb", "ccc"]):
+        cache.get(source, key, convert)
+        os.utime(cache.entry_path(key), (1000 + i, 1000 + i))
+    cache.save()
+    # A torn index loads as empty
+    with open(cache.index_path, "w") as f:
+        f.write('{"entries": {"aa')
+    reloaded = sp.SessionPresetsConvertedCache(directory, size * 2)
+    # The conversions are still there, in the budget, oldest evicted first
+    assert sorted(reloaded.entries.keys()) == ["bbb", "ccc"]
+    assert not os.path.isfile(reloaded.entry_path("aaa"))
+    assert reloaded.lookup("ccc") == reloaded.entry_path("ccc")
+    reloaded.save()
+    with open(reloaded.index_path) as f:
+        assert sorted(sp.json.load(f)["entries"].keys()) == ["bbb", "ccc"]
+    assert sorted(os.listdir(directory)) == ["bbb.dmx", "ccc.dmx", "index.json"]
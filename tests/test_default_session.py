@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import write_kv2
+
+def defaults_events(presets):
+    # Laid out like default_startup_sessions.dmx: every default's clip inlined in the root's defaults, plus their ids
+    events = [
+        ("header", "dmx encoding keyvalues2 1 format sfm_session 20"),
+        ("begin", "DmElement", None),
+        ("attribute", "id", "elementid", "00000000-0000-0000-0000-000000000001"),
+        ("attribute", "name", "string", presets.default_session_title),
+        ("attribute", "activeClip", "element", presets.registry.defaults[0]["id"]),
+        ("array_begin", "clipBin", "element_array"),
+        ("array_end", "clipBin"),
+        ("array_begin", "defaults", "element_array"),
+    ]
+    for i, default in enumerate(presets.registry.defaults):
+        events += [
+            ("begin", "DmeFilmClip", None),
+            ("attribute", "id", "elementid", default["id"]),
+            ("attribute", "name", "string", default["name"]),
+            ("attribute", "text", "string", default["description"]),
+            ("attribute", "frameRate", "float", "24"),
+            ("begin", "DmeFloatLogLayer", "layer"),
+            ("attribute", "id", "elementid", "00000000-0000-0000-0001-%012d" % i),
+            ("attribute", "name", "string", "layer"),
+            ("array", "times", "time_array", ["0.0000", "0.0450", "0.0834", "1.0000"]),
+            ("array", "values", "float_array", ["0", "1", "2", "3"]),
+            ("end", "DmeFloatLogLayer"),
+            ("end", "DmeFilmClip"),
+        ]
+    events += [
+        ("array_end", "defaults"),
+        ("array", "ids", "string_array", [default["id"] for default in presets.registry.defaults]),
+        ("end", "DmElement"),
+    ]
+    return events
+
+@pytest.mark.parametrize("framerate", [24.0, 30.0])
+def test_default_session(sp, presets, tmp_path, framerate):
+    defaults_path = str(tmp_path / "default_startup_sessions.dmx")
+    write_kv2(sp, defaults_path, defaults_events(presets))
+    presets.default_sessions_override = defaults_path
+    default = presets.registry.at(2)[0]
+    prepared = presets.prepare_session(2, framerate, "my session", str(tmp_path))
+    assert [name for name, seconds in prepared["timings"]] == ["resolve", "extract"]
+    with sp._session_presets_open_dmx(prepared["path"]) as f:
+        events = list(sp._session_presets_kv2_events(f))
+    attributes = [event[1:] for event in events if event[0] == "attribute"]
+    assert ("name", "string", "session") in attributes
+    assert ("activeClip", "element", default["id"]) in attributes
+    assert ("name", "string", "my session") in attributes
+    assert ("text", "string", "") in attributes
+    assert ("frameRate", "float", sp._session_presets_format_float(framerate)) in attributes
+    # Only the chosen default was extracted, without the defaults and ids
+    assert [event[1] for event in events if event[0] == "begin"] == ["DmElement", "DmeFilmClip", "DmeFloatLogLayer"]
+    assert not [event for event in events if event[0] in ("array", "array_begin") and event[1] in ("defaults", "ids")]
+    times = [event[3] for event in events if event[0] == "array" and event[1] == "times"][0]
+    if framerate == 30.0:
+        # 0.0834 is a step edge a tick after frame 2, it stays a tick after that frame at 30 fps
+        assert times == ["0.0000", "0.0333", "0.1001", "1.0000"]
+    else:
+        assert times == ["0.0000", "0.0450", "0.0834", "1.0000"]
+    assert [default["name"] for default in prepared["default_presets"]] == [default["name"] for default in presets.registry.defaults]
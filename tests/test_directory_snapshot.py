@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+@pytest.fixture
+def clock(sp, monkeypatch):
+    # time.time() returns clock[0]
+    clock = [1000.0]
+    monkeypatch.setattr(sp.time, "time", lambda: clock[0])
+    return clock
+
+def touch(path):
+    open(path, "w").close()
+
+def test_listing_trusted_for_ttl(sp, clock, tmp_path):
+    directory = str(tmp_path)
+    touch(os.path.join(directory, "session.dmx"))
+    snapshot = sp.SessionPresetsDirectorySnapshot(ttl=5.0)
+    assert snapshot.exists(os.path.join(directory, "session.dmx"))
+    assert not snapshot.exists(os.path.join(directory, "session1.dmx"))
+    assert snapshot.scans == 1
+    # Files added within the ttl aren't seen, the directory isn't listed again
+    touch(os.path.join(directory, "session1.dmx"))
+    clock[0] += 5.0
+    assert not snapshot.exists(os.path.join(directory, "session1.dmx"))
+    assert snapshot.unique_name(directory, "session") == "session1"
+    assert snapshot.scans == 1
+    # Listed again once the ttl has passed
+    clock[0] += 0.1
+    assert snapshot.exists(os.path.join(directory, "session1.dmx"))
+    assert snapshot.unique_name(directory, "session") == "session2"
+    assert snapshot.scans == 2
+
+def test_refresh(sp, clock, tmp_path):
+    first = str(tmp_path / "first")
+    second = str(tmp_path / "second")
+    os.makedirs(first)
+    snapshot = sp.SessionPresetsDirectorySnapshot(ttl=5.0)
+    # A directory that doesn't exist yet is empty
+    assert snapshot.names(first) == set() and snapshot.names(second) == set()
+    assert snapshot.scans == 2
+    os.makedirs(second)
+    touch(os.path.join(first, "a.dmx"))
+    touch(os.path.join(second, "b.dmx"))
+    # Only the refreshed directory is listed again
+    snapshot.refresh(first)
+    assert snapshot.exists(os.path.join(first, "a.dmx"))
+    assert not snapshot.exists(os.path.join(second, "b.dmx"))
+    assert snapshot.scans == 3
+    snapshot.refresh()
+    assert snapshot.exists(os.path.join(second, "b.dmx"))
+    assert snapshot.scans == 4
+    # The same directory under another spelling shares the listing
+    assert snapshot.exists(os.path.join(second, ".", "b.dmx"))
+    assert snapshot.scans == 4
+
+def test_unique_name_increments_numbers(sp, clock, tmp_path):
+    directory = str(tmp_path)
+    for name in ("take9.dmx", "take10.dmx", "shot.dmx"):
+        touch(os.path.join(directory, name))
+    snapshot = sp.SessionPresetsDirectorySnapshot()
+    assert snapshot.unique_name(directory, "take9") == "take11"
+    assert snapshot.unique_name(directory, "shot") == "shot1"
+    assert snapshot.unique_name(directory, "new") == "new"
@@ -0,0 +1,91 @@
+# The binary reader against files written by a real dmxconvert, see tests/fixtures/make_dmxconvert_fixtures.py
+# Each binary file is compared with dmxconvert's own keyvalues2 conversion of it, element by element, so nesting and
+# float formatting differences between the two writers don't matter but every id, name, type and value does
+
+import os
+
+import pytest
+
+from conftest import fixtures_directory
+
+dmxconvert_directory = os.path.join(fixtures_directory, "dmxconvert")
+
+# Encodings that need a fixture: 5 is what SFM writes, 2 is the oldest with a string table
+required_versions = [2, 5]
+
+def fixture_versions():
+    versions = set(required_versions)
+    if os.path.isdir(dmxconvert_directory):
+        for name in os.listdir(dmxconvert_directory):
+            if name.startswith("session_binary") and name.endswith(".dmx") and not name.endswith(".kv2.dmx"):
+                versions.add(int(name[len("session_binary"):-len(".dmx")]))
+    return sorted(versions)
+
+def fixture_pair(version):
+    binary_path = os.path.join(dmxconvert_directory, "session_binary%d.dmx" % version)
+    kv2_path = os.path.join(dmxconvert_directory, "session_binary%d.kv2.dmx" % version)
+    if not os.path.isfile(binary_path) or not os.path.isfile(kv2_path):
+        pytest.skip("no dmxconvert fixture for binary encoding %d, write it with tests/fixtures/make_dmxconvert_fixtures.py" % version)
+    return binary_path, kv2_path
+
+def normalized_value(value_type, value):
+    if value_type in ("float", "time", "vector2", "vector3", "vector4", "qangle", "quaternion", "matrix", "color", "int", "bool"):
+        return tuple([round(float(token), 5) for token in value.split()])
+    if value_type == "binary":
+        return "".join(value.split()).upper()
+    return value
+
+def elements_of(events):
+    # Every element by id as (type, attributes), however the file nested them. Element attributes are ids
+    elements = {}
+    stack = []
+    for event in events:
+        kind = event[0]
+        if kind == "begin":
+            element = {"type": event[1], "attributes": {}, "array": None, "slot": None}
+            if stack:
+                parent = stack[-1]
+                element["slot"] = (parent, parent["array"] or event[2], parent["array"] is not None)
+            stack.append(element)
+        elif kind == "attribute":
+            element = stack[-1]
+            element["attributes"][event[1]] = (event[2], normalized_value(event[2], event[3]))
+            if event[1] == "id" and element["slot"] is not None:
+                parent, name, is_array = element["slot"]
+                if is_array:
+                    parent["attributes"][name][1].append(event[3])
+                else:
+                    parent["attributes"][name] = ("element", event[3])
+        elif kind == "array":
+            value_type = event[2][:-len("_array")]
+            stack[-1]["attributes"][event[1]] = (event[2], [normalized_value(value_type, value) for value in event[3]])
+        elif kind == "array_begin":
+            stack[-1]["attributes"][event[1]] = (event[2], [])
+            stack[-1]["array"] = event[1]
+        elif kind == "reference":
+            stack[-1]["attributes"][stack[-1]["array"]][1].append(event[1])
+        elif kind == "array_end":
+            stack[-1]["array"] = None
+        elif kind == "end":
+            element = stack.pop()
+            elements[element["attributes"]["id"][1]] = (element["type"], element["attributes"])
+    return elements
+
+@pytest.mark.parametrize("version", fixture_versions())
+def test_dmxconvert_binary_elements(sp, version):
+    binary_path, kv2_path = fixture_pair(version)
+    with open(binary_path, "rb") as f:
+        binary = elements_of(sp._session_presets_binary_dmx_events(f))
+    with sp._session_presets_open_dmx(kv2_path) as f:
+        kv2 = elements_of(sp._session_presets_kv2_events(f))
+    assert kv2 and sorted(binary.keys()) == sorted(kv2.keys())
+    for element_id in kv2:
+        assert binary[element_id] == kv2[element_id]
+
+@pytest.mark.parametrize("version", fixture_versions())
+def test_dmxconvert_binary_probe(sp, version):
+    binary_path, kv2_path = fixture_pair(version)
+    binary = sp._session_presets_probe_dmx(binary_path)
+    kv2 = sp._session_presets_probe_dmx(kv2_path)
+    assert (binary.pop("encoding"), kv2.pop("encoding")) == ("binary", "keyvalues2")
+    assert binary == kv2
@@ -0,0 +1,74 @@
+import os
+
+from conftest import session_events, write_kv2
+
+root_id = "00000000-0000-0000-0000-000000000001"
+clip_id = "00000000-0000-0000-0000-000000000002"
+time_frame_id = "00000000-0000-0000-0000-000000000003"
+layer_id = "00000000-0000-0000-0001-000000000000"
+
+def write_session(sp, path, name):
+    write_kv2(sp, path, session_events(name, layers=[["0.0000", "1.0000"]]))
+
+def test_byte_ranges(sp, tmp_path):
+    path = str(tmp_path / "session.dmx")
+    write_session(sp, path, "indexed")
+    with open(path, "rb") as f:
+        data = f.read()
+    with sp.SessionPresetsElementIndex(path) as index:
+        assert index.root == root_id
+        assert sorted(index.elements.keys()) == sorted([root_id, clip_id, time_frame_id, layer_id])
+        for element_id, element_type in ((root_id, "DmElement"), (clip_id, "DmeFilmClip"), (time_frame_id, "DmeTimeFrame"), (layer_id, "DmeFloatLogLayer")):
+            start, end = index.element_range(element_id)
+            assert index.element_type(element_id) == element_type
+            # Each range is the element's text from its type to its closing brace
+            text = index.element_text(element_id)
+            assert text == data[start:end].decode("utf-8")
+            assert text.startswith('"%s"' % element_type) and text.endswith("}")
+            assert next(iter(index.element_events(element_id))) == ("begin", element_type, None)
+        # Inline children lie inside their parent's range
+        clip_range = index.element_range(clip_id)
+        for child_id in (time_frame_id, layer_id):
+            child_range = index.element_range(child_id)
+            assert clip_range[0] < child_range[0] < child_range[1] < clip_range[1]
+        assert index.element_attribute(clip_id, "frameRate") == "24"
+        assert index.element_attribute(clip_id, "timeFrame") == time_frame_id
+        assert index.element_attribute(layer_id, "times") == ["0.0000", "1.0000"]
+        assert index.element_attribute(clip_id, "missing") is None
+        assert index.element_range("not an id") is None
+        assert sorted(index.get_references(clip_id)) == sorted([time_frame_id, layer_id])
+        assert index.get_referenced_by(clip_id) == [root_id, root_id]
+
+def test_rebuilt_when_the_file_changes(sp, tmp_path):
+    path = str(tmp_path / "session.dmx")
+    write_session(sp, path, "first")
+    with sp.SessionPresetsElementIndex(path) as index:
+        first_range = index.element_range(clip_id)
+    assert os.path.isfile(path + ".index")
+    # Unchanged, the persisted index is used as it is
+    index = sp.SessionPresetsElementIndex(path)
+    assert index.load()
+    assert index.element_range(clip_id) == first_range
+    # A different size
+    write_session(sp, path, "a longer name")
+    index = sp.SessionPresetsElementIndex(path)
+    assert not index.load()
+    with index:
+        assert index.element_range(clip_id) != first_range
+        assert index.element_attribute(clip_id, "name") == "a longer name"
+    assert sp.SessionPresetsElementIndex(path).load()
+    # The same size, written again
+    write_session(sp, path, "a longer nane")
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    index = sp.SessionPresetsElementIndex(path)
+    assert not index.load()
+    with index:
+        assert index.element_attribute(clip_id, "name") == "a longer nane"
+    # An index from another version isn't used
+    with open(path + ".index") as f:
+        data = sp.json.load(f)
+    data["version"] = sp.SessionPresetsElementIndex.version + 1
+    with open(path + ".index", "w") as f:
+        sp.json.dump(data, f)
+    assert not sp.SessionPresetsElementIndex(path).load()
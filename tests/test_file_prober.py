@@ -0,0 +1,53 @@
+import os, threading, time
+
+import pytest
+
+offline = os.path.join("offline", "share", "session.dmx")
+
+@pytest.fixture
+def share(sp, monkeypatch):
+    # Checking offline blocks until the share is set
+    share = threading.Event()
+    isfile = os.path.isfile
+    def blocking_isfile(path):
+        if path == offline:
+            share.wait(10)
+            return False
+        return isfile(path)
+    monkeypatch.setattr(sp.os.path, "isfile", blocking_isfile)
+    yield share
+    share.set()
+
+def poll_until(prober, count, timeout=5.0):
+    results = []
+    deadline = time.time() + timeout
+    while len(results) < count and time.time() < deadline:
+        results += prober.poll()
+        time.sleep(0.01)
+    return results
+
+def test_checks_report_existence(sp, tmp_path):
+    present = str(tmp_path / "present.dmx")
+    open(present, "w").close()
+    missing = str(tmp_path / "missing.dmx")
+    prober = sp.SessionPresetsFileProber(workers=2, timeout=5.0)
+    prober.probe(present)
+    prober.probe(missing)
+    assert sorted(poll_until(prober, 2)) == sorted([(present, True), (missing, False)])
+    assert not prober.busy()
+
+def test_timed_out_check_is_unknown(sp, share, tmp_path):
+    present = str(tmp_path / "present.dmx")
+    open(present, "w").close()
+    prober = sp.SessionPresetsFileProber(workers=1, timeout=0.05)
+    prober.probe(offline)
+    prober.probe(present)
+    # The stuck check is reported as unknown rather than missing, and doesn't hold up the rest
+    results = poll_until(prober, 2)
+    assert (offline, None) in results
+    assert (offline, False) not in results
+    assert (present, True) in results
+    assert not prober.busy()
+    # Its late result still comes through once the share answers
+    share.set()
+    assert poll_until(prober, 1) == [(offline, False)]
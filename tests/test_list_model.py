@@ -0,0 +1,97 @@
+import types
+
+import pytest
+
+class Signal(object):
+    def __init__(self, emitted, name):
+        self.emitted = emitted
+        self.name = name
+    def emit(self):
+        self.emitted.append(self.name)
+
+class Index(object):
+    def __init__(self, row=-1):
+        self._row = row
+    def row(self):
+        return self._row
+    def isValid(self):
+        return self._row != -1
+
+class QAbstractListModel(object):
+    # Just what SessionPresetsListModel calls on its base, persistent indexes are kept like Qt does
+    def __init__(self, parent=None):
+        self.emitted = []
+        self.persistent = []
+        self.layoutAboutToBeChanged = Signal(self.emitted, "layoutAboutToBeChanged")
+        self.layoutChanged = Signal(self.emitted, "layoutChanged")
+        self.beginResetModel = lambda: self.emitted.append("beginResetModel")
+        self.endResetModel = lambda: self.emitted.append("endResetModel")
+        self.persistentIndexList = lambda: list(self.persistent)
+        self.index = lambda row, column: Index(row)
+        self.changePersistentIndex = lambda old, new: self.persistent.__setitem__(self.persistent.index(old), new)
+
+@pytest.fixture
+def qt(sp, monkeypatch):
+    # Single shot timers only run when the test says so
+    timers = []
+    monkeypatch.setattr(sp.QtCore, "QAbstractListModel", QAbstractListModel)
+    monkeypatch.setattr(sp.QtCore, "QModelIndex", Index, raising=False)
+    monkeypatch.setattr(sp.QtCore, "Qt", types.SimpleNamespace(DisplayRole=0, ToolTipRole=3, AccessibleDescriptionRole=12, NoItemFlags=0, ItemIsEnabled=32, ItemIsSelectable=1))
+    monkeypatch.setattr(sp.QtCore, "QTimer", types.SimpleNamespace(singleShot=lambda msec, callback: timers.append(callback)))
+    return timers
+
+@pytest.fixture
+def registry(sp):
+    defaults = [{"name": "Default %d" % i, "description": "", "id": "default-%d" % i} for i in range(2)]
+    customs = [{"name": "Custom %d" % i, "order": i, "description": "", "path": "custom%d.dmx" % i} for i in range(3)]
+    return sp.SessionPresetsRegistry(defaults, customs)
+
+def make_model(sp, registry):
+    model = sp.SessionPresetsListModel(registry, sp.SessionPresetsSearchIndex(registry), lambda preset: preset["path"])
+    model.reset()
+    return model
+
+def names(sp, model):
+    return [model.data(Index(row), sp.QtCore.Qt.DisplayRole) for row in range(model.rowCount())]
+
+def test_rows_past_the_registry(sp, qt, registry):
+    model = make_model(sp, registry)
+    registry.remove_customs(0, 3)
+    # Not updated yet, the rows that are gone show nothing instead of raising
+    assert model.rowCount() == 6
+    assert names(sp, model) == ["Default 0", "Default 1", None, None, None, None]
+    assert model.flags(Index(5)) == sp.QtCore.Qt.NoItemFlags
+    assert model.flags(Index(0)) == sp.QtCore.Qt.ItemIsEnabled | sp.QtCore.Qt.ItemIsSelectable
+    assert model.data(Index(99), sp.QtCore.Qt.DisplayRole) is None
+
+def test_registry_changes_update_the_layout_once(sp, qt, registry):
+    model = make_model(sp, registry)
+    del model.emitted[:]
+    for i in range(3):
+        registry.add_custom({"name": "Added %d" % i, "description": "", "path": "added%d.dmx" % i})
+    assert len(qt) == 1 and model.emitted == []
+    qt.pop()()
+    assert model.emitted == ["layoutAboutToBeChanged", "layoutChanged"]
+    assert names(sp, model) == ["Default 0", "Default 1", None, "Custom 0", "Custom 1", "Custom 2", "Added 0", "Added 1", "Added 2"]
+    # Already up to date after a reset
+    registry.add_custom({"name": "Added 3", "description": "", "path": "added3.dmx"})
+    model.reset()
+    del model.emitted[:]
+    qt.pop()()
+    assert model.emitted == []
+
+def test_persistent_indexes_follow_their_preset(sp, qt, registry):
+    model = make_model(sp, registry)
+    model.reset(autoload_row=4, append=" (default)")
+    model.persistent = [Index(4), Index(1), Index(5)]
+    registry.remove_custom(0)
+    registry.move_custom(0, 1)
+    qt.pop()()
+    # Custom 1 moved a row down, Default 1 stayed, Custom 2 moved up and its row is now the one with the autoload suffix
+    assert [index.row() for index in model.persistent] == [4, 1, 3]
+    assert model.autoload_row == 4
+    assert names(sp, model) == ["Default 0", "Default 1", None, "Custom 2", "Custom 1 (default)"]
+    registry.remove_customs(0, 2)
+    qt.pop()()
+    assert [index.row() for index in model.persistent] == [-1, 1, -1]
+    assert model.autoload_row == -1
@@ -0,0 +1,59 @@
+import json, os, threading
+
+import pytest
+
+from conftest import session_events, write_kv2
+
+@pytest.fixture
+def preset_files(sp, tmp_path):
+    paths = []
+    for i in range(20):
+        path = str(tmp_path / ("preset%d.dmx" % i))
+        write_kv2(sp, path, session_events("Preset %d" % i))
+        paths.append(path)
+    return paths
+
+def test_failed_save_keeps_the_old_cache(sp, tmp_path, preset_files, monkeypatch):
+    cache_path = str(tmp_path / "metadata.json")
+    cache = sp.SessionPresetsMetadataCache(cache_path)
+    cache.get(preset_files[0])
+    cache.save()
+    with open(cache_path) as f:
+        saved = f.read()
+    cache.get(preset_files[1])
+    def crash(source, destination):
+        raise OSError("disk full")
+    monkeypatch.setattr(sp, "_session_presets_replace_file", crash)
+    cache.save()
+    with open(cache_path) as f:
+        assert f.read() == saved
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+    assert cache.dirty
+    monkeypatch.undo()
+    cache.save()
+    reloaded = sp.SessionPresetsMetadataCache(cache_path)
+    assert reloaded.get(preset_files[1], validate=False)["name"] == "Preset 1"
+
+def test_save_while_presets_are_read(sp, tmp_path, preset_files):
+    # Like the importer pool reading presets while the Qt thread saves the cache
+    cache_path = str(tmp_path / "metadata.json")
+    cache = sp.SessionPresetsMetadataCache(cache_path, hash_contents=True)
+    errors = []
+    def read(paths):
+        try:
+            for path in paths:
+                cache.get(path)
+                cache.get_hash(path)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=read, args=(preset_files[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while any([thread.is_alive() for thread in threads]):
+        cache.save()
+    for thread in threads:
+        thread.join()
+    cache.save()
+    assert errors == []
+    with open(cache_path) as f:
+        assert len(json.load(f)["entries"]) == len(preset_files)
@@ -0,0 +1,71 @@
+import gc, json
+
+class FakeQTimer(object):
+    # Records what the store asks of a QTimer, firing is left to the test
+    timers = []
+    def __init__(self):
+        self.single_shot = False
+        self.interval = None
+        self.slots = []
+        FakeQTimer.timers.append(self)
+    def setSingleShot(self, single_shot):
+        self.single_shot = single_shot
+    @property
+    def timeout(self):
+        return self
+    def connect(self, slot):
+        self.slots.append(slot)
+    def start(self, interval):
+        self.interval = interval
+    def stop(self):
+        self.interval = None
+    def fire(self):
+        for slot in self.slots:
+            slot()
+
+def test_qt_store_writes_from_qtimer(sp, tmp_path, monkeypatch):
+    monkeypatch.setattr(sp.QtCore, "QTimer", FakeQTimer, raising=False)
+    FakeQTimer.timers = []
+    monkeypatch.setattr(sp.threading, "Timer", None)
+    path = str(tmp_path / "session_presets.json")
+    store = sp.SessionPresetsOptionsStore(path, qt=True)
+    store.save({"a": 1})
+    store.save({"a": 2})
+    assert len(FakeQTimer.timers) == 1
+    timer = FakeQTimer.timers[0]
+    assert timer.single_shot and timer.interval == 500
+    assert not (tmp_path / "session_presets.json").exists()
+    timer.fire()
+    with open(path) as f:
+        assert json.load(f) == {"a": 2}
+    assert store.timer is None and store.writes == 1
+
+def test_flush_stops_qtimer(sp, tmp_path, monkeypatch):
+    monkeypatch.setattr(sp.QtCore, "QTimer", FakeQTimer, raising=False)
+    FakeQTimer.timers = []
+    path = str(tmp_path / "session_presets.json")
+    store = sp.SessionPresetsOptionsStore(path, qt=True)
+    store.save({"a": 1})
+    # A dialog closing writes straight away
+    assert store.flush()
+    assert FakeQTimer.timers[0].interval is None
+    assert not store.flush()
+    with open(path) as f:
+        assert json.load(f) == {"a": 1}
+
+def test_dropped_stores_are_not_kept_for_exit(sp, tmp_path):
+    store = sp.SessionPresetsOptionsStore(str(tmp_path / "session_presets.json"), debounce=0)
+    assert store in sp._session_presets_option_stores
+    store.save({"a": 1})
+    del store
+    gc.collect()
+    assert not [store for store in sp._session_presets_option_stores if store.path == str(tmp_path / "session_presets.json")]
+
+def test_pending_options_are_written_at_exit(sp, tmp_path, monkeypatch):
+    monkeypatch.setattr(sp.QtCore, "QTimer", FakeQTimer, raising=False)
+    path = str(tmp_path / "session_presets.json")
+    store = sp.SessionPresetsOptionsStore(path, qt=True)
+    store.save({"a": 1})
+    sp._session_presets_flush_option_stores()
+    with open(path) as f:
+        assert json.load(f) == {"a": 1}
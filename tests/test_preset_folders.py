@@ -0,0 +1,23 @@
+import shutil
+
+from conftest import session_events, write_kv2
+
+def test_failing_folder_file_is_skipped(sp, presets, tmp_path, fixture_path, message_boxes):
+    folder = tmp_path / "shared presets"
+    folder.mkdir()
+    write_kv2(sp, str(folder / "good.dmx"), session_events("Good Preset"))
+    # Binary, so it's converted into the converted cache on import, and there's no dmxconvert to do it
+    shutil.copyfile(fixture_path("session_binary5.dmx"), str(folder / "binary.dmx"))
+    assert presets.converted_cache_budget_mb > 0
+    presets.preset_folders = [str(folder)]
+    presets.scan_preset_folders()
+    presets.folder_scan.wait()
+    assert presets.merge_preset_folders()
+    assert [preset["name"] for preset in presets.registry.customs] == ["Good Preset"]
+    assert list(presets.preset_folder_skipped.keys()) == [presets.registry.path_key(str(folder / "binary.dmx"))]
+    assert message_boxes == []
+    # Skipped files aren't read again until they change
+    presets.scan_preset_folders()
+    presets.folder_scan.wait()
+    assert not presets.merge_preset_folders()
+    assert len(presets.preset_folder_skipped) == 1
@@ -0,0 +1,64 @@
+import os, types
+
+import pytest
+
+import standins
+from conftest import session_events, write_kv2
+
+@pytest.fixture
+def timers(sp, monkeypatch):
+    # Single shot timers only run when the test says so, no document is open to begin with
+    timers = []
+    monkeypatch.setattr(sp.QtCore, "QTimer", types.SimpleNamespace(singleShot=lambda msec, callback: timers.append(callback)))
+    sp.sfmApp.CloseDocument()
+    yield timers
+    sp.sfmApp.CloseDocument()
+
+@pytest.fixture
+def preset_index(sp, presets, tmp_path):
+    preset_path = str(tmp_path / "custom.dmx")
+    write_kv2(sp, preset_path, session_events("custom", layers=[["0.0000", "1.0000"]]))
+    preset = {"name": "Custom", "description": "", "path": preset_path}
+    presets.registry.add_custom(preset)
+    return presets.registry.row_of_id(preset["id"])
+
+def test_prewarmed_session_is_opened(sp, presets, timers, preset_index, tmp_path):
+    directory = str(tmp_path / "sessions")
+    os.makedirs(directory)
+    presets.prewarm_session(preset_index, 24.0, "prewarmed", directory)
+    prewarm = presets.prewarm
+    # Prepared on a worker thread, opened once the event loop runs
+    assert prewarm.thread.name == "SessionPresetsPrewarm"
+    assert prewarm.args == (preset_index, 24.0, "prewarmed", directory)
+    assert len(timers) == 1
+    timers.pop()()
+    assert presets.prewarm is None
+    assert prewarm.error is None
+    path = prewarm.result["path"]
+    assert standins._document.path == path
+    # SFM has the document, the prepared file isn't left behind
+    assert not os.path.isfile(path)
+    # Opening again does nothing
+    presets.open_prewarmed_session()
+    assert standins._document.path == path
+
+def test_prewarmed_session_left_alone_when_a_document_is_open(sp, presets, timers, preset_index, tmp_path):
+    directory = str(tmp_path / "sessions")
+    os.makedirs(directory)
+    presets.prewarm_session(preset_index, 24.0, "prewarmed", directory)
+    sp.sfmApp.NewDocument("autosave.dmx", "autosave")
+    timers.pop()()
+    assert standins._document.path == "autosave.dmx"
+    assert "[SESSION PRESETS] Document already open, discarding prepared autoload session.\n" in standins.messages
+    assert os.listdir(directory) == []
+
+def test_prewarm_failure_creates_a_blank_session(sp, presets, timers, message_boxes, tmp_path):
+    directory = str(tmp_path / "sessions")
+    def prepare_session(preset_index, framerate, filename, directory):
+        raise Exception("broken preset")
+    presets.prepare_session = prepare_session
+    presets.prewarm_session(0, 30.0, "blank", directory)
+    timers.pop()()
+    assert presets.prewarm is None
+    assert standins._document.path == directory + "/blank.dmx"
+    assert [msg for msg, thread in message_boxes] == ["Error creating session from preset, creating a blank session instead: broken preset"]
@@ -0,0 +1,84 @@
+import random
+
+def make_registry(sp, named):
+    # A custom preset for each item of named, named ones get a name
+    defaults = [{"name": "Default %d" % i, "description": "", "id": "default-%d" % i} for i in range(2)]
+    customs = [{"name": "Custom %d" % i if is_named else "", "description": "", "path": "custom%d.dmx" % i} for i, is_named in enumerate(named)]
+    return sp.SessionPresetsRegistry(defaults, customs)
+
+def assert_consistent(sp, registry):
+    # The lookups match those of a registry built from scratch with the same presets
+    fresh = sp.SessionPresetsRegistry(registry.defaults, [dict(preset) for preset in registry.customs])
+    assert [preset and preset["id"] for preset in registry.rows] == [preset and preset["id"] for preset in fresh.rows]
+    assert registry.positions == fresh.positions
+    assert registry.custom_rows == fresh.custom_rows
+    assert registry.named_before == fresh.named_before
+    # The order of ids in the name and path lookups doesn't matter, the first in order wins
+    for table, fresh_table in ((registry.custom_names, fresh.custom_names), (registry.paths, fresh.paths)):
+        assert dict((key, sorted(ids)) for key, ids in table.items()) == dict((key, sorted(ids)) for key, ids in fresh_table.items())
+    for preset in registry.customs:
+        assert registry.get(preset["id"]) is preset
+        row = registry.row_of_id(preset["id"])
+        if preset["name"]:
+            assert registry.at(row) == (preset, False)
+        else:
+            assert row == -1
+
+def test_ids_are_stable(sp):
+    registry = make_registry(sp, [True, True, False])
+    ids = [preset["id"] for preset in registry.customs]
+    assert len(set(ids)) == 3 and all(ids)
+    # Saved ids are kept when the presets are loaded again
+    saved = [dict(preset) for preset in registry.customs]
+    assert [preset["id"] for preset in sp.SessionPresetsRegistry([], saved).customs] == ids
+    # and follow their presets through changes
+    added = {"name": "Added", "description": "", "path": "added.dmx"}
+    registry.add_custom(added, 0)
+    registry.move_custom(0, 3)
+    registry.update_custom(1, {"name": "Renamed"})
+    registry.remove_custom(2)
+    assert [preset["id"] for preset in registry.customs] == [ids[0], ids[1], added["id"]]
+    assert registry.get(ids[2]) is None
+    assert registry.get(ids[1])["name"] == "Renamed"
+    assert registry.get("default-1") is registry.defaults[1]
+    assert_consistent(sp, registry)
+
+def test_move_custom(sp):
+    registry = make_registry(sp, [True, False, True, True, False, True])
+    ids = [preset["id"] for preset in registry.customs]
+    registry.move_custom(0, 3)
+    assert [preset["id"] for preset in registry.customs] == [ids[1], ids[2], ids[3], ids[0], ids[4], ids[5]]
+    assert [preset and preset["name"] for preset in registry.rows] == ["Default 0", "Default 1", None, "Custom 2", "Custom 3", "Custom 0", "Custom 5"]
+    assert registry.row("Custom 0") == 5
+    assert registry.find_path("custom0.dmx") is registry.customs[3]
+    assert_consistent(sp, registry)
+    # To and from the ends
+    registry.move_custom(5, 0)
+    assert_consistent(sp, registry)
+    registry.move_custom(0, 5)
+    assert_consistent(sp, registry)
+
+def test_reindex_after_random_changes(sp):
+    rng = random.Random(4)
+    registry = make_registry(sp, [rng.random() < 0.7 for i in range(12)])
+    versions = []
+    registry.listeners.append(lambda: versions.append(registry.version))
+    for step in range(300):
+        count = len(registry.customs)
+        action = rng.choice(["move", "move", "add", "remove", "rename", "unname"])
+        if action == "move" and count > 1:
+            registry.move_custom(rng.randrange(count), rng.randrange(count))
+        elif action == "add" or count < 2:
+            name = "Added %d" % step if rng.random() < 0.7 else ""
+            registry.add_custom({"name": name, "description": "", "path": "added%d.dmx" % step}, rng.randrange(count + 1))
+        elif action == "remove":
+            start = rng.randrange(count)
+            registry.remove_customs(start, min(count, start + rng.randrange(1, 3)))
+        elif action == "rename":
+            registry.update_custom(rng.randrange(count), {"name": "Renamed %d" % step})
+        else:
+            registry.update_custom(rng.randrange(count), {"name": ""})
+        assert_consistent(sp, registry)
+    # Every change told the listeners, with a new version each time
+    assert len(versions) >= 300
+    assert versions == sorted(set(versions))
@@ -0,0 +1,31 @@
+import pytest
+
+from conftest import session_events, write_kv2
+
+quoted_name = 'My "quoted" session \\ take 2'
+
+@pytest.mark.parametrize("framerate", [24.0, 30.0])
+def test_stream_session_renames_escaped_names(sp, tmp_path, framerate):
+    # 24 fps goes through the text patch, 30 fps through the retime events
+    source = str(tmp_path / "preset.dmx")
+    destination = str(tmp_path / "session.dmx")
+    write_kv2(sp, source, session_events(quoted_name, layers=[["0", "0.5"]]))
+    result = sp._session_presets_stream_session(source, destination, 'new "name"', framerate)
+    assert result["name"] == quoted_name
+    assert result["retimed"] == (framerate != 24.0)
+    info = sp._session_presets_probe_dmx(destination)
+    assert info["name"] == 'new "name"'
+    assert info["root_name"] == 'new "name"'
+    assert info["framerate"] == framerate
+    # And back again, from the escaped form the first pass wrote
+    sp._session_presets_stream_session(destination, source, quoted_name, 24.0)
+    assert sp._session_presets_probe_dmx(source)["name"] == quoted_name
+
+def test_replace_name_and_framerate_escaped(sp, presets, tmp_path):
+    source = str(tmp_path / "preset.dmx")
+    destination = str(tmp_path / "session.dmx")
+    write_kv2(sp, source, session_events(quoted_name))
+    assert presets.replace_name_and_framerate_in_dmx(source, quoted_name, 'back\\slash "quote"', 24.0, 30.0, destination)
+    info = sp._session_presets_probe_dmx(destination)
+    assert info["name"] == 'back\\slash "quote"'
+    assert info["framerate"] == 30.0
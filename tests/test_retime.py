@@ -0,0 +1,86 @@
+import array
+
+import pytest
+
+from conftest import session_events
+
+@pytest.fixture(params=["numpy", "array", "table"])
+def snap(sp, request, monkeypatch):
+    # Every path of _session_presets_snap_times: numpy and the array module for long arrays, the snap tables for short ones
+    if request.param == "numpy":
+        if sp.numpy is None:
+            pytest.skip("numpy isn't installed")
+    else:
+        monkeypatch.setattr(sp, "numpy", None)
+    if request.param != "table":
+        monkeypatch.setattr(sp, "_session_presets_snap_table_max_keys", 0)
+    else:
+        # Each test starts from empty tables
+        monkeypatch.setattr(sp, "_session_presets_snap_tables", {})
+    return sp._session_presets_snap_times
+
+def typed_times(sp, times):
+    return sp._SessionPresetsTypedArray("time_array", array.array("d", [float(value) for value in times]))
+
+@pytest.mark.parametrize("time_value, expected", [
+    # Frame 2 at 24 fps is frame 2.5 at 30 fps, rounded up to frame 3 (0.1000), edges keep their offset from it
+    ("0.0831", "0.0998"),
+    ("0.0832", "0.0999"),
+    ("0.0833", "0.1000"),
+    ("0.0834", "0.1001"),
+    ("0.0835", "0.1002"),
+    # Three ticks off isn't an edge, it's snapped to the nearest frame
+    ("0.0836", "0.1000"),
+    ("0.0830", "0.0667"),
+])
+def test_step_edges(sp, snap, time_value, expected):
+    assert snap([time_value], 30.0, 24.0) == ([expected], None)
+    snapped, keep = snap(typed_times(sp, [time_value]), 30.0, 24.0)
+    assert snapped.values() == [expected] and keep is None
+
+def test_step_edges_around_hold(sp, snap):
+    # A hold as SFM writes it, "1.9999" "2.0000" "2.0001" at 24 fps, survives going to 30 fps
+    assert snap(["0.0000", "1.9999", "2.0000", "2.0001", "2.5000"], 30.0, 24.0) == (["0.0000", "1.9999", "2.0000", "2.0001", "2.5000"], None)
+    # Without the source framerate the edges collide with their frame and are merged into it
+    assert snap(["0.0000", "1.9999", "2.0000", "2.0001", "2.5000"], 30.0) == (["0.0000", "2.0000", "2.5000"], [True, True, False, False, True])
+
+def test_colliding_keys_are_merged(sp, snap):
+    # Every other frame at 24 fps lands on the frame before it at 12 fps, 0.1700 snaps onto 0.1667
+    times = ["0.0000", "0.0417", "0.0833", "0.1250", "0.1667", "0.1700"]
+    expected = (["0.0000", "0.0833", "0.1667"], [True, True, False, True, False, False])
+    assert snap(times, 12.0, 24.0) == expected
+    snapped, keep = snap(typed_times(sp, times), 12.0, 24.0)
+    assert (snapped.values(), keep) == expected
+
+def test_keys_before_earlier_keys_are_dropped(sp, snap):
+    # Times have to increase, a key that snaps back before the latest kept key goes too
+    assert snap(["0.0000", "0.5000", "0.4999", "0.5400", "0.6000"], 12.0, 24.0) == (["0.0000", "0.5000", "0.5833"], [True, True, False, False, True])
+
+def test_negative_times(sp, snap):
+    assert snap(["-0.0833", "-0.0417", "0.0000"], 30.0, 24.0) == (["-0.0667", "-0.0333", "0.0000"], None)
+
+def test_merged_keys_drop_their_values(sp, snap):
+    events = session_events(layers=[["0.0000", "0.0417", "0.0833", "0.1250"]])
+    stats = {}
+    retimed = list(sp._session_presets_retime_events(iter(events), 12.0, 24.0, stats))
+    arrays = dict((event[1], event[3]) for event in retimed if event[0] == "array")
+    assert arrays["times"] == ["0.0000", "0.0833", "0.1667"]
+    assert arrays["values"] == ["0", "1", "3"]
+    assert stats == {"layers": 1, "keys": 4, "dropped": 1}
+    assert ("attribute", "frameRate", "float", "12") in retimed
+
+def test_snap_tables_match_bulk_snapping(sp, monkeypatch):
+    # Layers sharing their times go through the tables, and come out the same as snapped in bulk
+    times = ["%.4f" % (i / 24.0 + offset) for i in range(200) for offset in (-0.0001, 0, 0.0001, 0.0003)]
+    times.sort(key=float)
+    for source_framerate in (None, 24.0):
+        tabled = [sp._session_presets_snap_times(times, 30.0, source_framerate) for i in range(2)]
+        tabled_typed = sp._session_presets_snap_times(typed_times(sp, times), 30.0, source_framerate)
+        monkeypatch.setattr(sp, "_session_presets_snap_table_max_keys", 0)
+        for numpy in (sp.numpy, None):
+            monkeypatch.setattr(sp, "numpy", numpy)
+            bulk = sp._session_presets_snap_times(times, 30.0, source_framerate)
+            assert tabled[0] == tabled[1] == bulk
+            bulk_typed = sp._session_presets_snap_times(typed_times(sp, times), 30.0, source_framerate)
+            assert list(tabled_typed[0].data) == list(bulk_typed[0].data) and tabled_typed[1] == bulk_typed[1]
+        monkeypatch.undo()
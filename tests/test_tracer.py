@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+def test_span_nesting(sp, tmp_path):
+    tracer = sp.SessionPresetsTracer(str(tmp_path / "trace.jsonl"))
+    with tracer.span("startup", preset_index=2):
+        with tracer.span("load"):
+            with tracer.span("read"):
+                pass
+            tracer.record("timed_elsewhere", 0.25, cached=True)
+        # Nothing is written until the outermost span ends
+        assert tracer.read() == []
+        with pytest.raises(ValueError):
+            with tracer.span("fails"):
+                raise ValueError()
+    records = tracer.read()
+    # Written as each span ends, innermost first
+    assert [(record["name"], record["parent"]) for record in records] == [
+        ("read", "load"),
+        ("timed_elsewhere", "load"),
+        ("load", "startup"),
+        ("fails", "startup"),
+        ("startup", None),
+    ]
+    assert len(set(record["run"] for record in records)) == 1
+    assert records[-1]["preset_index"] == 2
+    assert records[1]["cached"] is True and records[1]["seconds"] == 0.25
+    assert records[3]["error"] == "ValueError"
+    assert "error" not in records[-1]
+    # Spans contain their children
+    read, timed, load, fails, startup = records
+    assert startup["start"] <= load["start"] <= read["start"]
+    assert load["seconds"] <= startup["seconds"]
+    # A new outermost span is a new run
+    with tracer.span("second"):
+        pass
+    assert tracer.read()[-1]["run"] != startup["run"]
+
+def test_spans_on_other_threads_are_their_own_runs(sp, tmp_path):
+    tracer = sp.SessionPresetsTracer(str(tmp_path / "trace.jsonl"))
+    with tracer.span("main"):
+        def work():
+            with tracer.span("worker"):
+                pass
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        # The worker's span isn't a child of main, it's written straight away
+        assert [(record["name"], record["parent"]) for record in tracer.read()] == [("worker", None)]
+    runs = [record["run"] for record in tracer.read()]
+    assert len(runs) == 2 and runs[0] != runs[1]
+
+def test_rotation(sp, tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    tracer = sp.SessionPresetsTracer(path, max_bytes=400, backups=2)
+    for i in range(40):
+        tracer.record("phase", 0.001, i=i)
+    # Every file stays under max_bytes, the oldest backups are dropped
+    for name in ("trace.jsonl", "trace.jsonl.1", "trace.jsonl.2"):
+        assert 0 < (tmp_path / name).stat().st_size <= 400
+    assert not (tmp_path / "trace.jsonl.3").exists()
+    numbers = [record["i"] for record in tracer.read()]
+    assert numbers == list(range(40 - len(numbers), 40))
+    assert len(numbers) < 40
+    # Without backups the trace starts over
+    path = str(tmp_path / "nobackups.jsonl")
+    tracer = sp.SessionPresetsTracer(path, max_bytes=400, backups=0)
+    for i in range(40):
+        tracer.record("phase", 0.001, i=i)
+    assert (tmp_path / "nobackups.jsonl").stat().st_size <= 400
+    assert not (tmp_path / "nobackups.jsonl.1").exists()
+    assert tracer.read()[-1]["i"] == 39
+
+def test_disabled_writes_nothing(sp, tmp_path):
+    tracer = sp.SessionPresetsTracer(str(tmp_path / "trace.jsonl"))
+    tracer.enabled = False
+    with tracer.span("startup"):
+        pass
+    assert not (tmp_path / "trace.jsonl").exists()